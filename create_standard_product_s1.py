@@ -13,108 +13,112 @@ import traceback
 import logging
 import hashlib
 import math
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from subprocess import (check_call,
                         CalledProcessError)
 from glob import glob
 from lxml.etree import parse
-import numpy as np
 from datetime import datetime
-from osgeo import (ogr,
-                   gdal)
-from isceobj.Image.Image import Image
 from topsApp_utils.UrlUtils import UrlUtils
-from topsApp_utils.imutils import (get_image,
-                                   get_size,
-                                   crop_mask)
+from topsApp_utils.context_checks import (POL_RE,
+                                          get_job_spec_id,
+                                          check_job_type,
+                                          load_job_config,
+                                          check_pipeline,
+                                          check_polarization,
+                                          get_input_metadata)
 from topsApp_utils.fetchCalES import fetch as fetch_aux_cal
-
-from topsApp_utils.sent1_bbox import get_envelope_from_all_slcs
+from topsApp_utils.geometry_cache import GeometryCache
+from topsApp_utils.burst_slc_cache import share_burst_slcs
+from topsApp_utils.stage_telemetry import StageTelemetry
+from topsApp_utils.stage_tracker import (StageTracker,
+                                         TOPSAPP_STEPS,
+                                         get_topsapp_resume_step)
+from topsApp_utils.slc_annotations import extract_annotations
 from topsApp_utils.time_utils import getTemporalSpanInDays
 from dateutil import parser
 from string import Template
-from iscesys.Component.ProductManager import ProductManager as PM
 from pathlib import Path
-import zipfile
-from elasticsearch import Elasticsearch
-from elasticsearch_dsl import Search, Q
 
-gdal.UseExceptions()  # make GDAL raise python exceptions
+# numpy, GDAL, ISCE and elasticsearch are imported in the functions
+# using them so that importing this module is cheap and has no side effects;
+# the job context and settings are read by `load_job_context`
 
 
 BASE_PATH = os.path.dirname(__file__)
 
 RESORB_RE = re.compile(r'_RESORB_')
 MISSION_RE = re.compile(r'^(S1\w)_')
-POL_RE = re.compile(r'^S1\w_IW_SLC._1S(\w{2})_')
 
-#  Read conf/settings.conf
-SETTINGS_DICT = UrlUtils()
-if 'ES_USERNAME' in SETTINGS_DICT:
-    ES_USERNAME = SETTINGS_DICT['ES_USERNAME']
-    ES_PASSWORD = SETTINGS_DICT['ES_PASSWORD']
-    HTTP_AUTH = (ES_USERNAME, ES_PASSWORD)
-else:
-    HTTP_AUTH = None
+# Log name
+# Note this actually reads the standard out so if you change the above
+# Make sure to change the `create_standard_product.sh`, too!
+LOG_NAME = 'standard_product_s1.log'
 
-dem_user = SETTINGS_DICT['ARIA_DEM_U']
-dem_pass = SETTINGS_DICT['ARIA_DEM_P']
+log_format = '[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s'
+logger = logging.getLogger('create_ifg')
 
-# topsApp Path in container
-TOPS_APP_PATH = os.environ['TOPSAPP']
 
-# Read Context File
-with open('_context.json') as file:
-    ctx = json.load(file)
+def load_job_context(context_file='_context.json'):
+    """
+    Read conf/settings.conf, the job context and the pipeline config into
+    the module globals used by the processing functions.
+    """
+    global SETTINGS_DICT, HTTP_AUTH, dem_user, dem_pass, TOPS_APP_PATH, ctx
+    global JOB_SPEC_ID, config_data, DATASET_KEY, ES_INDEX, JOB_NAME
+    global IFG_ID_SP_TMPL, MACHINE_TAGS, TEMPLATE_FILE
+
+    #  Read conf/settings.conf
+    SETTINGS_DICT = UrlUtils()
+    if 'ES_USERNAME' in SETTINGS_DICT:
+        ES_USERNAME = SETTINGS_DICT['ES_USERNAME']
+        ES_PASSWORD = SETTINGS_DICT['ES_PASSWORD']
+        HTTP_AUTH = (ES_USERNAME, ES_PASSWORD)
+    else:
+        HTTP_AUTH = None
 
-# The job_spec_id should match the `job-{string trailing job-spec json}`
-JOB_SPEC_ID, branch = ctx['job_specification']['id'].split(':')
-# Hysds append `job-` to id
-JOB_SPEC_ID = JOB_SPEC_ID.replace('job-', '')
+    dem_user = SETTINGS_DICT['ARIA_DEM_U']
+    dem_pass = SETTINGS_DICT['ARIA_DEM_P']
 
-ACCEPTED_JOB_TYPES = ['coseismic-s1gunw-topsapp',
-                      'standard-product-s1gunw-topsapp']
+    # topsApp Path in container
+    TOPS_APP_PATH = os.environ['TOPSAPP']
 
-# This will never happen because of job-spec and hysds-io setup.
-# Still it is instructive within PGE to illustrate we have two pipeliens
-if JOB_SPEC_ID not in ACCEPTED_JOB_TYPES:
-    job_types_str = ', '.join(ACCEPTED_JOB_TYPES)
-    raise ValueError(f'Job type {JOB_SPEC_ID} not understood; '
-                     f'must be {job_types_str}')
+    # Read Context File
+    with open(context_file) as file:
+        ctx = json.load(file)
 
-# Open config file replacing `job-` with `config-` at the beginning
-config_file_path = f'{TOPS_APP_PATH}/conf/config-{JOB_SPEC_ID}.json'
-with open(config_file_path) as file:
-    config_data = json.load(file)
+    # The job_spec_id should match the `job-{string trailing job-spec json}`
+    JOB_SPEC_ID = get_job_spec_id(ctx)
 
-# Coseismic vs. Standard Product Global Variables
-DATASET_KEY = config_data['dataset_key']
-ES_INDEX = f'grq_*_{DATASET_KEY.lower()}'
+    # This will never happen because of job-spec and hysds-io setup.
+    # Still it is instructive within PGE to illustrate we have two pipeliens
+    check_job_type(JOB_SPEC_ID)
 
-# will be `coseismic` or `standard-product`
-JOB_NAME = config_data['name']
+    # Open config file replacing `job-` with `config-` at the beginning
+    config_data = load_job_config(TOPS_APP_PATH, JOB_SPEC_ID)
 
-# Fill in using config
-IFG_ID_SP_TMPL = f'{DATASET_KEY}' + '-{}-{}-{:03d}-tops-{}_{}-{}-{}-PP-{}-{}'
+    # Coseismic vs. Standard Product Global Variables
+    DATASET_KEY = config_data['dataset_key']
+    ES_INDEX = f'grq_*_{DATASET_KEY.lower()}'
 
-# Log name
-# Note this actually reads the standard out so if you change the above
-# Make sure to change the `create_standard_product.sh`, too!
-LOG_NAME = 'standard_product_s1.log'
+    # will be `coseismic` or `standard-product`
+    JOB_NAME = config_data['name']
 
-log_format = '[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s'
-logging.basicConfig(filename=LOG_NAME,
-                    format=log_format,
-                    level=logging.INFO)
-logger = logging.getLogger('create_ifg')
-logger.info(f'The job type is {JOB_NAME}')
+    # Fill in using config
+    IFG_ID_SP_TMPL = (f'{DATASET_KEY}' +
+                      '-{}-{}-{:03d}-tops-{}_{}-{}-{}-PP-{}-{}')
+    logger.info(f'The job type is {JOB_NAME}')
 
-# Check if Coseismic Job Name Matches IFG-CFG
-input_metadata = ctx['input_metadata']
-MACHINE_TAGS = input_metadata.get('tags', [])
+    # Check if Coseismic Job Name Matches IFG-CFG
+    # A list of ifg-cfgs for batch and pair jobs
+    input_metadata = get_input_metadata(ctx)
+    MACHINE_TAGS = input_metadata.get('tags', [])
 
-# Use the same template file and then adapt based on context.json
-TEMPLATE_FILE = (os.environ['TOPSAPP'] +
-                 '/topsApp_standard_product.xml.tmpl')
+    # Use the same template file and then adapt based on context.json
+    TEMPLATE_FILE = (os.environ['TOPSAPP'] +
+                     '/topsApp_standard_product.xml.tmpl')
+    return ctx
 
 
 def update_met_key(met_md, old_key, new_key):
@@ -180,36 +184,13 @@ def get_md5_from_file(file_name):
     return hash_md5.hexdigest()
 
 
-def update_str(item: str) -> str:
-    return r'"' + item + r'"'
-
-
-def get_gunw_query(reference_scenes: list,
-                   secondary_scenes: list,
-                   version: str):
-    reference_scenes_ = list(map(update_str, reference_scenes))
-    secondary_scenes_ = list(map(update_str, secondary_scenes))
-
-    reference_matches = [Q('query_string',
-                           query=scene,
-                           default_field="metadata.reference_scenes")
-                         for scene in reference_scenes_]
-    secondary_matches = [Q('query_string',
-                           query=scene,
-                           default_field="metadata.secondary_scenes")
-                         for scene in secondary_scenes_]
-    version_match = [Q('query_string',
-                       query=version[:3],
-                       default_field="version")]
-    qq = Q('bool', must=(reference_matches +
-                         secondary_matches +
-                         version_match))
-    return qq
-
-
 def check_for_existing_gunw(reference_scenes: list,
                             secondary_scenes: list,
                             version: str) -> bool:
+    from topsApp_utils.gunw_lookup import (get_grq_client,
+                                           get_gunw_query,
+                                           find_existing_gunws)
+
     es_url = SETTINGS_DICT['GRQ_URL']
 
     # For local tests
@@ -217,40 +198,22 @@ def check_for_existing_gunw(reference_scenes: list,
     if LOCAL_TEST:
         es_url = es_url + '/es'
 
-    grq_client = Elasticsearch(es_url,
-                               http_auth=HTTP_AUTH,
-                               verify_certs=False,
-                               )
-
+    grq_client = get_grq_client(es_url, HTTP_AUTH)
     logger.info(grq_client)
-    search = Search(using=grq_client, index=ES_INDEX)
 
     query = get_gunw_query(reference_scenes, secondary_scenes, version)
-    s = search.query(query)
-    logger.info(json.dumps(s.to_dict(), indent=2))
-
-    response = s.execute()
-    hits = response.hits
+    logger.info(json.dumps(query.to_dict(), indent=2))
 
-    if hits:
-        # Ensure set equality
-        response = s.execute()
-        hits = response.hits
-
-        def ensure_consistent_scene_length(hit):
-            ref_consistent = (len(reference_scenes) ==
-                              len(hit['metadata']['reference_scenes']))
-            sec_consistent = (len(secondary_scenes) ==
-                              len(hit['metadata']['secondary_scenes']))
-            return sec_consistent and ref_consistent
-
-        hits = list(filter(ensure_consistent_scene_length, hits))
-        if hits:
-            logger.info(f'GUNW with ref scenes{",".join(reference_scenes)} '
-                        f' and sec scenes {",".join(secondary_scenes)} '
-                        f'and version {version[:3]}* exists')
-            return True
-    return False
+    exists, = find_existing_gunws([(reference_scenes,
+                                    secondary_scenes,
+                                    version)],
+                                  grq_client,
+                                  ES_INDEX)
+    if exists:
+        logger.info(f'GUNW with ref scenes{",".join(reference_scenes)} '
+                    f' and sec scenes {",".join(secondary_scenes)} '
+                    f'and version {version[:3]}* exists')
+    return exists
 
 
 def update_met(md):
@@ -442,6 +405,8 @@ def read_isce_product(xmlfile):
     check_file_exist(xmlfile)
 
     # loading the xml file with isce
+    import isce
+    from iscesys.Component.ProductManager import ProductManager as PM
     pm = PM()
     pm.configure()
     obj = pm.loadProduct(xmlfile)
@@ -558,6 +523,7 @@ def create_dataset_json(id, version, met_file, ds_file):
 
 def get_union_polygon(ds_files):
     """Get GeoJSON polygon of union of IFGs."""
+    from osgeo import ogr
 
     geom_union = None
     for ds_file in ds_files:
@@ -573,12 +539,13 @@ def get_union_polygon(ds_files):
     return json.loads(geom_union.ExportToJson()), geom_union.GetEnvelope()
 
 
-def get_bool_param(ctx, param):
+def get_bool_param(ctx, param, default=True):
     """Return bool param from context."""
 
     if param in ctx and isinstance(ctx[param], bool):
         return ctx[param]
-    return True if ctx.get(param, 'true').strip().lower() == 'true' else False
+    value = ctx.get(param, str(default))
+    return True if value.strip().lower() == 'true' else False
 
 
 def download_file(url, outdir='.', session=None):
@@ -653,39 +620,6 @@ def get_polarization2(id):
         raise RuntimeError('Unrecognized polarization: %s' % pp)
 
 
-def get_pol_data_from_slcs(slcs):
-    pol_data = []
-    for slc in slcs:
-        pol = get_polarization(slc).strip().lower()
-        logger.info('get_pol_data_from_slcs:'
-                    f'pol data of SLC : {slc} is {pol}')
-        if pol not in pol_data:
-            pol_data.append(pol)
-
-    if (len(pol_data) == 0) or (len(pol_data) > 1):
-        err_msg = ('get_pol_data_from_slcs: Found Multiple Polarization '
-                   f'or No Polarization for slcs {slcs} : {pol_data}')
-        print(err_msg)
-        raise RuntimeError(err_msg)
-
-    return pol_data[0]
-
-
-def get_polarization(id):
-    """Return polarization."""
-
-    match = POL_RE.search(id)
-    if not match:
-        raise RuntimeError('Failed to extract polarization from %s' % id)
-    pp = match.group(1)
-    if pp in ('SV', 'DV'):
-        return 'vv'
-    elif pp in ('DH', 'SH'):
-        return 'hh'
-    else:
-        raise RuntimeError('Unrecognized polarization: %s' % pp)
-
-
 def file_transform(infile, maskfile, maskfile_out):
     """
         convert file into the same geo frame as the input file
@@ -780,213 +714,68 @@ def call_noerr(cmd):
         logger.warn('Traceback: {}'.format(traceback.format_exc()))
 
 
-def unzip_annotation_xmls(zip_path: str) -> list:
-    zip_obj = zipfile.ZipFile(zip_path, 'r')
-    all_files = zip_obj.filelist
-    # Only want xmls that match this regular expression
-    # (within annotation file)
-    pattern = re.compile(r'S1\w*.SAFE/annotation/s1[\w\-]*.xml')
-    xmls = list(filter(lambda x: re.match(pattern, x.filename), all_files))
-
-    def extract(zip_info_ob):
-        zip_obj.extract(zip_info_ob)
-        fn = zip_info_ob.filename
-        logger.info(f'Unzipping {fn}')
-        return fn
-
-    out = list(map(extract, xmls))
-
-    return out
-
-
-def main():
-    """HySDS PGE wrapper for TopsInSAR interferogram generation."""
-
-    # save cwd (working directory)
-    complete_start_time = datetime.now()
-    logger.info('TopsApp End Time : {}'.format(complete_start_time))
-    cwd = os.getcwd()
-
-    # If there is a machine tag, check that it's coseismic
-    # otherwise make sure it's
-    # the standard product.
-    # New machine tags other than "s1-coseismic-gunw"
-    # will need new control flow.
-    if MACHINE_TAGS:
-        if not ((MACHINE_TAGS[0] == "s1-coseismic-gunw")
-                and (JOB_NAME == 'coseismic')):
-            exception_msg = ('TopsApp Pipelines were mixed: '
-                             'A coseismic job was called with a '
-                             'standard product ifg-cfg')
-            raise RuntimeError(exception_msg)
-    elif JOB_NAME != 'standard-product':
-        exception_msg = ('TopsApp Pipelines were mixed: '
-                         'A standard product job was called with a '
-                         'coseismic ifg-cfg')
-        raise RuntimeError(exception_msg)
-    else:
-        pass
-    logger.info(f'The machine tag and job name agree for '
-                f'the {JOB_NAME} pipeline')
-
-    input_metadata = ctx['input_metadata']
-    if type(input_metadata) is list:
-        input_metadata = input_metadata[0]
-
-    # get args
-    project = input_metadata['project']
-    if type(project) is list:
-        project = project[0]
-
-    ifg_cfg_id = input_metadata['id']
-    master_ids = input_metadata['master_scenes']
-    slave_ids = input_metadata['slave_scenes']
-    direction = input_metadata['direction']
-    platform = input_metadata['platform']
-    master_zip_file = input_metadata['master_zip_file']
-    slave_zip_file = input_metadata['slave_zip_file']
-    master_orbit_file = input_metadata['master_orbit_file']
-    slave_orbit_file = input_metadata['slave_orbit_file']
-    master_orbit_url = input_metadata['master_orbit_url']
-    slave_orbit_url = input_metadata['slave_orbit_url']
-    track = input_metadata['track_number']
-    dem_type = input_metadata['dem_type']
-    system_version = ctx['container_image_name'].strip().split(':')[-1].strip()
-    ctx['system_version'] = system_version
-    full_id_hash = input_metadata['full_id_hash']
-    ctx['full_id_hash'] = full_id_hash
-
-    new_ifg_hash = get_ifg_hash(master_ids, slave_ids)
-    ctx['new_ifg_hash'] = new_ifg_hash
-
-    slc_slave_dt = input_metadata['slc_slave_dt']
-    ctx['slc_slave_dt'] = slc_slave_dt
-    slc_master_dt = input_metadata['slc_master_dt']
-    ctx['slc_master_dt'] = slc_master_dt
-    if dem_type == 'Ned1':
-        dem_type = 'NED1'
-
-    ctx['dem_type'] = dem_type
-    ctx['ifg_cfg_id'] = ifg_cfg_id
-
-    orbit_type = 'poeorb'
-    for o in (master_orbit_url, slave_orbit_url):
-        if RESORB_RE.search(o):
-            orbit_type = 'resorb'
-            break
-    ctx['orbit_type'] = orbit_type
-
-    for key in list(input_metadata.keys()):
-        if key not in list(ctx.keys()):
-            ctx[key] = input_metadata[key]
-            logger.info(f'Added {key} key to ctx')
-        else:
-            logger.info(f'key {key} already in ctx with value {ctx[key]}'
-                        f' and input_metadata value is {input_metadata[key]}')
-    logger.info('ctx: {}'.format(json.dumps(ctx, indent=2)))
-
-    azimuth_looks = 7
-    if 'azimuth_looks' in input_metadata:
-        azimuth_looks = int(input_metadata['azimuth_looks'])
-    ctx['azimuth_looks'] = azimuth_looks
-
-    range_looks = 19
-    if 'range_looks' in input_metadata:
-        range_looks = int(input_metadata['range_looks'])
-    ctx['range_looks'] = range_looks
-
-    filter_strength = 0.5
-    if 'filter_strength' in input_metadata:
-        filter_strength = float(input_metadata['filter_strength'])
-    ctx['filter_strength'] = filter_strength
-
-    precise_orbit_only = True
-    if 'precise_orbit_only' in input_metadata:
-        precise_orbit_only = get_bool_param(input_metadata,
-                                            'precise_orbit_only')
-    ctx['precise_orbit_only'] = precise_orbit_only
-
-    ifg_hash = new_ifg_hash[0:4]
-    ctx['ifg_hash'] = ifg_hash
-
-    logger.info('ifg_hash : %s' % ifg_hash)
-
-    # Pull topsApp configs
-    ctx['azimuth_looks'] = ctx.get('context', {}).get('azimuth_looks', 7)
-    ctx['range_looks'] = ctx.get('context', {}).get('range_looks', 19)
-
-    ctx.setdefault('swathnum', [1, 2, 3])
-    ctx['stitch_subswaths_xt'] = True
-    azimuth_looks = ctx['azimuth_looks']
-    range_looks = ctx['range_looks']
-
-    # log inputs
-    logger.info('project: {}'.format(project))
-    logger.info('master_ids: {}'.format(master_ids))
-    logger.info('slave_ids: {}'.format(slave_ids))
-    logger.info('subswaths: {}'.format(ctx['swathnum']))
-    logger.info('azimuth_looks: {}'.format(azimuth_looks))
-    logger.info('range_looks: {}'.format(range_looks))
-    logger.info('filter_strength: {}'.format(filter_strength))
-    logger.info('precise_orbit_only: {}'.format(precise_orbit_only))
-    logger.info('direction : {}'.format(direction))
-    logger.info('platform : {}'.format(platform))
-    logger.info('direction : {}'.format(direction))
-    logger.info('platform : {}'.format(platform))
-
-    logger.info('master_zip_file : {}'.format(master_zip_file))
-    logger.info('slave_zip_file : {}'.format(slave_zip_file))
-    logger.info('master_orbit_file : {}'.format(master_orbit_file))
-    logger.info('slave_orbit_file : {}'.format(slave_orbit_file))
-
-    logger.info(f'Using azimuth_looks of {azimuth_looks}'
-                f' and range_looks of {range_looks}')
-    logger.info('STITCHED SWATHS')
-
-    ctx['filter_strength'] = ctx.get('context', {}).get('filter_strength', 0.5)
-    logger.info('Using filter_strength of %f' % ctx['filter_strength'])
+def create_input_xml(template_dict,
+                     out_xml,
+                     template_file=None):
+    template_file = template_file or TEMPLATE_FILE
+    with open(template_file) as f:
+        template = Template(f.read())
+    template = template.substitute(**template_dict)
+    with open(out_xml, 'w') as f:
+        f.write(template)
+    return out_xml
 
-    logger.info('\nContext \n')
-    logger.info(json.dumps(ctx, indent=4, sort_keys=True))
 
-    # Check if ifg_name exists
-    version = get_version()
+def run_topsapp(start=None, end=None, resume=False):
+    """Run topsApp.py from `start` to `end` step.
 
-    TESTING = ctx.get('testing', False)
-    if not TESTING:
-        if check_for_existing_gunw(master_ids,
-                                   slave_ids,
-                                   version):
-            raise RuntimeError("Duplicate S1 GUNW found")
+    If `resume` is True, the start is moved to the first step between
+    `start` and `end` without a pickle from an interrupted attempt.
+    """
+    start = start or TOPSAPP_STEPS[0]
+    if resume:
+        start = get_topsapp_resume_step(start, end)
+        logger.info(f'Resuming topsApp.py at step {start}')
+
+    topsapp_cmd = ['topsApp.py', '--steps']
+    if start != TOPSAPP_STEPS[0]:
+        topsapp_cmd.append(f'--start={start}')
+    topsapp_cmd.append(f'--end={end}')
+    topsapp_cmd_line = ' '.join(topsapp_cmd)
+    logger.info(f'Calling topsApp.py to {end} step: {topsapp_cmd_line}')
+    check_call(topsapp_cmd_line, shell=True)
 
-        logger.info('\n'
-                    f'{DATASET_KEY} duplicate NOT Found.\n'
-                    f'Proceeding ....\n')
 
-    logger.debug('Warning: We assume that the zip paths are '
-                 'in the current working directory with the other data')
-    zip_paths = list(Path('.').glob('S1*_IW_SLC__*.zip'))
-    logger.info(f'There are {len(zip_paths)} slcs to unzip')
-    if len(zip_paths) == 0:
-        err_msg = 'No SLC files to Unzip!'
-        raise RuntimeError(err_msg)
-    list(map(unzip_annotation_xmls, zip_paths))
+def get_bbox_from_slcs(zip_paths, extract=False, index=True):
+    """
+    Determine the SLC envelope from the co-pol annotation xmls, which are
+    streamed directly from the zips or, if `extract` is True, extracted
+    first. If `index` is True, the annotation index of each zip is built
+    first (see topsApp_utils/annotation_index.py) and the envelope and the
+    metadata extraction read it instead of the xmls. If the index cannot be
+    built, the xmls are streamed as without it.
+    """
+    from topsApp_utils.sent1_bbox import get_envelope_from_all_slcs
+    from topsApp_utils.annotation_index import build_indexes
 
-    # get polarization values
-    master_pol = get_pol_data_from_slcs(ctx['master_zip_file'])
-    slave_pol = get_pol_data_from_slcs(ctx['slave_zip_file'])
-    if master_pol == slave_pol:
-        match_pol = master_pol
+    index_files = []
+    if index:
+        try:
+            index_files = build_indexes(zip_paths)
+        except Exception as err:
+            logger.warning('Could not build the annotation indexes; '
+                           f'parsing the annotation xmls instead: {err}')
+    if extract:
+        annotation_xmls = extract_annotations(zip_paths)
+        slc_paths = None
     else:
-        err_msg = ('Reference and Secondary Polarization are NOT SAME\n'
-                   f'Reference Polarization : {master_pol}\n'
-                   f'Secondary Polarization : {slave_pol}')
-        raise RuntimeError(err_msg)
+        annotation_xmls = []
+        slc_paths = zip_paths
 
     # get union bbox
     logger.info('Determining envelope bbox from SLC swaths.')
 
-    envelope_dict = get_envelope_from_all_slcs()
+    envelope_dict = get_envelope_from_all_slcs(slc_paths)
     bbox = [envelope_dict['ymin'],
             envelope_dict['ymax'],
             envelope_dict['xmin'],
@@ -998,14 +787,45 @@ def main():
               indent=2)
 
     logger.info(f'bbox: {json.dumps(bbox_json, indent=2)}')
+    return {'bbox': bbox,
+            'annotation_xmls': annotation_xmls,
+            'index_files': index_files}
 
-    # get dataset version and set dataset ID
-    version = get_version()
 
-    # get endpoint configurations
+def stitch_ned_dem(bbox, dem_url, dem_type_simple, downsample=None):
+    """
+    Stitch the NED processing and geocoding DEMs in process, reading the
+    tiles in place (see topsApp_utils/dem_stitcher.py).
+    """
+    from topsApp_utils.ned_dem import get_name_list, download
+    from topsApp_utils.dem_stitcher import stitch_dem
+
+    dem_S, dem_N, dem_W, dem_E = bbox
+    url_list, _, _ = get_name_list([dem_S, dem_N], [dem_W, dem_E], dem_url)
+    zip_files = download(url_list, dem_user, dem_pass)
+    preprocess_dem_dir = f'{dem_type_simple}_preprocess_dem'
+    preprocess_dem_file = os.path.join(preprocess_dem_dir, 'stitched.dem')
+    geocode_dem_file = os.path.join(
+        preprocess_dem_dir, f'Coarse_{dem_type_simple}_preprocess_dem',
+        'stitched.dem')
+    stitch_dem(zip_files, bbox, preprocess_dem_file, geocode_dem_file,
+               downsample=downsample)
+    for zip_file in zip_files:
+        os.unlink(zip_file)
+    logger.info(f'Using Preprocess DEM file: {preprocess_dem_file}')
+    logger.info(f'Using Geocode DEM file: {geocode_dem_file}')
+    return {'preprocess_dem_file': preprocess_dem_file,
+            'geocode_dem_file': geocode_dem_file}
+
+
+def stitch_dems(bbox, dem_type, in_process=True):
+    """
+    Stitch the processing DEM and downsample it for geocoding.
+
+    With `in_process`, NED DEMs are stitched by `stitch_ned_dem` instead of
+    ned_dem.py, fixImageXml.py and downsampleDEM.py.
+    """
 
-    # get DEM configuration
-    dem_type = ctx['dem_type']
     logger.info(f'dem_type: {dem_type}')
     dem_type_simple = None
     dem_url = SETTINGS_DICT['ARIA_DEM_URL']
@@ -1033,18 +853,27 @@ def main():
             dem_url = srtm3_dem_url
             dem_type_simple = 'SRTM3'
 
-        dem_cmd = [
-            '{}/applications/dem.py'.format(os.environ['ISCE_HOME']), '-a',
-            'stitch', '-b', '{} {} {} {}'.format(dem_S,
-                                                 dem_N,
-                                                 dem_W,
-                                                 dem_E),
-            '-r', '-s', '1', '-f', '-x', '-c', '-n', dem_user, '-w',
-            dem_pass, '-u', dem_url
-        ]
-        dem_cmd_line = ' '.join(dem_cmd)
-        logger.info('Calling dem.py: {}'.format(dem_cmd_line))
-        check_call(dem_cmd_line, shell=True)
+        # dem.py downloads the tiles itself; with a tile cache it is
+        # pointed to a local server fetching the tiles through the cache
+        from topsApp_utils.dem_tile_cache import TileCache, TileCacheServer
+        tile_cache = TileCache.from_env()
+        with ExitStack() as stack:
+            if tile_cache is not None:
+                server = stack.enter_context(
+                    TileCacheServer(tile_cache, dem_url, dem_user, dem_pass))
+                dem_url = server.url
+            dem_cmd = [
+                '{}/applications/dem.py'.format(os.environ['ISCE_HOME']),
+                '-a', 'stitch', '-b', '{} {} {} {}'.format(dem_S,
+                                                           dem_N,
+                                                           dem_W,
+                                                           dem_E),
+                '-r', '-s', '1', '-f', '-x', '-c', '-n', dem_user, '-w',
+                dem_pass, '-u', dem_url
+            ]
+            dem_cmd_line = ' '.join(dem_cmd)
+            logger.info('Calling dem.py: {}'.format(dem_cmd_line))
+            check_call(dem_cmd_line, shell=True)
         preprocess_dem_file = glob('*.dem.wgs84')[0]
 
     else:
@@ -1066,6 +895,14 @@ def main():
         dem_W = dem_W - 1 if dem_W > -179 else dem_W
         dem_E = dem_E + 1 if dem_E < 179 else dem_E
 
+        if in_process:
+            out = stitch_ned_dem([dem_S, dem_N, dem_W, dem_E], dem_url,
+                                 dem_type_simple,
+                                 downsample_option.split()[-1]
+                                 if downsample_option else None)
+            checkBurstError()
+            return out
+
         topsApp_util_dir = os.environ['TOPSAPP'] + '/topsApp_utils'
         dem_cmd = [
             '{}/ned_dem.py'.format(topsApp_util_dir), '-a',
@@ -1151,70 +988,70 @@ def main():
     logger.info('Calling fixImageXml.py: {}'.format(fix_cmd_line))
     check_call(fix_cmd_line, shell=True)
 
-    # download auciliary calibration files
-    fetch_aux_cal('aux_cal', False)
+    return {'preprocess_dem_file': preprocess_dem_file,
+            'geocode_dem_file': geocode_dem_file}
 
-    # ESD Computations
-    # ESD is by dafault turned off
-    do_esd = ctx.get('do_esd', False)
-    logger.info(f'ESD computations are {"ON" if do_esd else "OFF"}')
 
-    # create initial input xml
-    esd_coh_thresh = 0.85 if do_esd else - 1.
-    master_orbit = ctx['master_orbit_file']
-    slave_orbit = ctx['slave_orbit_file']
-    region_of_interest_str = str(ctx.get('region_of_interest', bbox))
+def fetch_aux_cal_files(shared_aux_cal_dir=None):
+    """
+    Download auxiliary calibration files or link those already downloaded
+    to `shared_aux_cal_dir` (e.g. by a batch of pairs).
+    """
 
-    TEMPLATE_DICT = dict(MASTER_SAFE_DIR=master_zip_file,
-                         SLAVE_SAFE_DIR=slave_zip_file,
-                         MASTER_ORBIT_FILE=master_orbit,
-                         SLAVE_ORBIT_FILE=slave_orbit,
-                         DEM_FILE=preprocess_dem_file,
-                         GEOCODE_DEM_FILE=geocode_dem_file,
-                         SWATHNUM=str(ctx['swathnum']),
-                         AZIMUTH_LOOKS=ctx['azimuth_looks'],
-                         RANGE_LOOKS=ctx['range_looks'],
-                         FILTER_STRENGTH=ctx['filter_strength'],
-                         REGION_OF_INTEREST=region_of_interest_str,
-                         USE_VIRTUAL_FILES=True,
-                         DO_ESD=do_esd,
-                         ESD_COHERENCE_THRESHOLD=esd_coh_thresh)
+    if shared_aux_cal_dir is not None and os.path.isdir(shared_aux_cal_dir):
+        logger.info(f'Using auxiliary calibration files of '
+                    f'{shared_aux_cal_dir}')
+        if os.path.islink('aux_cal'):
+            os.unlink('aux_cal')
+        if not os.path.exists('aux_cal'):
+            os.symlink(os.path.abspath(shared_aux_cal_dir), 'aux_cal')
+    else:
+        fetch_aux_cal('aux_cal', False)
+    return {'aux_cal_dir': 'aux_cal'}
 
-    def create_input_xml(template_dict,
-                         out_xml,
-                         template_file=TEMPLATE_FILE):
-        with open(template_file) as f:
-            template = Template(f.read())
-        template = template.substitute(**template_dict)
-        with open(out_xml, 'w') as f:
-            f.write(template)
-        return out_xml
 
-    create_input_xml(TEMPLATE_DICT, 'topsApp.xml')
+def run_esd(template_dict, do_esd, esd_coh_thresh, sweep=True):
+    """
+    Run topsApp esd step lowering the coherence threshold on failure.
 
-    # get the time before stating topsApp.py
-    topsApp_start_time = datetime.now()
-    logger.info('TopsApp Start Time : {}'.format(topsApp_start_time))
-
-    # run topsApp to prepesd step
-    topsapp_cmd = [
-        'topsApp.py', '--steps', '--end=prepesd',
-    ]
-    topsapp_cmd_line = ' '.join(topsapp_cmd)
-    logger.info(f'Calling topsApp.py to prepesd step: {topsapp_cmd_line}')
-    check_call(topsapp_cmd_line, shell=True)
+    If `sweep` is True, the highest coherence threshold leaving overlap
+    pixels for the ESD estimate is determined from the prepesd outputs in a
+    single pass, so that the esd step normally runs once.
+    """
 
     # iterate over ESD coherence thresholds
     esd_coh_increment = 0.05
     esd_coh_min = 0.5
 
+    template_esd = template_dict.copy()
+    if do_esd and sweep:
+        from topsApp_utils.esd_sweep import (get_candidate_thresholds,
+                                             select_esd_threshold)
+        thresholds = get_candidate_thresholds(esd_coh_thresh,
+                                              minimum=esd_coh_min,
+                                              increment=esd_coh_increment)
+        try:
+            selected_thresh = select_esd_threshold(thresholds)
+        except RuntimeError as err:
+            # fall back to lowering the threshold on esd step failures
+            logger.warning(f'ESD coherence threshold sweep failed: {err}')
+        else:
+            if selected_thresh is None:
+                logger.info('No ESD coherence threshold leaves enough points. '
+                            'Disabling ESD filtering.')
+                do_esd = False
+            else:
+                esd_coh_thresh = selected_thresh
+                logger.info('Selected ESD coherence threshold: '
+                            f'{esd_coh_thresh}')
+            template_esd['DO_ESD'] = do_esd
+            template_esd['ESD_COHERENCE_THRESHOLD'] = esd_coh_thresh
+            create_input_xml(template_esd, 'topsApp.xml')
+
     topsapp_cmd = [
         'topsApp.py', '--steps', '--dostep=esd',
     ]
     topsapp_cmd_line = ' '.join(topsapp_cmd)
-    check_call(topsapp_cmd_line, shell=True)
-
-    template_esd = TEMPLATE_DICT.copy()
     while do_esd:
         logger.info('Calling topsApp.py on esd step '
                     f'with ESD coherence threshold: {esd_coh_thresh}')
@@ -1228,147 +1065,80 @@ def main():
             if esd_coh_thresh < esd_coh_min:
                 logger.info('Disabling ESD filtering.')
                 do_esd = False
-                template_esd['do_esd'] = False
+                template_esd['DO_ESD'] = False
                 create_input_xml(template_esd, 'topsApp.xml')
                 break
             logger.info('Reducing ESD coherence threshold to: '
                         f'{esd_coh_thresh}')
             logger.info('Creating topsApp.xml with'
                         f'ESD coherence threshold: {esd_coh_thresh}')
+            template_esd['ESD_COHERENCE_THRESHOLD'] = esd_coh_thresh
             create_input_xml(template_esd, 'topsApp.xml')
 
-    # run topsApp from rangecoreg to geocode
-    topsapp_cmd = [
-        'topsApp.py', '--steps', '--start=rangecoreg', '--end=geocode',
-    ]
-    topsapp_cmd_line = ' '.join(topsapp_cmd)
-    logger.info(f'Calling topsApp.py to geocode step: {topsapp_cmd_line}')
-
-    checkBurstError()
-
-    check_call(topsapp_cmd_line, shell=True)
-
-    # topsApp End Time
-    topsApp_end_time = datetime.now()
-    logger.info('TopsApp End Time : {}'.format(topsApp_end_time))
-
-    topsApp_run_time = topsApp_end_time - topsApp_start_time
-    logger.info('New TopsApp Run Time : {}'.format(topsApp_run_time))
-
-    swath_list = ctx['swathnum'].copy()
-
-    # get radian value for 5-cm wrap. As it is same for all swath,
-    # we will use swathnum = 1
-    rt = parse('master/IW{}.xml'.format(swath_list[0]))
-    wv = eval(rt.xpath(".//property[@name='radarwavelength']/value/text()")[0])
-    rad = 4 * np.pi * .05 / wv
-    logger.info('Radian value for 5-cm wrap is: {}'.format(rad))
-
-    # create id and product directory
-
-    output = get_tops_metadata('fine_interferogram')
-    sensing_start = output['sensingStart']
-    sensing_stop = output['sensingStop']
-    logger.info('sensing_start : %s' % sensing_start)
-    logger.info('sensing_stop : %s' % sensing_stop)
-
-    acq_center_time = get_center_time(sensing_start, sensing_stop)
-
-    ifg_hash = ctx['new_ifg_hash']
-    direction = ctx['direction']
-    platform = ctx['platform']
-    orbit_type = ctx['orbit_type']
-    track = ctx['track_number']
-    slave_ifg_dt = ctx['slc_slave_dt']
-    master_ifg_dt = ctx['slc_master_dt']
-    lats = get_geocoded_lats('merged/filt_topophase.unw.geo.vrt')
-
-    logger.info(f'lats : {lats}')
-    logger.info(f'max(lats): {max(lats)}: {convert_number(max(lats))}')
-    logger.info(f'min(lats): {min(lats)}: {convert_number(min(lats))}')
-
-    sorted_lats_temp = sorted(lats)[-2]
-    num = convert_number(sorted_lats_temp)
-    logger.info(f'sorted(lats)[-2] : {sorted_lats_temp}: {num}')
-    sorted_lats_temp = sorted(lats)[1]
-    num = convert_number(sorted_lats_temp)
-    logger.info(f'sorted(lats)[1]{sorted_lats_temp} : {num}')
+    if not do_esd:
+        # the esd step is a no-op but its pickle is needed by the next steps
+        check_call(topsapp_cmd_line, shell=True)
 
-    sat_direction = 'D'
-    logger.info('sat_direction : {}'.format(sat_direction))
+    return {'do_esd': do_esd,
+            'esd_coh_thresh': esd_coh_thresh}
 
-    west_lat = '{}_{}'.format(convert_number(sorted(lats)[-2]),
-                              convert_number(min(lats)))
 
-    if direction.lower() == 'asc':
-        sat_direction = 'A'
-        west_lat = '{}_{}'.format(convert_number(max(lats)),
-                                  convert_number(sorted(lats)[1]))
-
-    ifg_hash = ifg_hash[0:4]
-    logger.info('slc_master_dt : %s,slc_slave_dt : %s' % (slc_master_dt,
-                                                          slc_slave_dt))
-    id_tmpl_merged = 'S1-GUNW-MERGED_R{}_M{:d}S{:d}_TN{:03d}_{}-{}_s123-{}-{}'
-    ifg_id_merged = id_tmpl_merged.format('M',
-                                          len(master_ids),
-                                          len(slave_ids),
-                                          track,
-                                          master_ifg_dt,
-                                          slave_ifg_dt,
-                                          orbit_type,
-                                          ifg_hash)
-    logger.info('ifg_id_merged : %s' % ifg_id_merged)
-
-    ifg_id = IFG_ID_SP_TMPL.format(sat_direction,
-                                   'R',
-                                   track,
-                                   master_ifg_dt.split('T')[0],
-                                   slave_ifg_dt.split('T')[0],
-                                   acq_center_time,
-                                   west_lat, ifg_hash,
-                                   version.replace('.', '_'))
-    id = ifg_id
-
-    logger.info('id : %s' % ifg_id)
-    logger.info('ifg_id_merged : %s' % ifg_id_merged)
-
-    prod_dir = ifg_id
-
-    logger.info('prod_dir : %s' % prod_dir)
-
-    os.makedirs(prod_dir, 0o755)
+def make_geocube(cores=None):
+    """
+    Make metadata geocube in the merged directory using `cores` cores
+    (default: OMP_NUM_THREADS).
+    """
 
-    # make metadata geocube
+    cwd = os.getcwd()
     os.chdir('merged')
-    topsApp_path = os.environ['TOPSAPP']
-    mgc_cmd = [f'{topsApp_path}/topsApp_utils/makeGeocube.py',
-               '-m', '../master',
-               '-s', '../slave',
-               '-o', 'metadata.h5'
-               ]
-    mgc_cmd_line = ' '.join(mgc_cmd)
-    logger.info('Calling makeGeocube.py: {}'.format(mgc_cmd_line))
-    check_call(mgc_cmd_line, shell=True)
+    try:
+        # makeGeocube.py refuses to overwrite output of an earlier attempt
+        if os.path.exists('metadata.h5'):
+            os.remove('metadata.h5')
+        topsApp_path = os.environ['TOPSAPP']
+        mgc_cmd = [f'{topsApp_path}/topsApp_utils/makeGeocube.py',
+                   '-m', '../master',
+                   '-s', '../slave',
+                   '-o', 'metadata.h5'
+                   ]
+        if cores is not None:
+            mgc_cmd += ['--cores', str(cores)]
+        mgc_cmd_line = ' '.join(mgc_cmd)
+        logger.info('Calling makeGeocube.py: {}'.format(mgc_cmd_line))
+        check_call(mgc_cmd_line, shell=True)
+    finally:
+        os.chdir(cwd)
+    return {'metadata_file': 'merged/metadata.h5'}
+
+
+def package_product(ifg_id, prod_dir):
+    """Create the standard product netcdf and move it to `prod_dir`."""
 
     # create standard product packaging
     std_prod_file = '{}.nc'.format(ifg_id)
 
-    with open(os.path.join(BASE_PATH, 'tops_groups.json')) as f:
-        std_cfg = json.load(f)
-    std_cfg['filename'] = std_prod_file
-    with open('tops_groups.json', 'w') as f:
-        json.dump(std_cfg, f, indent=2, sort_keys=True)
-    std_cmd = [
-        '{}/topsApp_utils/standard_product_packaging.py'.format(BASE_PATH)
-    ]
-    std_cmd_line = ' '.join(std_cmd)
-    logger.info(f'Calling standard_product_packaging.py: {std_cmd_line}')
-    check_call(std_cmd_line, shell=True)
-
-    # chdir back up to work directory
-    os.chdir(cwd)
+    cwd = os.getcwd()
+    os.chdir('merged')
+    try:
+        with open(os.path.join(BASE_PATH, 'tops_groups.json')) as f:
+            std_cfg = json.load(f)
+        std_cfg['filename'] = std_prod_file
+        with open('tops_groups.json', 'w') as f:
+            json.dump(std_cfg, f, indent=2, sort_keys=True)
+        std_cmd = [
+            '{}/topsApp_utils/standard_product_packaging.py'.format(BASE_PATH)
+        ]
+        std_cmd_line = ' '.join(std_cmd)
+        logger.info(f'Calling standard_product_packaging.py: {std_cmd_line}')
+        check_call(std_cmd_line, shell=True)
+    finally:
+        # chdir back up to work directory
+        os.chdir(cwd)
 
     # move standard product to product directory
+    nc_file = os.path.join(prod_dir, std_prod_file)
+    if os.path.exists(nc_file):
+        os.remove(nc_file)
     shutil.move(os.path.join('merged', std_prod_file), prod_dir)
 
     # generate GDAL (ENVI) headers and move to product directory
@@ -1395,10 +1165,15 @@ def main():
     # save other files to product directory
     shutil.copyfile('_context.json', os.path.join(prod_dir,
                                                   f'{ifg_id}.context.json'))
+    return {'std_prod_file': std_prod_file,
+            'nc_file': nc_file}
 
-    fine_int_xmls = []
-    for swathnum in swath_list:
-        fine_int_xmls.append('fine_interferogram/IW{}.xml'.format(swathnum))
+
+def stitch_water_mask(bbox, in_process=True):
+    """
+    Stitch the water mask over the DEM bbox or, with `in_process`, only
+    fetch its tiles for `make_product_water_mask`.
+    """
 
     # get water mask configuration
     wbd_url = SETTINGS_DICT['ARIA_WBD_URL']
@@ -1414,6 +1189,13 @@ def main():
     dem_W = dem_W - 1 if dem_W > -179 else dem_W
     dem_E = dem_E + 1 if dem_E < 179 else dem_E
 
+    if in_process:
+        from topsApp_utils.water_mask import fetch_tiles
+        wbd_tiles = fetch_tiles([dem_S, dem_N, dem_W, dem_E], wbd_url,
+                                username=SETTINGS_DICT.get('ARIA_WBD_U'),
+                                password=SETTINGS_DICT.get('ARIA_WBD_P'))
+        return {'wbd_tiles': wbd_tiles}
+
     # get water mask
     fp = open('wbdStitcher.xml', 'w')
     fp.write("<stitcher>\n")
@@ -1460,12 +1242,30 @@ def main():
         check_call(wbd_cmd_line, shell=True)
     except Exception as e:
         logger.info(str(e))
+    return {'wbd_file': wbd_file}
+
+
+def make_product_water_mask(wbd_tiles):
+    """Sample the water mask tiles on the grid of the geocoded product."""
+    from topsApp_utils.imutils import get_size
+    from topsApp_utils.water_mask import make_water_mask
+
+    vrt_prod_size = get_size('merged/filt_topophase.unw.geo.xml')
+    logger.info('vrt_prod size: {}'.format(vrt_prod_size))
+    wbd_cropped_file = 'wbdmask_cropped.wbd'
+    make_water_mask(wbd_tiles, vrt_prod_size, wbd_cropped_file)
+    return {'wbd_cropped_file': wbd_cropped_file}
+
+
+def crop_water_mask(wbd_file):
+    """Downsample and crop the water mask to the geocoded product."""
+    from topsApp_utils.imutils import (get_image,
+                                       get_size,
+                                       crop_mask)
 
     # get product image and size info
     vrt_prod = get_image('merged/filt_topophase.unw.geo.xml')
     vrt_prod_size = get_size(vrt_prod)
-    flat_vrt_prod = get_image('merged/filt_topophase.flat.geo.xml')
-    flat_vrt_prod_size = get_size(flat_vrt_prod)
 
     # get water mask image and size info
     wbd_xml = '{}.xml'.format(wbd_file)
@@ -1548,52 +1348,52 @@ def main():
     wbd_cropped_file = 'wbdmask_cropped.wbd'
     wmask_cropped = crop_mask(vrt_prod, wmask_ds, wbd_cropped_file)
     logger.info('wmask_cropped shape: {}'.format(wmask_cropped.shape))
+    return {'wbd_cropped_file': wbd_cropped_file}
+
+
+def mask_product(wbd_cropped_file):
+    """Mask water and unconnected components out of the geocoded product."""
+    import isce
+    from isceobj.Image.Image import Image
+    from topsApp_utils.imutils import (get_image,
+                                       get_size)
+    from topsApp_utils.product_masking import mask_product_blocks
+
+    # get product image and size info
+    vrt_prod = get_image('merged/filt_topophase.unw.geo.xml')
+    vrt_prod_size = get_size(vrt_prod)
+    flat_vrt_prod = get_image('merged/filt_topophase.flat.geo.xml')
+    flat_vrt_prod_size = get_size(flat_vrt_prod)
+
+    # read in cropped water mask
+    wmask_cropped = get_image(f'{wbd_cropped_file}.xml')
 
-    # read in wrapped interferogram
-    flat_vrt_prod_im = np.memmap(flat_vrt_prod.filename,
-                                 dtype=flat_vrt_prod.toNumpyDataType(),
-                                 mode='c',
-                                 shape=(flat_vrt_prod_size['lat']['size'],
-                                        flat_vrt_prod_size['lon']['size']))
-    phase = np.angle(flat_vrt_prod_im)
-    phase[phase == 0] = -10
-    phase[wmask_cropped == -1] = -10
-
-    # mask out water from the product data
+    # mask out water and unconnected components from the product data
+    # and overwrite displacement with phase, streaming blocks of lines
     vrt_prod_shape = (vrt_prod_size['lat']['size'],
                       vrt_prod.bands,
                       vrt_prod_size['lon']['size'])
-    vrt_prod_im = np.memmap(vrt_prod.filename,
-                            dtype=vrt_prod.toNumpyDataType(),
-                            mode='c', shape=vrt_prod_shape)
-    im1 = vrt_prod_im[:, :, :]
-    for i in range(vrt_prod.bands):
-        im1_tmp = im1[:, i, :]
-        im1_tmp[wmask_cropped == -1] = 0
-
-    # read in connected component mask
+    flat_vrt_prod_shape = (flat_vrt_prod_size['lat']['size'],
+                           flat_vrt_prod_size['lon']['size'])
+    if flat_vrt_prod_shape != (vrt_prod_shape[0], vrt_prod_shape[2]):
+        raise RuntimeError(f'Shape of {flat_vrt_prod.filename} '
+                           f'{flat_vrt_prod_shape} does not match '
+                           f'{vrt_prod.filename} {vrt_prod_shape}')
     cc_vrt = 'merged/filt_topophase.unw.conncomp.geo.vrt'
-    cc = gdal.Open(cc_vrt)
-    cc_data = cc.ReadAsArray()
-    cc = None
-    logger.info('cc_data: {}'.format(cc_data))
-    logger.info('cc_data shape: {}'.format(cc_data.shape))
-    for i in range(vrt_prod.bands):
-        im1_tmp = im1[:, i, :]
-        im1_tmp[cc_data == 0] = 0
-    phase[cc_data == 0] = -10
-
-    # overwrite displacement with phase
-    im1[:, 1, :] = phase
 
     # create masked product image
     masked_filt = 'filt_topophase.masked.unw.geo'
     masked_filt_xml = 'filt_topophase.masked.unw.geo.xml'
-    tim = np.memmap(masked_filt,
-                    dtype=vrt_prod.toNumpyDataType(),
-                    mode='w+',
-                    shape=vrt_prod_shape)
-    tim[:, :, :] = im1
+    mask_product_blocks(vrt_prod.filename,
+                        vrt_prod.toNumpyDataType(),
+                        flat_vrt_prod.filename,
+                        flat_vrt_prod.toNumpyDataType(),
+                        wmask_cropped.filename,
+                        wmask_cropped.toNumpyDataType(),
+                        cc_vrt,
+                        vrt_prod_shape,
+                        masked_filt)
+
     im = Image()
     with open('merged/filt_topophase.unw.geo.xml') as f:
         doc = parse(f)
@@ -1630,6 +1430,12 @@ def main():
     cmd = (f'gdal_translate -of VRT -b 2 -a_nodata -10 {vrt_prod_file} '
            f'{vrt_prod_file_dis}')
     check_call(cmd, shell=True)
+    return {'masked_file': masked_filt,
+            'vrt_prod_file_dis': vrt_prod_file_dis}
+
+
+def create_browse_and_tiles(vrt_prod_file_dis, prod_dir, id):
+    """Create the interferogram tile layer and browse images."""
 
     # create interferogram tile layer
     tiles_dir = '{}/tiles'.format(prod_dir)
@@ -1660,41 +1466,523 @@ def main():
                shell=True)
     for i in glob('{}/{}.*.browse*.aux.xml'.format(prod_dir, id)):
         os.unlink(i)
+    return {'tiles_dir': tiles_dir}
 
-    # extract metadata from master
-    met_file = os.path.join(prod_dir, '{}.met.json'.format(id))
-    frame_metadata_dir = os.environ['TOPSAPP'] + '/frameMetadata'
-    extract_cmd_tmpl = ('{}/extractMetadata_standard_product.sh -i '
-                        '{}/annotation/s1?-iw?-slc-{}-*.xml -o {}')
-    check_call(extract_cmd_tmpl.format(frame_metadata_dir,
-                                       master_zip_file[0].replace('.zip',
-                                                                  '.SAFE'),
-                                       master_pol,
-                                       met_file),
-               shell=True)
 
-    # update met JSON
-    if (('RESORB' in ctx['master_orbit_file']) or
-       ('RESORB' in ctx['slave_orbit_file'])):
-        orbit_type = 'resorb'
+def main():
+    """HySDS PGE wrapper for TopsInSAR interferogram generation."""
+
+    from osgeo import gdal
+    gdal.UseExceptions()  # make GDAL raise python exceptions
+
+    # save cwd (working directory)
+    complete_start_time = datetime.now()
+    logger.info('TopsApp End Time : {}'.format(complete_start_time))
+    telemetry = StageTelemetry()
+
+    # If there is a machine tag, check that it's coseismic
+    # otherwise make sure it's
+    # the standard product.
+    check_pipeline(MACHINE_TAGS, JOB_NAME)
+    logger.info(f'The machine tag and job name agree for '
+                f'the {JOB_NAME} pipeline')
+
+    input_metadata = get_input_metadata(ctx)
+
+    # get args
+    project = input_metadata['project']
+    if type(project) is list:
+        project = project[0]
+
+    ifg_cfg_id = input_metadata['id']
+    master_ids = input_metadata['master_scenes']
+    slave_ids = input_metadata['slave_scenes']
+    direction = input_metadata['direction']
+    platform = input_metadata['platform']
+    master_zip_file = input_metadata['master_zip_file']
+    slave_zip_file = input_metadata['slave_zip_file']
+    master_orbit_file = input_metadata['master_orbit_file']
+    slave_orbit_file = input_metadata['slave_orbit_file']
+    master_orbit_url = input_metadata['master_orbit_url']
+    slave_orbit_url = input_metadata['slave_orbit_url']
+    track = input_metadata['track_number']
+    dem_type = input_metadata['dem_type']
+    system_version = ctx['container_image_name'].strip().split(':')[-1].strip()
+    ctx['system_version'] = system_version
+    full_id_hash = input_metadata['full_id_hash']
+    ctx['full_id_hash'] = full_id_hash
+
+    new_ifg_hash = get_ifg_hash(master_ids, slave_ids)
+    ctx['new_ifg_hash'] = new_ifg_hash
+
+    slc_slave_dt = input_metadata['slc_slave_dt']
+    ctx['slc_slave_dt'] = slc_slave_dt
+    slc_master_dt = input_metadata['slc_master_dt']
+    ctx['slc_master_dt'] = slc_master_dt
+    if dem_type == 'Ned1':
+        dem_type = 'NED1'
+
+    ctx['dem_type'] = dem_type
+    ctx['ifg_cfg_id'] = ifg_cfg_id
+
+    orbit_type = 'poeorb'
+    for o in (master_orbit_url, slave_orbit_url):
+        if RESORB_RE.search(o):
+            orbit_type = 'resorb'
+            break
+    ctx['orbit_type'] = orbit_type
+
+    for key in list(input_metadata.keys()):
+        if key not in list(ctx.keys()):
+            ctx[key] = input_metadata[key]
+            logger.info(f'Added {key} key to ctx')
+        else:
+            logger.info(f'key {key} already in ctx with value {ctx[key]}'
+                        f' and input_metadata value is {input_metadata[key]}')
+    logger.info('ctx: {}'.format(json.dumps(ctx, indent=2)))
+
+    azimuth_looks = 7
+    if 'azimuth_looks' in input_metadata:
+        azimuth_looks = int(input_metadata['azimuth_looks'])
+    ctx['azimuth_looks'] = azimuth_looks
+
+    range_looks = 19
+    if 'range_looks' in input_metadata:
+        range_looks = int(input_metadata['range_looks'])
+    ctx['range_looks'] = range_looks
+
+    filter_strength = 0.5
+    if 'filter_strength' in input_metadata:
+        filter_strength = float(input_metadata['filter_strength'])
+    ctx['filter_strength'] = filter_strength
+
+    precise_orbit_only = True
+    if 'precise_orbit_only' in input_metadata:
+        precise_orbit_only = get_bool_param(input_metadata,
+                                            'precise_orbit_only')
+    ctx['precise_orbit_only'] = precise_orbit_only
+
+    ifg_hash = new_ifg_hash[0:4]
+    ctx['ifg_hash'] = ifg_hash
+
+    logger.info('ifg_hash : %s' % ifg_hash)
+
+    # Pull topsApp configs
+    ctx['azimuth_looks'] = ctx.get('context', {}).get('azimuth_looks', 7)
+    ctx['range_looks'] = ctx.get('context', {}).get('range_looks', 19)
+
+    ctx.setdefault('swathnum', [1, 2, 3])
+    ctx['stitch_subswaths_xt'] = True
+    azimuth_looks = ctx['azimuth_looks']
+    range_looks = ctx['range_looks']
+
+    # log inputs
+    logger.info('project: {}'.format(project))
+    logger.info('master_ids: {}'.format(master_ids))
+    logger.info('slave_ids: {}'.format(slave_ids))
+    logger.info('subswaths: {}'.format(ctx['swathnum']))
+    logger.info('azimuth_looks: {}'.format(azimuth_looks))
+    logger.info('range_looks: {}'.format(range_looks))
+    logger.info('filter_strength: {}'.format(filter_strength))
+    logger.info('precise_orbit_only: {}'.format(precise_orbit_only))
+    logger.info('direction : {}'.format(direction))
+    logger.info('platform : {}'.format(platform))
+    logger.info('direction : {}'.format(direction))
+    logger.info('platform : {}'.format(platform))
+
+    logger.info('master_zip_file : {}'.format(master_zip_file))
+    logger.info('slave_zip_file : {}'.format(slave_zip_file))
+    logger.info('master_orbit_file : {}'.format(master_orbit_file))
+    logger.info('slave_orbit_file : {}'.format(slave_orbit_file))
+
+    logger.info(f'Using azimuth_looks of {azimuth_looks}'
+                f' and range_looks of {range_looks}')
+    logger.info('STITCHED SWATHS')
+
+    ctx['filter_strength'] = ctx.get('context', {}).get('filter_strength', 0.5)
+    logger.info('Using filter_strength of %f' % ctx['filter_strength'])
+
+    logger.info('\nContext \n')
+    logger.info(json.dumps(ctx, indent=4, sort_keys=True))
+
+    # Check if ifg_name exists
+    version = get_version()
+
+    TESTING = ctx.get('testing', False)
+    if not TESTING:
+        if check_for_existing_gunw(master_ids,
+                                   slave_ids,
+                                   version):
+            raise RuntimeError("Duplicate S1 GUNW found")
+
+        logger.info('\n'
+                    f'{DATASET_KEY} duplicate NOT Found.\n'
+                    f'Proceeding ....\n')
+
+    # Stages completed by a previous attempt with unchanged inputs
+    # are skipped
+    tracker = StageTracker(enabled=get_bool_param(ctx, 'resume_stages'),
+                           telemetry=telemetry)
+
+    logger.debug('Warning: We assume that the zip paths are '
+                 'in the current working directory with the other data')
+    zip_paths = sorted(Path('.').glob('S1*_IW_SLC__*.zip'))
+    logger.info(f'There are {len(zip_paths)} slcs to unzip')
+    if len(zip_paths) == 0:
+        err_msg = 'No SLC files to Unzip!'
+        raise RuntimeError(err_msg)
+
+    # get polarization values
+    match_pol = check_polarization(ctx['master_zip_file'],
+                                   ctx['slave_zip_file'])
+    master_pol = match_pol
+
+    # Annotation xmls are only extracted to disk if requested
+    extract_xmls = ctx.get('extract_annotation_xmls', False)
+    # Annotations are parsed once into an index read by later consumers,
+    # kept in the work directory unless annotation_index_dir is set
+    index_annotations = get_bool_param(ctx, 'annotation_index')
+    os.environ['ANNOTATION_INDEX_DIR'] = os.path.abspath(
+        ctx.get('annotation_index_dir') or
+        os.environ.get('ANNOTATION_INDEX_DIR') or '.')
+    out = tracker.run('envelope', get_bbox_from_slcs, zip_paths,
+                      extract=extract_xmls, index=index_annotations,
+                      params={'extract': extract_xmls,
+                              'index': index_annotations},
+                      input_files=zip_paths,
+                      output_files=lambda out: (['bbox.json'] +
+                                                out['annotation_xmls'] +
+                                                out.get('index_files', [])))
+    bbox = out['bbox']
+
+    # get dataset version and set dataset ID
+    version = get_version()
+
+    # get endpoint configurations
+
+    # get DEM configuration
+    dem_type = ctx['dem_type']
+
+    # DEM and water mask stitching only need the bbox and run while
+    # topsApp.py processes the steps that only read the SAFE zips and
+    # orbits. topsApp.py blocks on the DEM at the verifyDEM step.
+    # DEM tiles are shared with the other jobs of the node
+    if ctx.get('dem_tile_cache_dir'):
+        os.environ['DEM_TILE_CACHE_DIR'] = ctx['dem_tile_cache_dir']
+        logger.info(f'Using DEM tile cache {ctx["dem_tile_cache_dir"]}')
+
+    # State vectors of the orbit files are parsed once into a shared cache
+    # (see topsApp_utils/eof_orbit.py)
+    if ctx.get('orbit_cache_dir'):
+        os.environ['ORBIT_CACHE_DIR'] = ctx['orbit_cache_dir']
+        logger.info(f'Using orbit cache {ctx["orbit_cache_dir"]}')
+
+    # Off unless requested in the context
+    overlap_prep = get_bool_param(ctx, 'overlap_ancillary_prep',
+                                  default=False)
+    logger.info('Ancillary data preparation is '
+                f'{"concurrent" if overlap_prep else "sequential"}')
+    executor = ThreadPoolExecutor(max_workers=2)
+    # Off until its DEMs are compared with those of downsampleDEM.py
+    in_process_dem = get_bool_param(ctx, 'in_process_dem_stitch',
+                                    default=False)
+    dem_future = executor.submit(tracker.run, 'dem', stitch_dems,
+                                 bbox, dem_type, in_process_dem,
+                                 params={'bbox': bbox, 'dem_type': dem_type,
+                                         'in_process': in_process_dem},
+                                 output_files=lambda out: list(out.values()),
+                                 background=True)
+    if not overlap_prep:
+        dem_future.result()
+    # Off until its mask is compared with the stitched one on a product
+    in_process_wbd = get_bool_param(ctx, 'in_process_water_mask',
+                                    default=False)
+    wbd_future = executor.submit(tracker.run, 'water_mask_stitch',
+                                 stitch_water_mask, bbox, in_process_wbd,
+                                 params={'bbox': bbox,
+                                         'in_process': in_process_wbd},
+                                 output_files=lambda out: out.get(
+                                     'wbd_tiles', [out.get('wbd_file')]),
+                                 background=True)
+    if not overlap_prep:
+        wbd_future.result()
+    executor.shutdown(wait=False)
+
+    # download auciliary calibration files
+    # (needed by topsApp.py from the preprocess step on)
+    shared_aux_cal_dir = ctx.get('aux_cal_dir')
+    tracker.run('aux_cal', fetch_aux_cal_files, shared_aux_cal_dir,
+                params={'aux_cal_dir': shared_aux_cal_dir},
+                output_files=lambda out: [out['aux_cal_dir']])
+
+    # ESD Computations
+    # ESD is by dafault turned off
+    do_esd = ctx.get('do_esd', False)
+    logger.info(f'ESD computations are {"ON" if do_esd else "OFF"}')
+
+    # create initial input xml without DEMs
+    esd_coh_thresh = 0.85 if do_esd else - 1.
+    master_orbit = ctx['master_orbit_file']
+    slave_orbit = ctx['slave_orbit_file']
+    region_of_interest_str = str(ctx.get('region_of_interest', bbox))
+
+    TEMPLATE_DICT = dict(MASTER_SAFE_DIR=master_zip_file,
+                         SLAVE_SAFE_DIR=slave_zip_file,
+                         MASTER_ORBIT_FILE=master_orbit,
+                         SLAVE_ORBIT_FILE=slave_orbit,
+                         DEM_FILE='',
+                         GEOCODE_DEM_FILE='',
+                         SWATHNUM=str(ctx['swathnum']),
+                         AZIMUTH_LOOKS=ctx['azimuth_looks'],
+                         RANGE_LOOKS=ctx['range_looks'],
+                         FILTER_STRENGTH=ctx['filter_strength'],
+                         REGION_OF_INTEREST=region_of_interest_str,
+                         USE_VIRTUAL_FILES=True,
+                         DO_ESD=do_esd,
+                         ESD_COHERENCE_THRESHOLD=esd_coh_thresh)
+
+    create_input_xml(TEMPLATE_DICT, 'topsApp.xml')
+
+    # get the time before stating topsApp.py
+    topsApp_start_time = datetime.now()
+    logger.info('TopsApp Start Time : {}'.format(topsApp_start_time))
+
+    # run topsApp to the last step before the DEM is used
+    topsapp_inputs = zip_paths + [master_orbit, slave_orbit]
+    tracker.run('topsapp_preprocess', run_topsapp, end='computeBaselines',
+                params={'template': TEMPLATE_DICT},
+                input_files=topsapp_inputs,
+                resumable=True)
+
+    # The topo step (shadow_mask/runTopo.py) reuses the reference geometry
+    # computed by earlier jobs with the same reference bursts and DEM
+    if ctx.get('topo_cache_dir'):
+        os.environ['TOPO_CACHE_DIR'] = ctx['topo_cache_dir']
+        logger.info(f'Using topo cache {ctx["topo_cache_dir"]}')
+
+    # Pairs of a batch decode the burst SLCs of each acquisition once
+    # (see topsApp_utils/burst_slc_cache.py)
+    if ctx.get('topo_cache_dir') and \
+            get_bool_param(ctx, 'share_burst_slcs', default=False):
+        tracker.run('burst_slcs', share_burst_slcs,
+                    GeometryCache.from_env(),
+                    params={'template': TEMPLATE_DICT})
+
+    # wait for the DEMs and add them to the input xml
+    logger.info('Waiting for DEM stitching')
+    out = dem_future.result()
+    preprocess_dem_file = out['preprocess_dem_file']
+    geocode_dem_file = out['geocode_dem_file']
+    TEMPLATE_DICT['DEM_FILE'] = preprocess_dem_file
+    TEMPLATE_DICT['GEOCODE_DEM_FILE'] = geocode_dem_file
+    create_input_xml(TEMPLATE_DICT, 'topsApp.xml')
+
+    # run topsApp to prepesd step
+    topsapp_params = {'template': TEMPLATE_DICT}
+    topsapp_inputs += [preprocess_dem_file, geocode_dem_file]
+    tracker.run('topsapp_prepesd', run_topsapp,
+                start='verifyDEM', end='prepesd',
+                params=topsapp_params,
+                input_files=topsapp_inputs,
+                resumable=True)
+
+    esd_sweep = get_bool_param(ctx, 'esd_sweep')
+    out = tracker.run('topsapp_esd', run_esd,
+                      TEMPLATE_DICT, do_esd, esd_coh_thresh,
+                      sweep=esd_sweep,
+                      params=dict(topsapp_params, esd_sweep=esd_sweep))
+    do_esd = out['do_esd']
+    esd_coh_thresh = out['esd_coh_thresh']
+
+    # the remaining steps use the ESD settings selected above
+    TEMPLATE_DICT['DO_ESD'] = do_esd
+    TEMPLATE_DICT['ESD_COHERENCE_THRESHOLD'] = esd_coh_thresh
+    create_input_xml(TEMPLATE_DICT, 'topsApp.xml')
+
+    # run topsApp from rangecoreg to geocode
+    checkBurstError()
+
+    tracker.run('topsapp_geocode', run_topsapp,
+                start='rangecoreg', end='geocode',
+                params=dict(topsapp_params, **out),
+                resumable=True,
+                output_files=['merged/filt_topophase.unw.geo'])
+
+    # topsApp End Time
+    topsApp_end_time = datetime.now()
+    logger.info('TopsApp End Time : {}'.format(topsApp_end_time))
+
+    topsApp_run_time = topsApp_end_time - topsApp_start_time
+    logger.info('New TopsApp Run Time : {}'.format(topsApp_run_time))
+
+    swath_list = ctx['swathnum'].copy()
+
+    # get radian value for 5-cm wrap. As it is same for all swath,
+    # we will use swathnum = 1
+    rt = parse('master/IW{}.xml'.format(swath_list[0]))
+    wv = eval(rt.xpath(".//property[@name='radarwavelength']/value/text()")[0])
+    rad = 4 * math.pi * .05 / wv
+    logger.info('Radian value for 5-cm wrap is: {}'.format(rad))
+
+    # create id and product directory
+
+    output = get_tops_metadata('fine_interferogram')
+    sensing_start = output['sensingStart']
+    sensing_stop = output['sensingStop']
+    logger.info('sensing_start : %s' % sensing_start)
+    logger.info('sensing_stop : %s' % sensing_stop)
+
+    acq_center_time = get_center_time(sensing_start, sensing_stop)
+
+    ifg_hash = ctx['new_ifg_hash']
+    direction = ctx['direction']
+    platform = ctx['platform']
+    orbit_type = ctx['orbit_type']
+    track = ctx['track_number']
+    slave_ifg_dt = ctx['slc_slave_dt']
+    master_ifg_dt = ctx['slc_master_dt']
+    lats = get_geocoded_lats('merged/filt_topophase.unw.geo.vrt')
+
+    logger.info(f'lats : {lats}')
+    logger.info(f'max(lats): {max(lats)}: {convert_number(max(lats))}')
+    logger.info(f'min(lats): {min(lats)}: {convert_number(min(lats))}')
+
+    sorted_lats_temp = sorted(lats)[-2]
+    num = convert_number(sorted_lats_temp)
+    logger.info(f'sorted(lats)[-2] : {sorted_lats_temp}: {num}')
+    sorted_lats_temp = sorted(lats)[1]
+    num = convert_number(sorted_lats_temp)
+    logger.info(f'sorted(lats)[1]{sorted_lats_temp} : {num}')
+
+    sat_direction = 'D'
+    logger.info('sat_direction : {}'.format(sat_direction))
+
+    west_lat = '{}_{}'.format(convert_number(sorted(lats)[-2]),
+                              convert_number(min(lats)))
+
+    if direction.lower() == 'asc':
+        sat_direction = 'A'
+        west_lat = '{}_{}'.format(convert_number(max(lats)),
+                                  convert_number(sorted(lats)[1]))
+
+    ifg_hash = ifg_hash[0:4]
+    logger.info('slc_master_dt : %s,slc_slave_dt : %s' % (slc_master_dt,
+                                                          slc_slave_dt))
+    id_tmpl_merged = 'S1-GUNW-MERGED_R{}_M{:d}S{:d}_TN{:03d}_{}-{}_s123-{}-{}'
+    ifg_id_merged = id_tmpl_merged.format('M',
+                                          len(master_ids),
+                                          len(slave_ids),
+                                          track,
+                                          master_ifg_dt,
+                                          slave_ifg_dt,
+                                          orbit_type,
+                                          ifg_hash)
+    logger.info('ifg_id_merged : %s' % ifg_id_merged)
+
+    ifg_id = IFG_ID_SP_TMPL.format(sat_direction,
+                                   'R',
+                                   track,
+                                   master_ifg_dt.split('T')[0],
+                                   slave_ifg_dt.split('T')[0],
+                                   acq_center_time,
+                                   west_lat, ifg_hash,
+                                   version.replace('.', '_'))
+    id = ifg_id
+
+    logger.info('id : %s' % ifg_id)
+    logger.info('ifg_id_merged : %s' % ifg_id_merged)
+
+    prod_dir = ifg_id
+
+    logger.info('prod_dir : %s' % prod_dir)
+
+    os.makedirs(prod_dir, 0o755, exist_ok=True)
+
+    # The water mask stitching uses paths relative to the work directory,
+    # which make_geocube and package_product change
+    logger.info('Waiting for water mask stitching')
+    wbd_out = wbd_future.result()
+
+    # make metadata geocube
+    tracker.run('geocube', make_geocube, ctx.get('geocube_cores'),
+                params={'ifg_id': ifg_id},
+                output_files=lambda out: [out['metadata_file']])
+
+    # create standard product packaging
+    out = tracker.run('packaging', package_product, ifg_id, prod_dir,
+                      params={'ifg_id': ifg_id},
+                      output_files=lambda out: [out['nc_file']])
+    std_prod_file = out['std_prod_file']
+
+    fine_int_xmls = []
+    for swathnum in swath_list:
+        fine_int_xmls.append('fine_interferogram/IW{}.xml'.format(swathnum))
+
+    # get water mask cropped to the product
+    out = wbd_out
+    if 'wbd_tiles' in out:
+        out = tracker.run('water_mask', make_product_water_mask,
+                          out['wbd_tiles'],
+                          params=out,
+                          output_files=lambda out: [out['wbd_cropped_file']])
     else:
-        orbit_type = 'poeorb'
-    scene_count = min(len(master_zip_file), len(slave_zip_file))
-    master_mission = MISSION_RE.search(master_zip_file[0]).group(1)
-    slave_mission = MISSION_RE.search(slave_zip_file[0]).group(1)
-    unw_vrt = 'filt_topophase.unw.geo.vrt'
-    unw_xml = 'filt_topophase.unw.geo.xml'
-    cmd_path = (f'{topsApp_util_dir}/update_met_json_standard_product.py')
-    update_met_cmd = (cmd_path + ' {} {} "{}"'
-                      ' {} {} {} "{}" {}/{} {}/{} {} {} {} {}')
-    check_call(update_met_cmd.format(orbit_type, scene_count,
-                                     ctx['swathnum'], master_mission,
-                                     slave_mission, 'PICKLE',
-                                     fine_int_xmls,
-                                     'merged', unw_vrt,
-                                     'merged', unw_xml,
-                                     met_file, sensing_start,
-                                     sensing_stop, std_prod_file), shell=True)
+        out = tracker.run('water_mask', crop_water_mask, out['wbd_file'],
+                          params=out,
+                          output_files=lambda out: [
+                              out['wbd_cropped_file']])
+    wbd_cropped_file = out['wbd_cropped_file']
+
+    out = tracker.run('masking', mask_product, wbd_cropped_file,
+                      output_files=lambda out: [out['masked_file']])
+    vrt_prod_file_dis = out['vrt_prod_file_dis']
+
+    tracker.run('tiles', create_browse_and_tiles,
+                vrt_prod_file_dis, prod_dir, id,
+                params={'ifg_id': ifg_id},
+                output_files=lambda out: [out['tiles_dir']])
+
+    # extract metadata from master
+    with telemetry.measure('met_update'):
+        met_file = os.path.join(prod_dir, '{}.met.json'.format(id))
+        frame_metadata_dir = os.environ['TOPSAPP'] + '/frameMetadata'
+        if extract_xmls:
+            extract_cmd_tmpl = ('{}/extractMetadata_standard_product.sh -i '
+                                '{}/annotation/s1?-iw?-slc-{}-*.xml -o {}')
+            master_safe = master_zip_file[0].replace('.zip', '.SAFE')
+        else:
+            extract_cmd_tmpl = ('{}/extractMetadata_standard_product.sh '
+                                '-z {} -p {} -o {}')
+            master_safe = master_zip_file[0]
+        check_call(extract_cmd_tmpl.format(frame_metadata_dir,
+                                           master_safe,
+                                           master_pol,
+                                           met_file),
+                   shell=True)
+
+        # update met JSON
+        if (('RESORB' in ctx['master_orbit_file']) or
+           ('RESORB' in ctx['slave_orbit_file'])):
+            orbit_type = 'resorb'
+        else:
+            orbit_type = 'poeorb'
+        scene_count = min(len(master_zip_file), len(slave_zip_file))
+        master_mission = MISSION_RE.search(master_zip_file[0]).group(1)
+        slave_mission = MISSION_RE.search(slave_zip_file[0]).group(1)
+        unw_vrt = 'filt_topophase.unw.geo.vrt'
+        unw_xml = 'filt_topophase.unw.geo.xml'
+        topsApp_util_dir = os.environ['TOPSAPP'] + '/topsApp_utils'
+        cmd_path = (f'{topsApp_util_dir}/update_met_json_standard_product.py')
+        update_met_cmd = (cmd_path + ' {} {} "{}"'
+                          ' {} {} {} "{}" {}/{} {}/{} {} {} {} {}')
+        check_call(update_met_cmd.format(orbit_type, scene_count,
+                                         ctx['swathnum'], master_mission,
+                                         slave_mission, 'PICKLE',
+                                         fine_int_xmls,
+                                         'merged', unw_vrt,
+                                         'merged', unw_xml,
+                                         met_file, sensing_start,
+                                         sensing_stop, std_prod_file),
+                   shell=True)
 
     # add master/slave ids and orbits to met JSON (per ASF request)
     master_ids = [i.replace('.zip', '') for i in ctx['master_zip_file']]
@@ -1757,10 +2045,12 @@ def main():
 
     # Include runtime stats in metadata file
     md['runtime_in_seconds'] = round(complete_run_time.total_seconds(), 2)
-    root_directory = Path('.')
-    nbytes = sum(f.stat().st_size
-                 for f in root_directory.glob('**/*') if f.is_file())
-    md['scratch_disk_at_completion_bytes'] = nbytes
+    performance = telemetry.summary()
+    # Size of the work directory, tracked incrementally by the telemetry
+    md['scratch_disk_at_completion_bytes'] = performance['scratch_disk_bytes']
+    md['performance'] = performance
+    telemetry.write_sidecar()
+    telemetry.stop()
 
     # write met json
     logger.info('creating met file : %s' % met_file)
@@ -1790,7 +2080,11 @@ def updateErrorFiles(msg):
 
 
 if __name__ == '__main__':
+    logging.basicConfig(filename=LOG_NAME,
+                        format=log_format,
+                        level=logging.INFO)
     wd = os.getcwd()
+    load_job_context(os.path.join(wd, '_context.json'))
 
     try:
         status = main()
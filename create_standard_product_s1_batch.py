@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Batch mode of the GUNW PGE for a network of pairs of one track and frame.
+
+The `input_metadata` of the context is a list of ifg-cfgs. All inputs of the
+batch are localized once into the work directory, the duplicate check of
+all pairs is a single GRQ request and the auxiliary calibration files are
+fetched once. Each pair is then processed by create_standard_product_s1.py
+in `pairs/<ifg-cfg id>` with links to the shared inputs, so that it yields
+exactly the product of a single-pair job, and its dataset is moved to the
+work directory. Pairs are run grouped by reference acquisition.
+
+The burst SLCs of each acquisition are decoded from its SAFE zips once,
+by the first pair using it, and shared with its other pairs through the
+topo cache (see topsApp_utils/burst_slc_cache.py). Acquisitions are not
+coregistered once for the network: topsApp coregisters and deramps the
+secondary bursts of each pair on its own, as coregistering against a
+common reference would change the products.
+"""
+import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import create_standard_product_s1 as single_pair
+from topsApp_utils.context_checks import (check_pipeline,
+                                          check_input_metadata,
+                                          check_polarization)
+from topsApp_utils.pair_batch import (check_common_track,
+                                      check_localized,
+                                      get_acquisitions,
+                                      order_pairs,
+                                      setup_pair_dir,
+                                      get_product_dirs,
+                                      log_plan)
+
+LOG_NAME = 'standard_product_s1_batch.log'
+STATUS_FILE = '_batch_status.json'
+TOPO_CACHE_DIR = 'topo_cache'
+DEM_TILE_CACHE_DIR = 'dem_tile_cache'
+ORBIT_CACHE_DIR = 'orbit_cache'
+
+log_format = '[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s'
+logger = logging.getLogger('create_ifg_batch')
+
+
+def get_batch_cfgs(ctx: dict) -> list:
+    cfgs = ctx['input_metadata']
+    if type(cfgs) is not list:
+        cfgs = [cfgs]
+    return cfgs
+
+
+def check_batch(cfgs: list):
+    check_common_track(cfgs)
+    for cfg in cfgs:
+        check_pipeline(cfg.get('tags', []), single_pair.JOB_NAME)
+        check_input_metadata(cfg)
+        check_polarization(cfg['master_zip_file'], cfg['slave_zip_file'])
+    check_localized(cfgs)
+
+
+def get_existing_pairs(cfgs: list, ctx: dict) -> set:
+    """Ids of the ifg-cfgs whose GUNW exists, from one multi-search."""
+    from topsApp_utils.gunw_lookup import (get_grq_client,
+                                           find_existing_gunws)
+
+    es_url = single_pair.SETTINGS_DICT['GRQ_URL']
+    if ctx.get('local_test', False):
+        es_url = es_url + '/es'
+    version = single_pair.get_version()
+    pairs = [(cfg['master_scenes'], cfg['slave_scenes'], version)
+             for cfg in cfgs]
+    exists = find_existing_gunws(pairs,
+                                 get_grq_client(es_url,
+                                                single_pair.HTTP_AUTH),
+                                 single_pair.ES_INDEX)
+    return {cfg['id'] for cfg, found in zip(cfgs, exists) if found}
+
+
+def run_pair(pair_dir: str) -> int:
+    """Run the single-pair PGE as create_standard_product_s1.sh does."""
+    script = os.path.join(single_pair.TOPS_APP_PATH,
+                          'create_standard_product_s1.py')
+    logger.info(f'Processing {pair_dir}')
+    with open(os.path.join(pair_dir, single_pair.LOG_NAME), 'w') as log:
+        proc = subprocess.run([sys.executable, script],
+                              cwd=pair_dir,
+                              stdout=log,
+                              stderr=subprocess.STDOUT)
+    logger.info(f'Finished {pair_dir} with exit status {proc.returncode}')
+    return proc.returncode
+
+
+def collect_products(pair_dir: str, batch_dir: str = '.') -> list:
+    """Move the datasets of a pair to the work directory for publishing."""
+    products = []
+    for product_dir in get_product_dirs(pair_dir):
+        name = os.path.basename(product_dir)
+        dst = os.path.join(batch_dir, name)
+        if os.path.exists(dst):
+            shutil.rmtree(dst)
+        shutil.move(product_dir, dst)
+        products.append(name)
+    return products
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('context', nargs='?', default='_context.json')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='Pairs processed concurrently (default: '
+                             'batch_max_workers of the context or 1)')
+    args = parser.parse_args()
+
+    ctx = single_pair.load_job_context(args.context)
+    cfgs = get_batch_cfgs(ctx)
+    check_batch(cfgs)
+    log_plan(cfgs, get_acquisitions(cfgs))
+
+    status = {cfg['id']: {'status': 'pending'} for cfg in cfgs}
+    if not ctx.get('testing', False):
+        for ifg_cfg_id in get_existing_pairs(cfgs, ctx):
+            logger.info(f'GUNW of {ifg_cfg_id} exists; skipping')
+            status[ifg_cfg_id]['status'] = 'exists'
+    todo = [cfg for cfg in order_pairs(cfgs)
+            if status[cfg['id']]['status'] == 'pending']
+
+    # Shared by all pairs
+    shared = {}
+    if todo:
+        out = single_pair.fetch_aux_cal_files()
+        shared['aux_cal_dir'] = os.path.abspath(out['aux_cal_dir'])
+        # Pairs with the same reference reuse its geometry, and the pairs
+        # of an acquisition its burst SLCs decoded once
+        shared['topo_cache_dir'] = os.path.abspath(
+            ctx.get('topo_cache_dir', TOPO_CACHE_DIR))
+        shared['share_burst_slcs'] = single_pair.get_bool_param(
+            ctx, 'share_burst_slcs')
+        shared['dem_tile_cache_dir'] = os.path.abspath(
+            ctx.get('dem_tile_cache_dir', DEM_TILE_CACHE_DIR))
+        shared['orbit_cache_dir'] = os.path.abspath(
+            ctx.get('orbit_cache_dir', ORBIT_CACHE_DIR))
+
+    pair_dirs = [setup_pair_dir(ctx, cfg, shared) for cfg in todo]
+    max_workers = args.max_workers or int(ctx.get('batch_max_workers', 1))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return_codes = list(executor.map(run_pair, pair_dirs))
+
+    for cfg, pair_dir, return_code in zip(todo, pair_dirs, return_codes):
+        pair_status = status[cfg['id']]
+        pair_status['returncode'] = return_code
+        pair_status['pair_dir'] = pair_dir
+        if return_code == 0:
+            pair_status['status'] = 'done'
+            pair_status['products'] = collect_products(pair_dir)
+        else:
+            pair_status['status'] = 'failed'
+
+    with open(STATUS_FILE, 'w') as f:
+        json.dump(status, f, indent=2)
+
+    failed = [ifg_cfg_id for ifg_cfg_id, pair_status in status.items()
+              if pair_status['status'] == 'failed']
+    if failed:
+        raise RuntimeError(f'{len(failed)} of {len(cfgs)} pairs failed: '
+                           f'{", ".join(failed)}')
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename=LOG_NAME,
+                        format=log_format,
+                        level=logging.INFO)
+    sys.exit(main())
@@ -29,11 +29,19 @@ from isceobj.Orbit.OrbitExtender import OrbitExtender
 from isceobj.Planet.AstronomicalHandbook import Const
 from iscesys.Component.Component import Component
 from iscesys.DateTimeUtil.DateTimeUtil import DateTimeUtil as DTUtil
+from topsApp_utils.annotation_index import extract_record
+from topsApp_utils.eof_orbit import load_state_vectors
+from topsApp_utils.validity_index import get_index, ORBIT, AUX_CAL
 import os
 import glob
 import numpy as np
 import shelve
 import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+####Lines of the burst SLCs written at a time
+BLOCK_LINES = 256
 
 sep = "\n"
 tab = "    "
@@ -59,18 +67,26 @@ class Sentinel1_TOPS(Component):
         self.bursts = []
 
         self._xml_root=None
+        ####Record of the annotation (see topsApp_utils/annotation_index.py)
+        self.record=None
         self.descriptionOfVariables = {}
         self.dictionaryOfVariables = {'XML': ['self.xml','str','mandatory'],
                                       'TIFF': ['self.tiff','str','mandatory'],
                                       'PREFIX': ['self.prefix','str','optional']}
 
     def parse(self):
-        try:
-            fp = open(self.xml,'r')
-        except IOError as strerr:
-            print("IOError: %s" % strerr)
-            return
-        self._xml_root = ElementTree(file=fp).getroot()
+        ####Annotation may already be parsed, e.g. when read from the zip,
+        ####or loaded from the annotation index
+        if self.record is None:
+            if self._xml_root is None:
+                try:
+                    fp = open(self.xml,'r')
+                except IOError as strerr:
+                    print("IOError: %s" % strerr)
+                    return
+                self._xml_root = ElementTree(file=fp).getroot()
+                fp.close()
+            self.record = extract_record(self._xml_root)
         self.numberBursts = self.getNumberOfBursts()
 
         for kk in range(self.numberBursts):
@@ -101,8 +117,6 @@ class Sentinel1_TOPS(Component):
             for sv in orb:
                 burst.orbit.addStateVector(sv)
 
-        fp.close()
-
         self.populateIPFVersion()
 
         if self.IPFversion == '002.36':
@@ -154,45 +168,46 @@ class Sentinel1_TOPS(Component):
         return dt
 
     def getNumberOfBursts(self):
-        return int(self.getxmlattr('swathTiming/burstList', 'count'))
+        return len(self.record['bursts'])
 
 
     def populateCommonMetadata(self):
         """
             Create metadata objects from the metadata files
         """
+        rec = self.record
+
         ####Set each parameter one - by - one
-        mission = self.getxmlvalue('adsHeader/missionId')
-        swath = self.getxmlvalue('adsHeader/swath')
-        polarization = self.getxmlvalue('adsHeader/polarisation')
-        orbitnumber = int(self.getxmlvalue('adsHeader/absoluteOrbitNumber'))
-        frequency = float(self.getxmlvalue('generalAnnotation/productInformation/radarFrequency'))
-        passDirection = self.getxmlvalue('generalAnnotation/productInformation/pass')
-
-        rangeSampleRate = float(self.getxmlvalue('generalAnnotation/productInformation/rangeSamplingRate'))
-#        rangePixelSize = float(self.getxmlvalue('imageAnnotation/imageInformation/rangePixelSpacing'))
+        mission = rec['mission_id']
+        swath = rec['swath']
+        polarization = rec['polarisation']
+        orbitnumber = rec['absolute_orbit_number']
+        frequency = rec['radar_frequency']
+        passDirection = rec['pass']
+
+        rangeSampleRate = rec['range_sampling_rate']
         rangePixelSize = old_div(Const.c,(2.0*rangeSampleRate))
-        azimuthPixelSize = float(self.getxmlvalue('imageAnnotation/imageInformation/azimuthPixelSpacing'))
-        azimuthTimeInterval = float(self.getxmlvalue('imageAnnotation/imageInformation/azimuthTimeInterval'))
+        azimuthPixelSize = rec['azimuth_pixel_spacing']
+        azimuthTimeInterval = rec['azimuth_time_interval']
 
-        lines = int(self.getxmlvalue('swathTiming/linesPerBurst'))
-        samples = int(self.getxmlvalue('swathTiming/samplesPerBurst'))
+        lines = rec['lines_per_burst']
+        samples = rec['samples_per_burst']
 
-        slantRangeTime = float(self.getxmlvalue('imageAnnotation/imageInformation/slantRangeTime'))
-        startingRange = float(self.getxmlvalue('imageAnnotation/imageInformation/slantRangeTime'))*Const.c/2.0
-        incidenceAngle = float(self.getxmlvalue('imageAnnotation/imageInformation/incidenceAngleMidSwath'))
-        steeringRate = np.radians(float( self.getxmlvalue('generalAnnotation/productInformation/azimuthSteeringRate')))
+        slantRangeTime = rec['slant_range_time']
+        startingRange = rec['slant_range_time']*Const.c/2.0
+        incidenceAngle = rec['incidence_angle_mid_swath']
+        steeringRate = np.radians(rec['azimuth_steering_rate'])
 
-        slantRangeTimeSub = self.getxmlvalue('antennaPattern/antennaPatternList/antennaPattern/slantRangeTime')
-        elevationAngle = self.getxmlvalue('antennaPattern/antennaPatternList/antennaPattern/elevationAngle')
+        slantRangeTimeSub = rec['antenna_slant_range_time']
+        elevationAngle = rec['antenna_elevation_angle']
 
-        prf = float(self.getxmlvalue('generalAnnotation/downlinkInformationList/downlinkInformation/prf'))
-        terrainHeight = float(self.getxmlvalue('generalAnnotation/terrainHeightList/terrainHeight/value'))
+        prf = rec['prf']
+        terrainHeight = rec['terrain_height']
         ####Sentinel is always right looking
         lookSide = -1
 
         ###Read ascending node for phase calibration
-        ascTime = self.convertToDateTime(self.getxmlvalue('imageAnnotation/imageInformation/ascendingNodeTime'))
+        ascTime = self.convertToDateTime(rec['ascending_node_time'])
 
         for burst in self.bursts:
             burst.numberOfSamples = samples
@@ -213,30 +228,29 @@ class Sentinel1_TOPS(Component):
             burst.ascendingNodeTime = ascTime
             burst.rangeSampleRate = rangeSampleRate
             burst.slantRangeTime = slantRangeTime
-            burst.slantRangeTimeSub = [float(val) for val in slantRangeTimeSub.split()]
-            burst.elevationAngle = [float(val) for val in elevationAngle.split()]
+            burst.slantRangeTimeSub = list(slantRangeTimeSub)
+            burst.elevationAngle = list(elevationAngle)
 
     def populateBurstSpecificMetadata(self):
         '''
         Extract burst specific metadata from the xml file.
         '''
 
-        burstList = self.getxmlelement('swathTiming/burstList')
-        for index, burst in enumerate(burstList.getchildren()):
+        for index, burst in enumerate(self.record['bursts']):
             bb = self.bursts[index]
-            bb.sensingStart = self.convertToDateTime(burst.find('azimuthTime').text)
+            bb.sensingStart = self.convertToDateTime(burst['azimuth_time'])
             deltaT = datetime.timedelta(seconds=(bb.numberOfLines - 1)*bb.azimuthTimeInterval)
             bb.sensingStop = bb.sensingStart + deltaT
 
             bb.sensingMid = bb.sensingStart + datetime.timedelta(seconds = 0.5 * deltaT.total_seconds())
 
-            bb.startUTC = self.convertToDateTime(burst.find('sensingTime').text)
+            bb.startUTC = self.convertToDateTime(burst['sensing_time'])
             deltaT = datetime.timedelta(seconds=old_div((bb.numberOfLines-1),bb.prf))
             bb.stopUTC = bb.startUTC + deltaT
             bb.midUTC  = bb.startUTC + datetime.timedelta(seconds = 0.5*deltaT.total_seconds())
 
-            firstValidSample = [int(val) for val in burst.find('firstValidSample').text.split()]
-            lastValidSample = [int(val) for val in burst.find('lastValidSample').text.split()]
+            firstValidSample = burst['first_valid_sample']
+            lastValidSample = burst['last_valid_sample']
 
             first=False
             last=False
@@ -258,19 +272,12 @@ class Sentinel1_TOPS(Component):
             bb.numValidSamples = lastSample - bb.firstValidSample
 
         ####Read in fm rates separately
-        fmrateList = self.getxmlelement('generalAnnotation/azimuthFmRateList')
         fmRates = []
-        for index, burst in enumerate(fmrateList.getchildren()):
-            r0 = 0.5 * Const.c * float(burst.find('t0').text)
-            try:
-                c0 = float(burst.find('c0').text)
-                c1 = float(burst.find('c1').text)
-                c2 = float(burst.find('c2').text)
-                coeffs = [c0,c1,c2]
-            except AttributeError:
-                coeffs = [float(val) for val in burst.find('azimuthFmRatePolynomial').text.split()]
-
-            refTime = self.convertToDateTime(burst.find('azimuthTime').text)
+        for index, burst in enumerate(self.record['fm_rates']):
+            r0 = 0.5 * Const.c * burst['t0']
+            coeffs = burst['coeffs']
+
+            refTime = self.convertToDateTime(burst['azimuth_time'])
             poly = Poly1D.Poly1D()
             poly.initPoly(order=len(coeffs)-1)
             poly.setMean(r0)
@@ -290,13 +297,12 @@ class Sentinel1_TOPS(Component):
 
 
 
-        dcList = self.getxmlelement('dopplerCentroid/dcEstimateList')
         dops = [ ]
-        for index, burst in enumerate(dcList.getchildren()):
+        for index, burst in enumerate(self.record['dc_estimates']):
 
-            r0 = 0.5 * Const.c* float(burst.find('t0').text)
-            refTime = self.convertToDateTime(burst.find('azimuthTime').text)
-            coeffs = [float(val) for val in burst.find('dataDcPolynomial').text.split()]
+            r0 = 0.5 * Const.c* burst['t0']
+            refTime = self.convertToDateTime(burst['azimuth_time'])
+            coeffs = burst['coeffs']
             poly = Poly1D.Poly1D()
             poly.initPoly(order=len(coeffs)-1)
             poly.setMean(r0)
@@ -345,97 +351,53 @@ class Sentinel1_TOPS(Component):
         Find correct orbit file in the orbit directory.
         '''
 
-        datefmt = "%Y%m%dT%H%M%S"
         types = ['POEORB', 'RESORB']
-        match = []
         nbursts = len(self.bursts)
         timeStamp = self.bursts[nbursts//2].sensingMid
+        mission = self.record['mission_id']
 
+        ####Files spanning the acquisition, looked up in the directory index
+        index = get_index(self.orbitDir, ORBIT)
         for orbType in types:
-            files = glob.glob( os.path.join(self.orbitDir, 'S1?_OPER_AUX_' + orbType + '_OPOD*'))
+            #####Return the file with the image is aligned best to the middle of the file
+            result = index.find(timeStamp, mission=mission, file_type=orbType)
+            if result is not None:
+                return result
 
-            ###List all orbit files
-            for result in files:
-                fields = result.split('_')
-                taft = datetime.datetime.strptime(fields[-1][0:15], datefmt)
-                tbef = datetime.datetime.strptime(fields[-2][1:16], datefmt)
-
-                #####Get all files that span the acquisition
-                if (tbef <= timeStamp) and (taft >= timeStamp):
-                    tmid = tbef + 0.5 * (taft - tbef)
-                    match.append((result, abs((timeStamp-tmid).total_seconds())))
-
-                #####Return the file with the image is aligned best to the middle of the file
-                if len(match) != 0:
-#                    print('Matches: ', match)
-                    bestmatch = min(match, key = lambda x: x[1])
-#                    print('Best match: ', bestmatch)
-                    return bestmatch[0]
-
-
-            if len(match) == 0:
-                 raise Exception('No suitable orbit file found. If you want to process anyway - unset the orbitdir parameter')
+        raise Exception('No suitable orbit file found. If you want to process anyway - unset the orbitdir parameter')
 
     def findAuxFile(self):
         '''
         Find appropriate auxiliary information file.
         '''
 
-        datefmt = "%Y%m%dT%H%M%S"
-
-        match = []
         nbursts = len(self.bursts)
         timeStamp = self.bursts[nbursts//2].sensingMid
-
-        files = glob.glob(os.path.join(self.auxDir, 'S1?_AUX_CAL_*'))
-
-        ###List all orbit files
-        for result in files:
-            fields = result.split('_')
-            taft = datetime.datetime.strptime(fields[-1][1:16], datefmt)
-            tbef = datetime.datetime.strptime(fields[-2][1:16], datefmt)
-
-            #####Get all files that span the acquisition
-            if (tbef <= timeStamp) and (taft >= timeStamp):
-                tmid = tbef + 0.5 * (taft - tbef)
-                match.append((result, abs((timeStamp-tmid).total_seconds())))
+        mission = self.record['mission_id']
 
         #####Return the file with the image is aligned best to the middle of the file
-        if len(match) != 0:
-#            print('Matches: ', match)
-            bestmatch = min(match, key = lambda x: x[1])
-#            print('Best match: ', bestmatch)
-            return glob.glob(os.path.join(bestmatch[0], 'data/s1?-aux-cal.xml'))[0]
+        result = get_index(self.auxDir, AUX_CAL).find(timeStamp, mission=mission)
+        if result is not None:
+            return glob.glob(os.path.join(result, 'data/s1?-aux-cal.xml'))[0]
 
+        print('******************************************')
+        print('Warning: Aux file requested but no suitable auxiliary file found.')
+        print('******************************************')
 
-            if len(match) == 0:
-                print('******************************************')
-                print('Warning: Aux file requested but no suitable auxiliary file found.')
-                print('******************************************')
-
-            return None
+        return None
 
     def extractOrbit(self):
         '''
-        Extract orbit information from xml node.
+        Extract orbit information from the annotation record.
         '''
-        node = self._xml_root.find('generalAnnotation/orbitList')
-
         print('Extracting orbit from annotation XML file')
         frameOrbit = Orbit()
         frameOrbit.configure()
 
-        for child in node.getchildren():
-            timestamp = self.convertToDateTime(child.find('time').text)
-            pos = []
-            vel = []
-            posnode = child.find('position')
-            velnode = child.find('velocity')
-            for tag in ['x','y','z']:
-                pos.append(float(posnode.find(tag).text))
-
-            for tag in ['x','y','z']:
-                vel.append(float(velnode.find(tag).text))
+        for child in self.record['orbit']:
+            timestamp = self.convertToDateTime(child['time'])
+            pos = list(child['position'])
+            vel = list(child['velocity'])
 
             vec = StateVector()
             vec.setTime(timestamp)
@@ -456,17 +418,15 @@ class Sentinel1_TOPS(Component):
     def extractPreciseOrbit(self):
         '''
         Extract precise orbit from given Orbit file.
+
+        The state vectors come from the sidecar cache of the orbit file or,
+        on a miss, from parsing it once into the cache
+        (see topsApp_utils/eof_orbit.py).
         '''
-        try:
-            fp = open(self.orbitFile,'r')
-        except IOError as strerr:
-            print("IOError: %s" % strerr)
+        if not os.path.isfile(self.orbitFile):
+            print("IOError: orbit file %s not found" % self.orbitFile)
             return
 
-        _xml_root = ElementTree(file=fp).getroot()
-
-        node = _xml_root.find('Data_Block/List_of_OSVs')
-
         print('Extracting orbit from Orbit File: ', self.orbitFile)
         orb = Orbit()
         orb.configure()
@@ -475,36 +435,25 @@ class Sentinel1_TOPS(Component):
         tstart = self.bursts[0].sensingStart - margin
         tend = self.bursts[-1].sensingStop + margin
 
-        for child in node.getchildren():
-            timestamp = self.convertToDateTime(child.find('UTC').text[4:])
-
-            if (timestamp >= tstart) and (timestamp < tend):
-
-                pos = []
-                vel = []
-
-                for tag in ['VX','VY','VZ']:
-                    vel.append(float(child.find(tag).text))
-
-                for tag in ['X','Y','Z']:
-                    pos.append(float(child.find(tag).text))
-
-                vec = StateVector()
-                vec.setTime(timestamp)
-                vec.setPosition(pos)
-                vec.setVelocity(vel)
-#                print(vec)
-                orb.addStateVector(vec)
-
-        fp.close()
+        osvs = load_state_vectors(self.orbitFile, tstart, tend)
+        for timestamp, pos, vel in zip(osvs['times'].astype(datetime.datetime),
+                                       osvs['positions'].tolist(),
+                                       osvs['velocities'].tolist()):
+            vec = StateVector()
+            vec.setTime(timestamp)
+            vec.setPosition(pos)
+            vec.setVelocity(vel)
+            orb.addStateVector(vec)
 
         return orb
 
 
     def extractImage(self, nameOffset=0, action=True, parse=True,
-            width=None, length = None):
+            width=None, length = None, numThreads=None):
         """
-           Use gdal python bindings to extract image
+           Use gdal python bindings to extract image. The bursts are
+           extracted by a pool of numThreads threads (default:
+           OMP_NUM_THREADS or the number of CPUs).
         """
         try:
             from osgeo import gdal
@@ -523,10 +472,10 @@ class Sentinel1_TOPS(Component):
             length = self.bursts[0].numberOfLines
 
         src = gdal.Open(self.tiff.strip(), gdal.GA_ReadOnly)
-        band = src.GetRasterBand(1)
 
         print('Total Width  = %d'%(src.RasterXSize))
         print('Total Length = %d'%(src.RasterYSize))
+        src = None
 
         if os.path.isdir(self.outdir):
             print('Output directory {0} already exists.'.format(self.outdir))
@@ -534,38 +483,21 @@ class Sentinel1_TOPS(Component):
             print('Creating directory {0} '.format(self.outdir))
             os.makedirs(self.outdir)
 
-        for index, burst in enumerate(self.bursts):
-            outfile = os.path.join(self.outdir, 'burst_%02d'%(nameOffset+index+1) + '.slc')
-            originalWidth = burst.numberOfSamples
-            originalLength = burst.numberOfLines
-
-            if action:
-                ###Write original SLC to file
-                fid = open(outfile, 'wb')
-
-                ####Use burstnumber to look into tiff file
-                lineOffset = (burst.burstNumber-1) * burst.numberOfLines
-
-                ###Read whole burst for debugging. Only valid part is used.
-                data = band.ReadAsArray(0, lineOffset, burst.numberOfSamples, burst.numberOfLines)
+        outfiles = [os.path.join(self.outdir, 'burst_%02d'%(nameOffset+index+1) + '.slc')
+                    for index in range(len(self.bursts))]
 
-                ###Create output array and copy in valid part only
-                ###Easier then appending lines and columns.
-                outdata = np.zeros((length,width), dtype=np.complex64)
-                outdata[burst.firstValidLine:burst.lastValidLine, burst.firstValidSample:burst.lastValidSample] =  data[burst.firstValidLine:burst.lastValidLine, burst.firstValidSample:burst.lastValidSample]
-
-                ###################################################################################
-                #Check if IPF version is 2.36 we need to correct for the Elevation Antenna Pattern
-                if burst.IPFversion == '002.36':
-                   print('The IPF version is 2.36. Correcting the Elevation Antenna Pattern ...')
-                   Geap = self.elevationAntennaPattern(burst)
-                   for i in range(burst.firstValidLine, burst.lastValidLine):
-                       outdata[i, burst.firstValidSample:burst.lastValidSample] = old_div(outdata[i, burst.firstValidSample:burst.lastValidSample],Geap[burst.firstValidSample:burst.lastValidSample])
-                ########################
-
-                outdata.tofile(fid)
-                fid.close()
+        if action:
+            ####Bursts are extracted concurrently; GDAL and numpy release the GIL
+            if numThreads is None:
+                numThreads = int(os.environ.get('OMP_NUM_THREADS', 0)) or os.cpu_count()
+            numThreads = max(1, min(numThreads, len(self.bursts)))
+            with ThreadPoolExecutor(max_workers=numThreads) as executor:
+                for _ in executor.map(lambda args: self.extractBurst(*args, width=width, length=length),
+                                      zip(self.bursts, outfiles)):
+                    pass
 
+        for burst, outfile in zip(self.bursts, outfiles):
+            if action:
                 #Updated width and length to match extraction
                 burst.numberOfSamples = width
                 burst.numberOfLines = length
@@ -582,35 +514,98 @@ class Sentinel1_TOPS(Component):
             slcImage.renderHdr()
             burst.image = slcImage
 
+    def extractBurst(self, burst, outfile, width, length):
+        '''
+        Write the valid part of a burst into a zero filled length x width SLC.
+
+        Only the valid window of the burst is read from the TIFF and the SLC is
+        written in blocks of BLOCK_LINES lines.
+        '''
+        from osgeo import gdal
+
+        ####Use burstnumber to look into tiff file
+        lineOffset = (burst.burstNumber-1) * burst.numberOfLines
+
+        ####Valid window, within the burst and the output
+        firstLine = burst.firstValidLine
+        lastLine = min(burst.lastValidLine, burst.numberOfLines, length)
+        firstSample = burst.firstValidSample
+        lastSample = min(burst.lastValidSample, burst.numberOfSamples, width)
+
+        ###################################################################################
+        #Check if IPF version is 2.36 we need to correct for the Elevation Antenna Pattern
+        Geap = None
+        if burst.IPFversion == '002.36':
+            print('The IPF version is 2.36. Correcting the Elevation Antenna Pattern ...')
+            Geap = self.elevationAntennaPattern(burst)[firstSample:lastSample]
+        ########################
+
+        ####Each thread reads through its own dataset
+        src = gdal.Open(self.tiff.strip(), gdal.GA_ReadOnly)
+        band = src.GetRasterBand(1)
+
+        with open(outfile, 'wb') as fid:
+            for start in range(0, length, BLOCK_LINES):
+                stop = min(start + BLOCK_LINES, length)
+                outdata = np.zeros((stop - start, width), dtype=np.complex64)
+
+                ####Valid lines of the block
+                validStart = max(start, firstLine)
+                validStop = min(stop, lastLine)
+                if (validStart < validStop) and (firstSample < lastSample):
+                    data = band.ReadAsArray(firstSample, lineOffset + validStart,
+                                            lastSample - firstSample, validStop - validStart).astype(np.complex64)
+                    if Geap is not None:
+                        data = old_div(data, Geap)
+                    outdata[validStart-start:validStop-start, firstSample:lastSample] = data
+
+                outdata.tofile(fid)
+
         band = None
         src = None
 
-    def computeAzimuthCarrier(self, burst, offset=0.0, position=None):
+    def computeCarrierTerms(self, burst):
         '''
-        Returns the ramp function as a numpy array.
+        Range dependent terms of the azimuth carrier, one per range column:
+        the Doppler centroid rate Kt and the reference time eta_ref.
         '''
         Vs = np.linalg.norm(burst.orbit.interpolateOrbit(burst.sensingMid, method='hermite').getVelocity())
         Ks =   old_div(2 * Vs * burst.azimuthSteeringRate, burst.radarWavelength)
 
+        rng = np.arange(burst.numberOfSamples) * burst.rangePixelSize + burst.startingRange
 
-        if position is None:
-            rng = np.arange(burst.numberOfSamples) * burst.rangePixelSize + burst.startingRange
+        f_etac = burst.doppler(rng)
+        Ka     = burst.azimuthFMRate(rng)
 
-## Seems to work best for basebanding data
-            eta =( np.arange(0, burst.numberOfLines) - (burst.numberOfLines//2)) * burst.azimuthTimeInterval +  offset * burst.azimuthTimeInterval
+        eta_ref = (old_div(burst.doppler(burst.startingRange), burst.azimuthFMRate(burst.startingRange)) ) - (old_div(f_etac, Ka))
 
-            f_etac = burst.doppler(rng)
-            Ka     = burst.azimuthFMRate(rng)
+#        eta_ref *= 0.0
+        Kt = old_div(Ks, (1.0 - old_div(Ks,Ka)))
+        return Kt, eta_ref
 
-            eta_ref = (old_div(burst.doppler(burst.startingRange), burst.azimuthFMRate(burst.startingRange)) ) - (old_div(f_etac, Ka))
+    def computeAzimuthCarrier(self, burst, offset=0.0, position=None, lines=None, terms=None):
+        '''
+        Returns the ramp function as a numpy array, for the given lines
+        (default: all lines of the burst). terms are the range dependent terms
+        of computeCarrierTerms, if already computed.
+        '''
+        if position is None:
+            if terms is None:
+                terms = self.computeCarrierTerms(burst)
+            Kt, eta_ref = terms
 
-#            eta_ref *= 0.0
-            Kt = old_div(Ks, (1.0 - old_div(Ks,Ka)))
+            if lines is None:
+                lines = np.arange(0, burst.numberOfLines)
 
+## Seems to work best for basebanding data
+            eta =( lines - (burst.numberOfLines//2)) * burst.azimuthTimeInterval +  offset * burst.azimuthTimeInterval
 
             carr = np.pi * Kt[None,:] * ((eta[:,None] - eta_ref[None,:])**2)
 
         else:
+            Vs = np.linalg.norm(burst.orbit.interpolateOrbit(burst.sensingMid, method='hermite').getVelocity())
+            Ks =   old_div(2 * Vs * burst.azimuthSteeringRate, burst.radarWavelength)
+
             ####y and x need to be zero index
             y,x = position
 
@@ -637,20 +632,11 @@ class Sentinel1_TOPS(Component):
         tau_sub = np.array(burst.slantRangeTimeSub)
         theta_sub = np.array(burst.elevationAngle)
         ###########################################
-        #Reading the 2 way EAP (Elevation Antenna Pattern from AUX_CAL file)
-        fp = open(burst.auxFile,'r')
-        xml_root = ElementTree(file=fp).getroot()
-        res = xml_root.find('calibrationParamsList/calibrationParams')
-        paramsList = xml_root.find('calibrationParamsList')
-        for par in (paramsList.getchildren()):
-            if par.find('swath').text == burst.swath and par.find('polarisation').text == burst.polarization:
-              print (par.find('swath').text)
-              print (par.find('polarisation').text)
-              delta_theta = float(par.find('elevationAntennaPattern/elevationAngleIncrement').text)
-              Geap_IQ = [float(val) for val in par.find('elevationAntennaPattern/values').text.split()]
-        I = np.array(Geap_IQ[0::2])
-        Q = np.array(Geap_IQ[1::2])
-        Geap = I[:]+Q[:]*1j   # Complex vector of Elevation Antenna Pattern
+        #2 way EAP (Elevation Antenna Pattern) of the AUX_CAL file, parsed once per file
+        patterns = readAuxCalPatterns(burst.auxFile)
+        if (burst.swath, burst.polarization) not in patterns:
+            raise Exception('No elevation antenna pattern for %s %s in %s'%(burst.swath, burst.polarization, burst.auxFile))
+        delta_theta, Geap = patterns[(burst.swath, burst.polarization)]
         Nelt = np.shape(Geap)[0]
         #########################
         # Vector of elevation angle in antenna frame
@@ -679,39 +665,41 @@ class Sentinel1_TOPS(Component):
         #correct each line of the burst
 
 
-    def computeRamp(self, burst, offset=0.0, position=None):
+    def computeRamp(self, burst, offset=0.0, position=None, lines=None, terms=None, singlePrecision=False):
         '''
-        Compute the phase ramp.
+        Compute the phase ramp. With singlePrecision, the carrier is wrapped
+        to [-pi, pi] in float64 and the ramp is computed in complex64 from
+        the float32 cosine and sine.
         '''
         cJ = np.complex64(1.0j)
-        carr = self.computeAzimuthCarrier(burst,offset=offset, position=position)
+        carr = self.computeAzimuthCarrier(burst,offset=offset, position=position, lines=lines, terms=terms)
+        if singlePrecision:
+            phase = (carr - 2*np.pi*np.rint(old_div(carr, 2*np.pi))).astype(np.float32)
+            ramp = np.empty(np.shape(phase), dtype=np.complex64)
+            ramp.real = np.cos(phase)
+            ramp.imag = -np.sin(phase)
+            return ramp
         ramp = np.exp(-cJ * carr)
         return ramp
 
 
-    def derampImage(self, offset=0.0, action=True):
+    def derampImage(self, offset=0.0, action=True, numThreads=None, singlePrecision=True):
         '''
-        Deramp the bursts.
+        Deramp the bursts. Each burst is streamed in blocks of BLOCK_LINES
+        lines, with the ramp of each block computed from the polynomials.
+        The bursts are deramped by a pool of numThreads threads (default:
+        OMP_NUM_THREADS or the number of CPUs). With singlePrecision, the ramp
+        is applied in complex64; else as before in complex128.
         '''
 
         t0 = self.bursts[0].sensingStart
 
         lineOffset = 0
+        derampfiles = []
         for index, burst in enumerate(self.bursts):
-            infile = burst.image.filename
-            derampfile = os.path.join(self.outdir, 'deramp_%02d'%(index+1) + '.slc')
-
+            derampfiles.append(os.path.join(self.outdir, 'deramp_%02d'%(index+1) + '.slc'))
 
             if action:
-                data = np.fromfile(infile, dtype=np.complex64).reshape((burst.numberOfLines, burst.numberOfSamples))
-
-
-                ramp = self.computeRamp(burst, offset=offset)
-
-                #####Write Deramped SLC to file
-                data *= ramp
-
-
                 print('Burst Number: %d'%(index+1))
                 print('Number of Lines: %d'%(burst.numberOfLines))
                 print('Global Offset: %d' %(np.round(old_div(-(t0 - burst.sensingStart).total_seconds(), burst.azimuthTimeInterval))))
@@ -720,11 +708,19 @@ class Sentinel1_TOPS(Component):
                     lineOffset += boff
                     print('Burst OFfset: %d'%lineOffset)
 
-                fid = open(derampfile, 'wb')
-                data.tofile(fid)
-                fid.close()
-
-
+        if action:
+            ####Range dependent terms use the ISCE orbits and polynomials, so are
+            ####computed here; the blocks are deramped concurrently
+            terms = [self.computeCarrierTerms(burst) for burst in self.bursts]
+            if numThreads is None:
+                numThreads = int(os.environ.get('OMP_NUM_THREADS', 0)) or os.cpu_count()
+            numThreads = max(1, min(numThreads, len(self.bursts)))
+            with ThreadPoolExecutor(max_workers=numThreads) as executor:
+                for _ in executor.map(lambda args: self.derampBurst(*args, offset=offset, singlePrecision=singlePrecision),
+                                      zip(self.bursts, derampfiles, terms)):
+                    pass
+
+        for burst, derampfile in zip(self.bursts, derampfiles):
             ####Render ISCE XML
             slcImage = isceobj.createSlcImage()
             slcImage.setByteOrder('l')
@@ -737,8 +733,23 @@ class Sentinel1_TOPS(Component):
             slcImage.renderHdr()
             burst.derampimage = slcImage
 
-        band = None
-        src = None
+    def derampBurst(self, burst, derampfile, terms, offset=0.0, singlePrecision=True):
+        '''
+        Write the deramped burst SLC, reading and deramping BLOCK_LINES lines
+        at a time.
+        '''
+        infile = burst.image.filename
+        width = burst.numberOfSamples
+
+        with open(infile, 'rb') as fin, open(derampfile, 'wb') as fout:
+            for start in range(0, burst.numberOfLines, BLOCK_LINES):
+                stop = min(start + BLOCK_LINES, burst.numberOfLines)
+                data = np.fromfile(fin, dtype=np.complex64, count=(stop-start)*width).reshape((stop-start, width))
+
+                #####Write Deramped SLC to file
+                data *= self.computeRamp(burst, offset=offset, lines=np.arange(start, stop), terms=terms,
+                                         singlePrecision=singlePrecision)
+                data.tofile(fout)
 
     def crop(self, bbox):
         '''
@@ -789,6 +800,27 @@ class Sentinel1_TOPS(Component):
         return
 
 
+@lru_cache(maxsize=None)
+def readAuxCalPatterns(auxFile):
+    '''
+    Lookup table of the 2 way elevation antenna patterns of an AUX_CAL file:
+    (elevation angle increment, complex pattern) keyed by (swath, polarisation).
+    The table is shared by all bursts, so the patterns are read-only.
+    '''
+    with open(auxFile, 'r') as fp:
+        xml_root = ElementTree(file=fp).getroot()
+
+    patterns = {}
+    paramsList = xml_root.find('calibrationParamsList')
+    for par in list(paramsList):
+        delta_theta = float(par.find('elevationAntennaPattern/elevationAngleIncrement').text)
+        Geap_IQ = np.array(par.find('elevationAntennaPattern/values').text.split(), dtype=np.float64)
+        Geap = Geap_IQ[0::2] + Geap_IQ[1::2]*1j   # Complex vector of Elevation Antenna Pattern
+        Geap.setflags(write=False)
+        patterns[(par.find('swath').text, par.find('polarisation').text)] = (delta_theta, Geap)
+    return patterns
+
+
 def anx2roll(delta_anx):
    #Returns the Platform nominal roll as function of elapsed time from
    #ascending node crossing time (ANX)
@@ -10,8 +10,10 @@ from isceobj.Scene.Frame import Frame
 from isceobj.Planet.AstronomicalHandbook import Const
 from isceobj.Planet.Planet import Planet
 from frameMetadata.Sentinel1_TOPS import Sentinel1_TOPS
+from topsApp_utils.slc_annotations import read_annotation_xmls_from_zip
+from topsApp_utils.annotation_index import load_index
+from xml.etree.ElementTree import fromstring
 import argparse
-from lxml import objectify as OBJ
 from FrameInfoExtractor import FrameInfoExtractor as FIE
 import numpy as np
 from osgeo import ogr, osr
@@ -31,18 +33,14 @@ def cmdLineParse():
     #parser.add_argument('-i','--input', dest='inxml', type=str, required=True,
             #help='Swath XML file')a
     parser.add_argument('-i','--input', dest='xml_file', type=str, nargs='+', help='Swath XML file')
+    parser.add_argument('-z','--zip', dest='zip_file', type=str,
+            help='SLC zip file to read the swath XML files from instead of --input')
+    parser.add_argument('-p','--pol', dest='pol', type=str,
+            help='Polarization of the swath XML files read from --zip')
     parser.add_argument('-o', '--output', dest='outjson', type=str, required=True,
             help = 'Ouput met.json')
     return parser.parse_args()
 
-def objectify(inxml):
-    '''
-    Return objectified XML.
-    '''
-    with open(inxml, 'r') as fid:
-        root = OBJ.parse(fid).getroot()
-    return root
-
 def get_area(coords):
     '''get area of enclosed coordinates- determines clockwise or counterclockwise order'''
     n = len(coords) # of corners
@@ -61,15 +59,13 @@ def change_direction(coords):
         coords = coords[::-1]
     return coords
 
-def getGeometry(obj):
+def getGeometry(record):
     '''
     Get bbox and central coordinates.
     '''
-    pts = []
-    glist = obj.geolocationGrid.geolocationGridPointList
-
-    for child in glist.getchildren():
-        pts.append( [float(child.line), float(child.pixel), float(child.latitude), float(child.longitude)])
+    grid = record['geolocation_grid']
+    pts = [list(x) for x in zip(grid['line'], grid['pixel'],
+                                grid['latitude'], grid['longitude'])]
 
     ys = sorted(list(set([x[0] for x in pts])))
     dy = ys[1] - ys[0]
@@ -96,10 +92,10 @@ class S1toFrame(object):
     Create a traditional ISCE Frame object from S1 container.
     '''
 
-    def __init__(self, sar, obj):
+    def __init__(self, sar):
         self.sar = sar
-        self.obj = obj
-        self.missionId = self.obj.xpath('.//missionId/text()')[0]
+        self.record = sar.record
+        self.missionId = self.record['mission_id']
         self.missionId_char = MISSION_RE.search(self.missionId).group(1)
         self.frame = Frame()
         self.frame.configure()
@@ -129,17 +125,17 @@ class S1toFrame(object):
         ins.setPulseRepetitionFrequency(1.0/b0.azimuthTimeInterval)
         ins.setRangePixelSize(b0.rangePixelSize)
 
-        tau = self.obj.generalAnnotation.replicaInformationList.replicaInformation.referenceReplica.timeDelay
-        ins.setPulseLength(float(tau))
-        slope = str(self.obj.generalAnnotation.replicaInformationList.replicaInformation.referenceReplica.phaseCoefficients).split()[2]
-        ins.setChirpSlope(float(slope))
+        tau = self.record['replica_time_delay']
+        ins.setPulseLength(tau)
+        slope = self.record['replica_phase_coefficients'][2]
+        ins.setChirpSlope(slope)
 
         fsamp = old_div(Const.c, (2.0 * b0.rangePixelSize))
         ins.setRangeSamplingRate(fsamp)
 
         ins.setInPhaseValue(127.5)
         ins.setQuadratureValue(127.5)
-        ins.setBeamNumber(self.obj.adsHeader.swath)
+        ins.setBeamNumber(self.record['swath'])
 
     def _populateFrame(self):
         frame = self.frame
@@ -147,19 +143,19 @@ class S1toFrame(object):
         b1 = self.sar.bursts[-1]
 
 
-        hdg = self.obj.generalAnnotation.productInformation.platformHeading
+        hdg = self.record['platform_heading']
         if hdg < -90:
             frame.setPassDirection('Descending')
         else:
             frame.setPassDirection('Ascending')
 
         frame.setStartingRange(b0.startingRange)
-        frame.setOrbitNumber(int(self.obj.adsHeader.absoluteOrbitNumber))
+        frame.setOrbitNumber(self.record['absolute_orbit_number'])
         frame.setProcessingFacility('Sentinel 1%s' % self.missionId_char)
         frame.setProcessingSoftwareVersion('IPF')
-        frame.setPolarization(self.obj.adsHeader.polarisation)
-        frame.setNumberOfSamples(int(self.obj.imageAnnotation.imageInformation.numberOfSamples))
-        frame.setNumberOfLines(int(self.obj.imageAnnotation.imageInformation.numberOfLines))
+        frame.setPolarization(self.record['polarisation'])
+        frame.setNumberOfSamples(self.record['number_of_samples'])
+        frame.setNumberOfLines(self.record['number_of_lines'])
         frame.setSensingStart(b0.sensingStart)
         frame.setSensingStop(b1.sensingStop)
 
@@ -407,7 +403,20 @@ if __name__ == '__main__':
     inps = cmdLineParse()
 
     #Read in metadata
-    xml_files=inps.xml_file
+    records = {}
+    xml_contents = {}
+    if inps.zip_file is not None:
+        ####Records of the annotation index if it was built for the zip,
+        ####else the annotation XMLs read from the zip without extracting them
+        index = load_index(inps.zip_file)
+        if index is not None:
+            records = index.find(pol=inps.pol)
+            xml_files = sorted(records)
+        else:
+            xml_contents = read_annotation_xmls_from_zip(inps.zip_file, pol=inps.pol)
+            xml_files = sorted(xml_contents)
+    else:
+        xml_files = inps.xml_file
     frame_infos=[]
     i=0
     for inxml in xml_files:
@@ -416,11 +425,14 @@ if __name__ == '__main__':
         met_file= "test_met%s.json"%i
         sar.xml = inxml
         print("Extract Metadata : Processing %s" %inxml)
+        if inxml in records:
+            sar.record = records[inxml]
+        elif inxml in xml_contents:
+            sar._xml_root = fromstring(xml_contents[inxml])
         sar.parse()
-        obj = objectify(inxml)
 
         ####Copy into ISCE Frame
-        frame = S1toFrame(sar,obj)
+        frame = S1toFrame(sar)
 
         ####Frameinfoextractor
         fie = FIE()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Preflight of a topsApp GUNW job.
+
+Runs the validations of create_standard_product_s1.py that only need the
+job context (job type, pipeline machine tags, input metadata and
+polarization consistency) and optionally the duplicate GUNW check, without
+importing ISCE or GDAL or localizing the SLCs. Exits with status 1 and the
+reason on stderr if the job would fail.
+"""
+import os
+import sys
+import json
+import argparse
+from topsApp_utils.context_checks import (run_context_checks,
+                                          get_input_metadata)
+
+
+def get_duplicate(ctx: dict, tops_app_path: str, dataset_key: str) -> bool:
+    # Only needed for the duplicate check
+    from topsApp_utils.UrlUtils import UrlUtils
+    from topsApp_utils.gunw_lookup import (get_grq_client,
+                                           find_existing_gunws,
+                                           ResultCache)
+
+    with open(f'{tops_app_path}/conf/dataset_versions.json') as f:
+        version = json.load(f)[dataset_key]
+
+    settings = UrlUtils()
+    es_url = settings['GRQ_URL']
+    if ctx.get('local_test', False):
+        es_url = es_url + '/es'
+    http_auth = None
+    if 'ES_USERNAME' in settings:
+        http_auth = (settings['ES_USERNAME'], settings['ES_PASSWORD'])
+
+    input_metadata = get_input_metadata(ctx)
+    pair = (input_metadata['master_scenes'],
+            input_metadata['slave_scenes'],
+            version)
+    exists, = find_existing_gunws([pair],
+                                  get_grq_client(es_url, http_auth),
+                                  f'grq_*_{dataset_key.lower()}',
+                                  cache=ResultCache())
+    return exists
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('context', nargs='?', default='_context.json',
+                        help='Job context (default: _context.json)')
+    parser.add_argument('--check-duplicates', action='store_true',
+                        help='Also query GRQ for an existing GUNW')
+    args = parser.parse_args()
+
+    tops_app_path = os.environ.get('TOPSAPP',
+                                   os.path.dirname(os.path.abspath(__file__)))
+    with open(args.context) as f:
+        ctx = json.load(f)
+
+    try:
+        result = run_context_checks(ctx, tops_app_path)
+        if args.check_duplicates and not ctx.get('testing', False):
+            dataset_key = result['config']['dataset_key']
+            if get_duplicate(ctx, tops_app_path, dataset_key):
+                raise RuntimeError("Duplicate S1 GUNW found")
+    except Exception as err:
+        print(f'Preflight failed: {err}', file=sys.stderr)
+        return 1
+
+    print(json.dumps({'job_spec_id': result['job_spec_id'],
+                      'job_name': result['config']['name'],
+                      'polarization': result['polarization']}))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,6 +12,27 @@ import logging
 
 logger = logging.getLogger('isce.topsinsar.topo')
 
+# Settings of topozero that are not taken from the burst; they are part of
+# the topo cache key. The planet is wired to topozero, the others are set
+# as its attributes
+TOPO_PARAMS = {'demInterpolationMethod': 'BIQUINTIC',
+               'lookSide': -1,
+               'numberRangeLooks': 1,
+               'numberAzimuthLooks': 1,
+               'planet': 'Earth'}
+
+
+def getTopoCache():
+    '''
+    Geometry cache configured by TOPO_CACHE_DIR or None if it is disabled
+    or the PGE utilities are not on the python path.
+    '''
+    try:
+        from topsApp_utils.geometry_cache import GeometryCache
+    except ImportError:
+        return None
+    return GeometryCache.from_env()
+
 def runTopo(self):
 
     hasGPU= self.useGPU and self._insar.hasGPU()
@@ -35,6 +56,13 @@ def runTopoCPU(self):
     demfilename = self.verifyDEM()
     catalog.addItem('Dem Used', demfilename, 'topo')
 
+    ####Geometry of bursts of earlier jobs with the same reference and DEM
+    cache = getTopoCache()
+    if cache is not None:
+        from topsApp_utils.geometry_cache import get_dem_digest, get_burst_key
+        demDigest = get_dem_digest(demfilename)
+        logger.info('Using topo cache {0}'.format(cache.root))
+
     boxes = []
     for swath in swathList:
         #####Load the master product
@@ -63,35 +91,50 @@ def runTopoCPU(self):
                 maskname = os.path.join(dirname, 'shadowMask_%02d.rdr'%(ind+1)) # edited for layover
                 incname = os.path.join(dirname, 'incLocal_%02d.rdr'%(ind+1)) # edited for layover
 
-                demImage = isceobj.createDemImage()
-                demImage.load(demfilename + '.xml')
-
-                #####Run Topo
-                planet = Planet(pname='Earth')
-                topo = createTopozero()
-                topo.slantRangePixelSpacing = burst.rangePixelSize
-                topo.prf = 1.0/burst.azimuthTimeInterval
-                topo.radarWavelength = burst.radarWavelength
-                topo.orbit = burst.orbit
-                topo.width = burst.numberOfSamples
-                topo.length = burst.numberOfLines
-                topo.wireInputPort(name='dem', object=demImage)
-                topo.wireInputPort(name='planet', object=planet)
-                topo.numberRangeLooks = 1
-                topo.numberAzimuthLooks = 1
-                topo.lookSide = -1
-                topo.sensingStart = burst.sensingStart
-                topo.rangeFirstSample = burst.startingRange
-                topo.demInterpolationMethod='BIQUINTIC'
-                topo.latFilename = latname
-                topo.lonFilename = lonname
-                topo.heightFilename = hgtname
-                topo.losFilename = losname
-                topo.maskFilename = maskname # edited for layover
-                topo.incFilename = incname  # edited for layover
-                topo.topo()
-
-                bbox = [topo.minimumLatitude, topo.maximumLatitude, topo.minimumLongitude, topo.maximumLongitude]
+                outputs = {'lat': latname, 'lon': lonname, 'hgt': hgtname,
+                           'los': losname, 'shadowMask': maskname,
+                           'incLocal': incname}
+                cached = None
+                if cache is not None:
+                    key = get_burst_key(burst, swath, demDigest, TOPO_PARAMS)
+                    cached = cache.fetch(key, outputs)
+
+                if cached is not None:
+                    bbox = cached['bbox']
+                    catalog.addItem('Topo cache hit for burst {0} - IW-{1}'.format(index,swath), key, 'topo')
+                else:
+                    demImage = isceobj.createDemImage()
+                    demImage.load(demfilename + '.xml')
+
+                    #####Run Topo
+                    planet = Planet(pname=TOPO_PARAMS['planet'])
+                    topo = createTopozero()
+                    topo.slantRangePixelSpacing = burst.rangePixelSize
+                    topo.prf = 1.0/burst.azimuthTimeInterval
+                    topo.radarWavelength = burst.radarWavelength
+                    topo.orbit = burst.orbit
+                    topo.width = burst.numberOfSamples
+                    topo.length = burst.numberOfLines
+                    topo.wireInputPort(name='dem', object=demImage)
+                    topo.wireInputPort(name='planet', object=planet)
+                    for name, value in TOPO_PARAMS.items():
+                        if name != 'planet':
+                            setattr(topo, name, value)
+                    topo.sensingStart = burst.sensingStart
+                    topo.rangeFirstSample = burst.startingRange
+                    topo.latFilename = latname
+                    topo.lonFilename = lonname
+                    topo.heightFilename = hgtname
+                    topo.losFilename = losname
+                    topo.maskFilename = maskname # edited for layover
+                    topo.incFilename = incname  # edited for layover
+                    topo.topo()
+
+                    bbox = [topo.minimumLatitude, topo.maximumLatitude, topo.minimumLongitude, topo.maximumLongitude]
+
+                    if cache is not None:
+                        cache.store(key, outputs, {'bbox': bbox})
+
                 boxes.append(bbox)
 
                 catalog.addItem('Number of lines for burst {0} - IW-{1}'.format(index,swath), burst.numberOfLines, 'topo')
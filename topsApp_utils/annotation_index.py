@@ -0,0 +1,327 @@
+"""
+Persistent index of the parsed annotation xmls of Sentinel-1 SLCs.
+
+Each annotation xml of an SLC is parsed once into a compact record holding
+what the annotation consumers of the PGE read: the swath header, image and
+product information, the burst list and swath timing, the FM rate and
+Doppler centroid polynomials, the orbit state vectors and the geolocation
+grid. The records of an SLC are stored in one sqlite file per SAFE,
+`<SAFE name>.annotations.sqlite` in the work directory (or in
+`ANNOTATION_INDEX_DIR`), rather than next to a possibly read-only or shared
+input SLC, so that sent1_bbox.py, Sentinel1_TOPS.py and
+extractMetadata_standard_product.py load them on demand instead of parsing
+the xmls again. An index is rebuilt if its SLC changed. Usage:
+
+    annotation_index.py S1A_IW_SLC__1SDV_....zip ...
+"""
+import os
+import sys
+import json
+import sqlite3
+import logging
+import zipfile
+import argparse
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('annotation_index')
+
+INDEX_DIR_ENV = 'ANNOTATION_INDEX_DIR'
+INDEX_SUFFIX = '.annotations.sqlite'
+
+# Changing `extract_record` invalidates the existing indexes
+INDEX_VERSION = 1
+
+GRID_FIELDS = ['line', 'pixel', 'latitude', 'longitude', 'height']
+
+
+def get_text(root, path: str) -> str:
+    elem = root.find(path)
+    if elem is None or elem.text is None:
+        raise ValueError(f'Tag {path} not found')
+    return elem.text
+
+
+def get_floats(root, path: str) -> list:
+    return [float(val) for val in get_text(root, path).split()]
+
+
+def get_polynomials(elems, coeffs_tag: str) -> list:
+    """Reference times, t0 and coefficients of FM rate or Doppler lists."""
+    polynomials = []
+    for elem in elems:
+        if coeffs_tag == 'azimuthFmRatePolynomial' and \
+                elem.find('c0') is not None:
+            # Older products list the FM rate coefficients separately
+            coeffs = [float(get_text(elem, tag))
+                      for tag in ('c0', 'c1', 'c2')]
+        else:
+            coeffs = get_floats(elem, coeffs_tag)
+        polynomials.append({'azimuth_time': get_text(elem, 'azimuthTime'),
+                            't0': float(get_text(elem, 't0')),
+                            'coeffs': coeffs})
+    return polynomials
+
+
+def extract_record(root) -> dict:
+    """
+    Record of a parsed annotation xml.
+
+    Values are converted to numbers; times are kept as their annotation
+    strings (e.g. '2020-01-01T00:00:00.000000').
+    """
+    image = 'imageAnnotation/imageInformation/'
+    product = 'generalAnnotation/productInformation/'
+    replica = ('generalAnnotation/replicaInformationList/'
+               'replicaInformation/referenceReplica/')
+    antenna = 'antennaPattern/antennaPatternList/antennaPattern/'
+    record = {
+        'mission_id': get_text(root, 'adsHeader/missionId'),
+        'swath': get_text(root, 'adsHeader/swath'),
+        'polarisation': get_text(root, 'adsHeader/polarisation'),
+        'absolute_orbit_number': int(get_text(
+            root, 'adsHeader/absoluteOrbitNumber')),
+        'radar_frequency': float(get_text(root, product + 'radarFrequency')),
+        'pass': get_text(root, product + 'pass'),
+        'range_sampling_rate': float(get_text(
+            root, product + 'rangeSamplingRate')),
+        'azimuth_steering_rate': float(get_text(
+            root, product + 'azimuthSteeringRate')),
+        'platform_heading': float(get_text(root,
+                                           product + 'platformHeading')),
+        'prf': float(get_text(root, 'generalAnnotation/'
+                                    'downlinkInformationList/'
+                                    'downlinkInformation/prf')),
+        'terrain_height': float(get_text(root, 'generalAnnotation/'
+                                               'terrainHeightList/'
+                                               'terrainHeight/value')),
+        'replica_time_delay': float(get_text(root, replica + 'timeDelay')),
+        'replica_phase_coefficients': get_floats(
+            root, replica + 'phaseCoefficients'),
+        'azimuth_pixel_spacing': float(get_text(
+            root, image + 'azimuthPixelSpacing')),
+        'azimuth_time_interval': float(get_text(
+            root, image + 'azimuthTimeInterval')),
+        'slant_range_time': float(get_text(root, image + 'slantRangeTime')),
+        'incidence_angle_mid_swath': float(get_text(
+            root, image + 'incidenceAngleMidSwath')),
+        'ascending_node_time': get_text(root, image + 'ascendingNodeTime'),
+        'number_of_samples': int(get_text(root, image + 'numberOfSamples')),
+        'number_of_lines': int(get_text(root, image + 'numberOfLines')),
+        'antenna_slant_range_time': get_floats(root,
+                                               antenna + 'slantRangeTime'),
+        'antenna_elevation_angle': get_floats(root,
+                                              antenna + 'elevationAngle'),
+        'lines_per_burst': int(get_text(root, 'swathTiming/linesPerBurst')),
+        'samples_per_burst': int(get_text(root,
+                                          'swathTiming/samplesPerBurst')),
+    }
+
+    record['bursts'] = [
+        {'azimuth_time': get_text(burst, 'azimuthTime'),
+         'sensing_time': get_text(burst, 'sensingTime'),
+         'first_valid_sample': [int(val) for val in
+                                get_text(burst, 'firstValidSample').split()],
+         'last_valid_sample': [int(val) for val in
+                               get_text(burst, 'lastValidSample').split()]}
+        for burst in root.findall('swathTiming/burstList/burst')]
+    record['fm_rates'] = get_polynomials(
+        root.findall('generalAnnotation/azimuthFmRateList/azimuthFmRate'),
+        'azimuthFmRatePolynomial')
+    record['dc_estimates'] = get_polynomials(
+        root.findall('dopplerCentroid/dcEstimateList/dcEstimate'),
+        'dataDcPolynomial')
+    record['orbit'] = [
+        {'time': get_text(sv, 'time'),
+         'position': [float(get_text(sv, 'position/' + tag))
+                      for tag in 'xyz'],
+         'velocity': [float(get_text(sv, 'velocity/' + tag))
+                      for tag in 'xyz']}
+        for sv in root.findall('generalAnnotation/orbitList/orbit')]
+
+    points = root.findall('geolocationGrid/geolocationGridPointList/'
+                          'geolocationGridPoint')
+    record['geolocation_grid'] = {
+        field: [float(get_text(point, field)) for point in points]
+        for field in GRID_FIELDS}
+    return record
+
+
+def get_safe_name(slc_path: str) -> str:
+    """SAFE name of an SLC zip or SAFE directory."""
+    name = os.path.basename(os.path.normpath(str(slc_path)))
+    return os.path.splitext(name)[0] + '.SAFE'
+
+
+def get_index_file(slc_path: str, index_dir: str = None) -> str:
+    """Index file of an SLC zip or SAFE directory."""
+    if index_dir is None:
+        index_dir = os.environ.get(INDEX_DIR_ENV) or os.getcwd()
+    return os.path.join(index_dir, get_safe_name(slc_path) + INDEX_SUFFIX)
+
+
+def get_source_state(slc_path: str) -> dict:
+    stat = os.stat(str(slc_path))
+    return {'version': INDEX_VERSION,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime}
+
+
+def read_annotations(slc_path: str) -> dict:
+    """
+    Parsed annotation xmls of an SLC zip or SAFE directory, keyed by their
+    names within the SLC zip.
+    """
+    from topsApp_utils.slc_annotations import read_annotations_from_zip
+
+    slc_path = str(slc_path)
+    if zipfile.is_zipfile(slc_path):
+        return read_annotations_from_zip(slc_path)
+    annotations = {}
+    safe_name = os.path.basename(os.path.normpath(slc_path))
+    for xml_file in sorted(Path(slc_path).glob('annotation/s1*-iw*.xml')):
+        annotations[f'{safe_name}/annotation/{xml_file.name}'] = \
+            ET.parse(str(xml_file)).getroot()
+    return annotations
+
+
+class AnnotationIndex(object):
+    """
+    Records of the annotation xmls of one SAFE, keyed by the names of the
+    xmls within the SLC zip, e.g.
+    'S1A_..._1234.SAFE/annotation/s1a-iw1-slc-vv-....xml'.
+    """
+
+    def __init__(self, index_file: str):
+        self.index_file = index_file
+
+    def _connect(self):
+        return sqlite3.connect(f'file:{self.index_file}?mode=ro', uri=True)
+
+    def get_info(self) -> dict:
+        with self._connect() as db:
+            return json.loads(db.execute(
+                "SELECT value FROM info WHERE key = 'source'").fetchone()[0])
+
+    def get_members(self) -> list:
+        with self._connect() as db:
+            return [row[0] for row in db.execute(
+                'SELECT member FROM annotations ORDER BY member')]
+
+    def get(self, member: str) -> dict:
+        with self._connect() as db:
+            row = db.execute('SELECT record FROM annotations '
+                             'WHERE member = ?', (member,)).fetchone()
+        if row is None:
+            raise KeyError(member)
+        return json.loads(row[0])
+
+    def find(self, swath: str = None, pol: str = None) -> dict:
+        """
+        Records of the annotations of a swath (e.g. 'IW1') and/or a
+        polarization (e.g. 'vv'), keyed by member.
+        """
+        query = 'SELECT member, record FROM annotations WHERE 1'
+        args = []
+        if swath is not None:
+            query += ' AND swath = ?'
+            args.append(swath.upper())
+        if pol is not None:
+            query += ' AND polarisation = ?'
+            args.append(pol.upper())
+        with self._connect() as db:
+            return {member: json.loads(record) for member, record in
+                    db.execute(query + ' ORDER BY member', args)}
+
+    @classmethod
+    def build(cls, slc_path: str, index_file: str = None):
+        """Parse the annotation xmls of an SLC and write its index."""
+        if index_file is None:
+            index_file = get_index_file(slc_path)
+        source = get_source_state(slc_path)
+        rows = []
+        for member, root in read_annotations(slc_path).items():
+            record = extract_record(root)
+            rows.append((member, record['swath'].upper(),
+                         record['polarisation'].upper(),
+                         json.dumps(record, separators=(',', ':'))))
+
+        tmp_file = f'{index_file}.{os.getpid()}.tmp'
+        if os.path.exists(tmp_file):
+            os.unlink(tmp_file)
+        with sqlite3.connect(tmp_file) as db:
+            db.execute('CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)')
+            db.execute('CREATE TABLE annotations (member TEXT PRIMARY KEY, '
+                       'swath TEXT, polarisation TEXT, record TEXT)')
+            db.execute('INSERT INTO info VALUES (?, ?)',
+                       ('source', json.dumps(source)))
+            db.executemany('INSERT INTO annotations VALUES (?, ?, ?, ?)',
+                           rows)
+        os.replace(tmp_file, index_file)
+        logger.info(f'Indexed {len(rows)} annotations of {slc_path} in '
+                    f'{index_file}')
+        return cls(index_file)
+
+
+def load_index(slc_path: str, index_dir: str = None):
+    """
+    The index of an SLC zip or SAFE directory or None if it was not built
+    or is outdated.
+    """
+    index_file = get_index_file(slc_path, index_dir)
+    if not os.path.exists(index_file):
+        return None
+    index = AnnotationIndex(index_file)
+    try:
+        if index.get_info() == get_source_state(slc_path):
+            return index
+    except (sqlite3.Error, TypeError, ValueError):
+        pass
+    logger.info(f'Ignoring outdated annotation index {index_file}')
+    return None
+
+
+def build_index(slc_path: str, index_dir: str = None) -> str:
+    """Build the index of an SLC unless it is up to date."""
+    index = load_index(slc_path, index_dir)
+    if index is None:
+        index = AnnotationIndex.build(slc_path,
+                                      get_index_file(slc_path, index_dir))
+    return index.index_file
+
+
+def build_indexes(slc_paths: list, index_dir: str = None,
+                  max_workers: int = None) -> list:
+    """
+    Build the indexes of SLC zips or SAFE directories using a thread pool
+    across SLCs.
+
+    Returns
+    -------
+    list
+        Index files
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda slc_path:
+                                 build_index(slc_path, index_dir),
+                                 slc_paths))
+
+
+def main():
+    formatter = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=formatter)
+    parser.add_argument('slc_paths', nargs='+',
+                        help='SLC zip files or SAFE directories')
+    parser.add_argument('-d', '--index-dir', default=None)
+    args = parser.parse_args()
+    for index_file in build_indexes(args.slc_paths, args.index_dir):
+        print(index_file)
+    return 0
+
+
+if __name__ == '__main__':
+    log_format = '[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s'
+    logging.basicConfig(format=log_format, level=logging.INFO)
+    sys.exit(main())
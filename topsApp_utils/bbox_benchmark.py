@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark and validation of the streaming SLC envelope of sent1_bbox.py.
+
+The envelope of the SLCs is computed both as before (all annotation xmls,
+cross-pol included, parsed into trees and the geolocation grid points of
+all of them gathered before taking their min/max) and by streaming the
+co-pol annotations (`sent1_bbox.get_envelope_from_all_slcs`). The time and
+peak memory (traced Python allocations) of both are reported. Usage:
+
+    bbox_benchmark.py S1A_IW_SLC__1SDV_....zip ... [--json out.json]
+
+The exit status is 1 if the envelopes differ.
+"""
+import sys
+import json
+import argparse
+import logging
+import zipfile
+import tracemalloc
+import xml.etree.ElementTree as ET
+from time import time
+from topsApp_utils.sent1_bbox import get_envelope_from_all_slcs
+from topsApp_utils.slc_annotations import get_annotation_members
+
+
+def get_envelope_reference(zip_paths: list) -> dict:
+    """Envelope of the grid points of all parsed annotation xmls."""
+    points = []
+    for zip_path in zip_paths:
+        with zipfile.ZipFile(zip_path, 'r') as zip_obj:
+            for member in get_annotation_members(zip_obj):
+                root = ET.fromstring(zip_obj.read(member))
+                points.extend({child.tag: child.text for child in point}
+                              for point in root.findall(
+                                  './geolocationGrid/'
+                                  'geolocationGridPointList/'
+                                  'geolocationGridPoint'))
+    lons = [float(point['longitude']) for point in points]
+    lats = [float(point['latitude']) for point in points]
+    return {'xmin': min(lons),
+            'xmax': max(lons),
+            'ymin': min(lats),
+            'ymax': max(lats)}
+
+
+def measure(func, *args) -> tuple:
+    """Result, seconds and peak traced bytes of `func(*args)`."""
+    tracemalloc.start()
+    start = time()
+    result = func(*args)
+    seconds = time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def main():
+    formatter = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=formatter)
+    parser.add_argument('zip_paths', nargs='+')
+    parser.add_argument('--json', dest='json_file', default=None)
+    args = parser.parse_args()
+
+    reference, reference_time, reference_peak = measure(
+        get_envelope_reference, args.zip_paths)
+    streamed, streamed_time, streamed_peak = measure(
+        get_envelope_from_all_slcs, args.zip_paths)
+
+    print(f'{len(args.zip_paths)} SLCs')
+    print(f'parsed   {reference_time:8.3f} s {reference_peak / 2**20:8.1f} MiB')
+    print(f'streamed {streamed_time:8.3f} s {streamed_peak / 2**20:8.1f} MiB')
+    print(f'envelope {streamed}')
+
+    if args.json_file is not None:
+        with open(args.json_file, 'w') as f:
+            json.dump({'parsed_seconds': reference_time,
+                       'parsed_peak_bytes': reference_peak,
+                       'streamed_seconds': streamed_time,
+                       'streamed_peak_bytes': streamed_peak,
+                       'parsed_envelope': reference,
+                       'streamed_envelope': streamed}, f, indent=2)
+
+    if streamed != reference:
+        print(f'Envelopes differ: parsed {reference}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    log_format = '[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s'
+    logging.basicConfig(format=log_format, level=logging.WARNING)
+    sys.exit(main())
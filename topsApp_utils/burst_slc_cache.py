@@ -0,0 +1,164 @@
+"""
+Burst SLCs of an acquisition shared by the pairs using it.
+
+With `use virtual files`, topsApp.py's preprocess step leaves each burst
+SLC as a vrt reading a window of the measurement tiff within the SAFE zip,
+so every step reading the burst decompresses it from the zip again, in
+every pair of the acquisition. The pixels of a burst only depend on the
+tiff and the window, so after the preprocess step each burst is decoded
+once into the geometry cache (see geometry_cache.py) as an entry
+`burst-<key>`, keyed by a digest of its vrt with the paths of the SAFE
+zips replaced by their names and sizes. The pairs of the acquisition copy
+the raw burst next to its vrt and point the vrt to it, so that the burst
+SLCs read by the later steps hold the same values. The secondary bursts
+are still deramped and resampled by each pair, as that depends on the
+offsets of the pair.
+"""
+import os
+import glob
+import json
+import hashlib
+import logging
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger('burst_slc_cache')
+
+# Changing the extraction invalidates the cached bursts
+CACHE_VERSION = 1
+
+# Output directories of the acquisitions in topsApp.xml
+SLC_PRODUCT_DIRS = ['master', 'slave']
+BURST_VRT_PATTERN = 'IW[1-3]/burst_*.slc.vrt'
+BLOCK_BYTES = 64 * 2**20
+VSIZIP = '/vsizip/'
+
+RAW_VRT = '''<VRTDataset rasterXSize="{width}" rasterYSize="{length}">
+    <VRTRasterBand dataType="{dtype}" band="1" subClass="VRTRawRasterBand">
+        <SourceFilename relativeToVRT="1">{filename}</SourceFilename>
+        <ByteOrder>LSB</ByteOrder>
+        <ImageOffset>0</ImageOffset>
+        <PixelOffset>{pixel_bytes}</PixelOffset>
+        <LineOffset>{line_bytes}</LineOffset>
+    </VRTRasterBand>
+</VRTDataset>
+'''
+
+
+def get_source_state(path: str) -> list:
+    """
+    Path of a vrt source relative to its SAFE zip or directory and the
+    size of that zip (or of the source), which identify its content across
+    jobs.
+    """
+    if path.startswith(VSIZIP):
+        zip_file, member = path[len(VSIZIP):].split('.zip/', 1)
+        zip_file += '.zip'
+        return [f'{os.path.basename(zip_file)}/{member}',
+                os.path.getsize(zip_file)]
+    parts = path.split('/')
+    for i in range(len(parts) - 1, -1, -1):
+        if parts[i].endswith('.SAFE'):
+            return ['/'.join(parts[i:]), os.path.getsize(path)]
+    return [path, os.path.getsize(path)]
+
+
+def is_raw_vrt(vrt_file: str) -> bool:
+    """Whether the vrt of a burst already points to its raw SLC."""
+    root = ET.parse(vrt_file).getroot()
+    return any(band.get('subClass') == 'VRTRawRasterBand'
+               for band in root.iter('VRTRasterBand'))
+
+
+def get_burst_key(vrt_file: str) -> str:
+    """Cache key of the burst SLC read by `vrt_file`."""
+    root = ET.parse(vrt_file).getroot()
+    sources = []
+    for elem in root.iter('SourceFilename'):
+        path = elem.text
+        if elem.get('relativeToVRT') == '1':
+            path = os.path.join(os.path.dirname(os.path.abspath(vrt_file)),
+                                path)
+        sources.append(get_source_state(path))
+        # The paths of the zips differ between jobs
+        elem.text = ''
+    burst_state = {'version': CACHE_VERSION,
+                   'sources': sources,
+                   'vrt': ET.tostring(root, encoding='unicode')}
+    payload = json.dumps(burst_state, sort_keys=True)
+    return 'burst-' + hashlib.sha256(payload.encode('utf8')).hexdigest()
+
+
+def extract_burst(vrt_file: str, slc_file: str) -> dict:
+    """
+    Write the pixels read by `vrt_file` as a raw little endian image.
+
+    Returns
+    -------
+    dict
+        Size and GDAL data type of the image
+    """
+    from osgeo import gdal
+    gdal.UseExceptions()
+
+    ds = gdal.Open(vrt_file, gdal.GA_ReadOnly)
+    band = ds.GetRasterBand(1)
+    width, length = ds.RasterXSize, ds.RasterYSize
+    dtype = gdal.GetDataTypeName(band.DataType)
+    pixel_bytes = gdal.GetDataTypeSize(band.DataType) // 8
+    rows_per_block = max(1, BLOCK_BYTES // (pixel_bytes * width))
+    tmp_file = f'{slc_file}.{os.getpid()}.tmp'
+    with open(tmp_file, 'wb') as f:
+        for row in range(0, length, rows_per_block):
+            rows = min(rows_per_block, length - row)
+            block = band.ReadAsArray(0, row, width, rows)
+            block.astype(block.dtype.newbyteorder('<')).tofile(f)
+    band = ds = None
+    os.replace(tmp_file, slc_file)
+    return {'width': width,
+            'length': length,
+            'dtype': dtype,
+            'pixel_bytes': pixel_bytes}
+
+
+def write_raw_vrt(vrt_file: str, slc_file: str, image: dict):
+    """Point the vrt of a burst to its raw SLC."""
+    with open(vrt_file, 'w') as f:
+        f.write(RAW_VRT.format(filename=os.path.basename(slc_file),
+                               line_bytes=image['pixel_bytes'] *
+                               image['width'],
+                               **image))
+
+
+def share_burst_slcs(cache, product_dirs: list = SLC_PRODUCT_DIRS) -> dict:
+    """
+    Replace the virtual burst SLCs of the acquisitions by raw SLCs, taken
+    from the geometry cache `cache` if another pair extracted them.
+
+    Returns
+    -------
+    dict
+        Numbers of bursts taken from the cache and extracted
+    """
+    counts = {'cached_bursts': 0, 'extracted_bursts': 0}
+    for product_dir in product_dirs:
+        for vrt_file in sorted(glob.glob(os.path.join(product_dir,
+                                                      BURST_VRT_PATTERN))):
+            if is_raw_vrt(vrt_file):
+                continue
+            slc_file = os.path.abspath(vrt_file[:-len('.vrt')])
+            key = get_burst_key(vrt_file)
+            outputs = {'slc': slc_file}
+            image = cache.fetch(key, outputs)
+            if image is not None:
+                logger.info(f'Burst SLC {slc_file} from cache entry {key}')
+                counts['cached_bursts'] += 1
+            else:
+                image = extract_burst(vrt_file, slc_file)
+                # The xml and vrt of the burst are those of the pair
+                cache.store(key, outputs, image, companion_suffixes=[])
+                logger.info(f'Extracted burst SLC {slc_file} as {key}')
+                counts['extracted_bursts'] += 1
+            write_raw_vrt(vrt_file, slc_file, image)
+    logger.info(f'{counts["cached_bursts"]} burst SLCs from the cache, '
+                f'{counts["extracted_bursts"]} extracted')
+    return counts
@@ -0,0 +1,160 @@
+"""
+Validations of a job that only need its `_context.json` and the PGE
+configuration.
+
+This module only imports the standard library so that the checks can run
+in a preflight before any heavy dependencies are imported or the SLCs are
+localized (see `preflight_s1.py`).
+"""
+import re
+import json
+import logging
+
+logger = logging.getLogger('context_checks')
+
+POL_RE = re.compile(r'^S1\w_IW_SLC._1S(\w{2})_')
+
+ACCEPTED_JOB_TYPES = ['coseismic-s1gunw-topsapp',
+                      'standard-product-s1gunw-topsapp']
+
+# input_metadata keys read by create_standard_product_s1.py
+REQUIRED_INPUT_METADATA = ['project',
+                           'id',
+                           'master_scenes',
+                           'slave_scenes',
+                           'direction',
+                           'platform',
+                           'master_zip_file',
+                           'slave_zip_file',
+                           'master_orbit_file',
+                           'slave_orbit_file',
+                           'master_orbit_url',
+                           'slave_orbit_url',
+                           'track_number',
+                           'dem_type',
+                           'full_id_hash',
+                           'slc_master_dt',
+                           'slc_slave_dt']
+
+
+def get_job_spec_id(ctx: dict) -> str:
+    # The job_spec_id should match the `job-{string trailing job-spec json}`
+    job_spec_id, branch = ctx['job_specification']['id'].split(':')
+    # Hysds append `job-` to id
+    return job_spec_id.replace('job-', '')
+
+
+def check_job_type(job_spec_id: str):
+    if job_spec_id not in ACCEPTED_JOB_TYPES:
+        job_types_str = ', '.join(ACCEPTED_JOB_TYPES)
+        raise ValueError(f'Job type {job_spec_id} not understood; '
+                         f'must be {job_types_str}')
+
+
+def load_job_config(tops_app_path: str, job_spec_id: str) -> dict:
+    # Open config file replacing `job-` with `config-` at the beginning
+    config_file_path = f'{tops_app_path}/conf/config-{job_spec_id}.json'
+    with open(config_file_path) as file:
+        return json.load(file)
+
+
+def get_input_metadata(ctx: dict) -> dict:
+    input_metadata = ctx['input_metadata']
+    if type(input_metadata) is list:
+        input_metadata = input_metadata[0]
+    return input_metadata
+
+
+def check_pipeline(machine_tags: list, job_name: str):
+    """
+    If there is a machine tag, check that it's coseismic otherwise make sure
+    it's the standard product. New machine tags other than
+    "s1-coseismic-gunw" will need new control flow.
+    """
+    if machine_tags:
+        if not ((machine_tags[0] == "s1-coseismic-gunw")
+                and (job_name == 'coseismic')):
+            exception_msg = ('TopsApp Pipelines were mixed: '
+                             'A coseismic job was called with a '
+                             'standard product ifg-cfg')
+            raise RuntimeError(exception_msg)
+    elif job_name != 'standard-product':
+        exception_msg = ('TopsApp Pipelines were mixed: '
+                         'A standard product job was called with a '
+                         'coseismic ifg-cfg')
+        raise RuntimeError(exception_msg)
+
+
+def check_input_metadata(input_metadata: dict):
+    missing = [key for key in REQUIRED_INPUT_METADATA
+               if key not in input_metadata]
+    if missing:
+        raise RuntimeError(f'input_metadata is missing {", ".join(missing)}')
+
+
+def get_polarization(id):
+    """Return polarization."""
+
+    match = POL_RE.search(id)
+    if not match:
+        raise RuntimeError('Failed to extract polarization from %s' % id)
+    pp = match.group(1)
+    if pp in ('SV', 'DV'):
+        return 'vv'
+    elif pp in ('DH', 'SH'):
+        return 'hh'
+    else:
+        raise RuntimeError('Unrecognized polarization: %s' % pp)
+
+
+def get_pol_data_from_slcs(slcs):
+    pol_data = []
+    for slc in slcs:
+        pol = get_polarization(slc).strip().lower()
+        logger.info('get_pol_data_from_slcs:'
+                    f'pol data of SLC : {slc} is {pol}')
+        if pol not in pol_data:
+            pol_data.append(pol)
+
+    if (len(pol_data) == 0) or (len(pol_data) > 1):
+        err_msg = ('get_pol_data_from_slcs: Found Multiple Polarization '
+                   f'or No Polarization for slcs {slcs} : {pol_data}')
+        print(err_msg)
+        raise RuntimeError(err_msg)
+
+    return pol_data[0]
+
+
+def check_polarization(master_zip_files: list, slave_zip_files: list) -> str:
+    """Return the polarization common to reference and secondary SLCs."""
+    master_pol = get_pol_data_from_slcs(master_zip_files)
+    slave_pol = get_pol_data_from_slcs(slave_zip_files)
+    if master_pol != slave_pol:
+        err_msg = ('Reference and Secondary Polarization are NOT SAME\n'
+                   f'Reference Polarization : {master_pol}\n'
+                   f'Secondary Polarization : {slave_pol}')
+        raise RuntimeError(err_msg)
+    return master_pol
+
+
+def run_context_checks(ctx: dict, tops_app_path: str) -> dict:
+    """
+    Run all validations that only need the context and PGE configuration.
+
+    Returns
+    -------
+    dict
+        The job configuration and the common polarization of the SLCs
+    """
+    job_spec_id = get_job_spec_id(ctx)
+    check_job_type(job_spec_id)
+    config_data = load_job_config(tops_app_path, job_spec_id)
+
+    input_metadata = get_input_metadata(ctx)
+    check_pipeline(input_metadata.get('tags', []), config_data['name'])
+    check_input_metadata(input_metadata)
+    pol = check_polarization(input_metadata['master_zip_file'],
+                             input_metadata['slave_zip_file'])
+    return {'job_spec_id': job_spec_id,
+            'config': config_data,
+            'polarization': pol}
@@ -9,11 +9,8 @@ from builtins import str
 import os, sys, traceback, logging, argparse
 from subprocess import check_call
 
-from get_clims import get_clims
-
 
 log_format = "[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s"
-logging.basicConfig(format=log_format, level=logging.INFO)
 logger = logging.getLogger('create_tiles')
 
 
@@ -34,6 +31,9 @@ def create_tiles(raster, output_dir, band=1, cmap='jet', clim_min=None,
                  zoom=[0, 8], nodata=None):
     """Generate map tiles following the OSGeo Tile Map Service Specification."""
 
+    # numpy and GDAL are only imported when tiles are made
+    from get_clims import get_clims
+
     # check mutually exclusive args
     if clim_min is not None and clim_min_pct is not None:
         raise RuntimeError
@@ -79,6 +79,7 @@ def create_tiles(raster, output_dir, band=1, cmap='jet', clim_min=None,
 
 
 if __name__ == '__main__':
+    logging.basicConfig(format=log_format, level=logging.INFO)
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("raster", help="input raster file (any GDAL-recognized file format)")
     parser.add_argument("output_dir", help="output directory")
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Single pass, in-process stitching of the processing and geocoding DEMs.
+
+The tiles are read from their zip files through GDAL's /vsizip/ and warped
+lazily onto the DEM grid. The warped DEM is read in blocks of rows: voids
+(values not above -1000, as `A*(A>-1000)` of ned_dem.py) are set to 0, the
+block is appended to the processing DEM and averaged into the rows of the
+3 arcsec geocoding DEM. The average reproduces ISCE's
+`downsampleDEM.py -rsec 3`, a GDAL `average` warp onto the 3 arcsec grid of
+the same extent, zeros included (see `BlockAverager`). The ISCE xml and vrt
+of both DEMs are written with their absolute paths, so no extracted tiles
+or intermediate DEMs are written to disk. Usage:
+
+    dem_stitcher.py -b 36 42 -123 -120 -o stitched.dem -g geocode/stitched.dem \
+        N37W121.hgt.zip ...
+"""
+import os
+import sys
+import math
+import logging
+import zipfile
+import argparse
+
+logger = logging.getLogger('dem_stitcher')
+
+# Values not above this are voids
+VOID_THRESHOLD = -1000
+GEOCODE_ARCSEC = 3
+BLOCK_BYTES = 64 * 2**20
+
+
+def get_tile_paths(zip_files: list) -> list:
+    """/vsizip/ paths of the rasters (.hgt) in the tile zip files."""
+    paths = []
+    for zip_file in zip_files:
+        with zipfile.ZipFile(zip_file) as z:
+            names = [name for name in z.namelist() if name.endswith('.hgt')]
+        paths.extend(f'/vsizip/{os.path.abspath(zip_file)}/{name}'
+                     for name in names)
+    return paths
+
+
+def fix_voids(block):
+    """Set voids (and NaNs) to 0 in place."""
+    import numpy as np
+
+    with np.errstate(invalid='ignore'):
+        block[~(block > VOID_THRESHOLD)] = 0
+    return block
+
+
+def write_isce_xml(dem_file: str, width: int, length: int,
+                   transform: tuple):
+    """Write the ISCE xml and vrt of the float32 DEM `dem_file`."""
+    import isce
+    from isceobj.Image import createDemImage
+
+    dem_file = os.path.abspath(dem_file)
+    image = createDemImage()
+    image.initImage(dem_file, 'read', width, 'FLOAT')
+    image.init({'REFERENCE': 'WGS84',
+                'Coordinate1': {'size': width,
+                                'startingValue': transform[0],
+                                'delta': transform[1]},
+                'Coordinate2': {'size': length,
+                                'startingValue': transform[3],
+                                'delta': transform[5]},
+                'FILE_NAME': dem_file})
+    image.renderHdr()
+    image.renderVRT()
+
+
+def get_average_size(size: int, ratio: float) -> int:
+    """
+    Pixels of the `ratio` times coarser grid of the same extent, as
+    `gdalwarp -tr` sizes it.
+    """
+    return max(1, int(size / ratio + 0.5))
+
+
+def get_average_weights(size: int, ratio: float, out_size: int) -> tuple:
+    """
+    Weights of averaging `size` pixels along an axis into `out_size` cells
+    of `ratio` pixels: the fraction of each pixel overlapping each cell, as
+    in GDAL's `average` resampling. Cells extending past the last pixel
+    only overlap the pixels inside.
+
+    Returns
+    -------
+    tuple
+        Pixel indices, cell indices (ascending) and weights
+    """
+    import numpy as np
+
+    pixels, cells, weights = [], [], []
+    for cell in range(out_size):
+        start = cell * ratio
+        end = min((cell + 1) * ratio, size)
+        for pixel in range(int(math.floor(start)),
+                           min(int(math.ceil(end)), size)):
+            weight = min(pixel + 1, end) - max(pixel, start)
+            if weight > 0:
+                pixels.append(pixel)
+                cells.append(cell)
+                weights.append(weight)
+    return (np.array(pixels), np.array(cells),
+            np.array(weights, dtype=np.float64))
+
+
+class BlockAverager(object):
+    """
+    Streaming average of a raster onto a `ratio` times coarser grid of the
+    same extent, fed with consecutive blocks of rows.
+
+    All pixels, zeros included, are averaged with their overlap weights as
+    `gdalwarp -tr <res> <res> -r average` does for a raster without nodata,
+    which is how ISCE's downsampleDEM.py makes the geocoding DEM. The
+    weights are separable, so each block is reduced along the columns and
+    its rows are accumulated into the pending output rows.
+    """
+
+    def __init__(self, width: int, length: int, ratio: float):
+        import numpy as np
+
+        self.width = get_average_size(width, ratio)
+        self.length = get_average_size(length, ratio)
+        self._x = get_average_weights(width, ratio, self.width)
+        self._y = get_average_weights(length, ratio, self.length)
+        self._x_starts = self._get_starts(self._x[1])
+        x_sums = np.add.reduceat(self._x[2], self._x_starts)
+        y_sums = np.zeros(self.length)
+        np.add.at(y_sums, self._y[1], self._y[2])
+        self._y_sums = y_sums
+        self._x_sums = x_sums
+        # Last input row of each output row
+        self._y_last = np.zeros(self.length, dtype=int)
+        np.maximum.at(self._y_last, self._y[1], self._y[0])
+        self._row = 0
+        self._first = 0
+        self._pending = np.zeros((0, self.width))
+
+    @staticmethod
+    def _get_starts(cells):
+        import numpy as np
+
+        return np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+
+    def add(self, block):
+        """
+        Add the next rows of the raster.
+
+        Returns
+        -------
+        numpy.ndarray
+            The output rows (float32) completed by these rows
+        """
+        import numpy as np
+
+        rows = block.shape[0]
+        pixels, cells, weights = self._x
+        columns = np.add.reduceat(block[:, pixels].astype(np.float64) *
+                                  weights, self._x_starts, axis=1)
+
+        in_block = (self._y[0] >= self._row) & (self._y[0] < self._row + rows)
+        y_pixels = self._y[0][in_block]
+        y_cells = self._y[1][in_block]
+        # Rows past the last cell (rounded off by the grid) have no weight
+        if y_cells.size:
+            contributions = columns[y_pixels - self._row] * \
+                self._y[2][in_block][:, None]
+            starts = self._get_starts(y_cells)
+            sums = np.add.reduceat(contributions, starts, axis=0)
+            end = y_cells[-1] + 1 - self._first
+            if end > self._pending.shape[0]:
+                self._pending = np.vstack([
+                    self._pending,
+                    np.zeros((end - self._pending.shape[0], self.width))])
+            self._pending[y_cells[starts] - self._first] += sums
+        self._row += rows
+
+        done = int(np.searchsorted(self._y_last[self._first:],
+                                   self._row - 1, side='right'))
+        done = min(done, self._pending.shape[0])
+        norm = np.outer(self._y_sums[self._first:self._first + done],
+                        self._x_sums)
+        out = (self._pending[:done] / norm).astype(np.float32)
+        self._pending = self._pending[done:]
+        self._first += done
+        return out
+
+
+def stitch_dem(zip_files: list,
+               bbox: list,
+               dem_file: str,
+               geocode_dem_file: str,
+               downsample: str = None,
+               geocode_arcsec: float = GEOCODE_ARCSEC) -> dict:
+    """
+    Parameters
+    ----------
+    zip_files : list
+        Zip files of the DEM tiles
+    bbox : list
+        South, north, west and east bounds of the DEM
+    dem_file : str
+        Processing DEM at the resolution of the tiles (or `downsample`)
+    geocode_dem_file : str
+        Geocoding DEM at `geocode_arcsec` resolution
+    downsample : str
+        Size of the processing DEM relative to the tiles, e.g. '33%'
+
+    Returns
+    -------
+    dict
+        Paths and sizes of both DEMs
+    """
+    import numpy as np
+    from osgeo import gdal
+    gdal.UseExceptions()
+
+    tile_paths = get_tile_paths(zip_files)
+    if not tile_paths:
+        raise RuntimeError('No DEM tiles to stitch')
+    logger.info(f'Stitching {len(tile_paths)} tiles')
+    mosaic_file = f'/vsimem/{os.getpid()}_dem_mosaic.vrt'
+    warped_file = f'/vsimem/{os.getpid()}_dem_warped.vrt'
+    gdal.BuildVRT(mosaic_file, tile_paths)
+
+    # Same grid as `gdalwarp -te W S E N [-outsize p% p%]`; the warp runs
+    # as the blocks are read
+    south, north, west, east = bbox
+    warp_options = ['-te', str(west), str(south), str(east), str(north),
+                    '-ot', 'Float32']
+    if downsample is not None:
+        warp_options += ['-outsize', downsample, downsample]
+    warped = gdal.Warp(warped_file, mosaic_file,
+                       options=gdal.WarpOptions(options=warp_options,
+                                                format='VRT'))
+    width, length = warped.RasterXSize, warped.RasterYSize
+    transform = warped.GetGeoTransform()
+    band = warped.GetRasterBand(1)
+    rows_per_block = max(1, BLOCK_BYTES // (4 * width))
+
+    # Grid of `gdalwarp -tr` at `geocode_arcsec` over the DEM extent
+    ratio = geocode_arcsec / 3600. / abs(transform[5])
+    averager = BlockAverager(width, length, ratio)
+    resolution = geocode_arcsec / 3600.
+    geocode_transform = (transform[0], resolution, 0,
+                         transform[3], 0, -resolution)
+    geocode_width, geocode_length = averager.width, averager.length
+    logger.info(f'DEM {width} x {length}; geocoding DEM {geocode_width} x '
+                f'{geocode_length}')
+
+    for path in (dem_file, geocode_dem_file):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(dem_file, 'wb') as dem, open(geocode_dem_file, 'wb') as geo:
+        for row in range(0, length, rows_per_block):
+            rows = min(rows_per_block, length - row)
+            block = band.ReadAsArray(0, row, width, rows).astype(np.float32)
+            fix_voids(block).astype('<f4').tofile(dem)
+            averager.add(block).astype('<f4').tofile(geo)
+    warped = band = None
+    gdal.Unlink(warped_file)
+    gdal.Unlink(mosaic_file)
+    write_isce_xml(dem_file, width, length, transform)
+    write_isce_xml(geocode_dem_file, geocode_width, geocode_length,
+                   geocode_transform)
+    return {'dem_file': os.path.abspath(dem_file),
+            'geocode_dem_file': os.path.abspath(geocode_dem_file),
+            'size': [width, length],
+            'geocode_size': [geocode_width, geocode_length]}
+
+
+def main():
+    formatter = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=formatter)
+    parser.add_argument('zip_files', nargs='+')
+    parser.add_argument('-b', '--bbox', type=float, nargs=4, required=True,
+                        help='south north west east')
+    parser.add_argument('-o', '--output', default='stitched.dem')
+    parser.add_argument('-g', '--geocode-output', required=True)
+    parser.add_argument('-d', '--downsample', default=None,
+                        help='downsample DEM by a percentage, e.g. 33%%')
+    parser.add_argument('-r', '--geocode-arcsec', type=float,
+                        default=GEOCODE_ARCSEC)
+    args = parser.parse_args()
+    stitch_dem(args.zip_files, args.bbox, args.output, args.geocode_output,
+               args.downsample, args.geocode_arcsec)
+    return 0
+
+
+if __name__ == '__main__':
+    log_format = '[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s'
+    logging.basicConfig(format=log_format, level=logging.INFO)
+    sys.exit(main())
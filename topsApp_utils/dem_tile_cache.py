@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+Node-local cache of DEM tiles shared by the jobs running on a node.
+
+Tiles are stored by the sha256 of their content in `<root>/objects` and an
+index maps each tile url to its object, size and last use. Concurrent jobs
+downloading the same tile serialize on a lock per url; the index is
+updated under a lock of the cache. Tiles are verified against their
+checksum whenever they are used (and zip tiles are tested before they are
+added) and the least recently used tiles are evicted once the cache
+exceeds its size. Tiles the server does not have (e.g. over the ocean) are
+remembered for `MISSING_TTL` seconds.
+
+`ned_dem.py` fetches its tiles through the cache directly. ISCE's dem.py,
+used for SRTM, downloads its tiles itself; `TileCacheServer` is a local
+http server that serves tiles from the cache, fetching misses from the
+DEM server, and whose url is passed to dem.py instead.
+
+The cache is enabled by setting DEM_TILE_CACHE_DIR. Usage:
+
+    dem_tile_cache.py fetch <url> [-o <file>] [-n <user> -w <password>]
+    dem_tile_cache.py info
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+import zipfile
+import argparse
+import threading
+import subprocess
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger('dem_tile_cache')
+
+CACHE_DIR_ENV = 'DEM_TILE_CACHE_DIR'
+MAX_BYTES_ENV = 'DEM_TILE_CACHE_MAX_BYTES'
+MAX_BYTES = 20 * 2**30
+MISSING_TTL = 30 * 24 * 3600
+
+INDEX_FILE = 'index.json'
+LOCK_FILE = '.lock'
+CHUNK_BYTES = 2**20
+
+# curl exit status when a file:// url does not exist
+CURL_FILE_NOT_FOUND = 37
+
+
+class TileNotFound(Exception):
+    pass
+
+
+def get_file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_url_key(url: str) -> str:
+    return hashlib.sha1(url.encode('utf8')).hexdigest()
+
+
+def download(url: str, out_file: str, username: str = None,
+             password: str = None):
+    """
+    Download `url` with curl as ned_dem.py does (http(s) or file://).
+
+    Raises TileNotFound if the server does not have the file.
+    """
+    cmd = ['curl', '-k', '-f', '-L', '-s', '-S', '-o', out_file,
+           '-w', '%{http_code}']
+    if username is not None and password is not None:
+        cmd += ['-u', f'{username}:{password}']
+    elif os.path.exists(os.path.join(os.environ.get('HOME', ''), '.netrc')):
+        cookie_file = os.path.join(os.environ['HOME'], '.earthdatacookie')
+        cmd += ['-n', '-c', cookie_file, '-b', cookie_file]
+    cmd.append(url)
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        if os.path.exists(out_file):
+            os.unlink(out_file)
+        if proc.stdout.strip() == '404' or \
+                proc.returncode == CURL_FILE_NOT_FOUND:
+            raise TileNotFound(url)
+        raise RuntimeError(f'Failed to download {url}: '
+                           f'{proc.stderr.strip()}')
+
+
+def check_tile(path: str, url: str):
+    """Reject truncated or corrupt zip tiles before they are cached."""
+    if not url.endswith('.zip'):
+        return
+    try:
+        with zipfile.ZipFile(path) as z:
+            bad = z.testzip()
+    except zipfile.BadZipFile as err:
+        raise RuntimeError(f'{url} is not a valid zip: {err}')
+    if bad is not None:
+        raise RuntimeError(f'{url} has a corrupt member {bad}')
+
+
+class TileCache(object):
+    """
+    Parameters
+    ----------
+    root : str
+        Cache directory, preferably on node-local disk
+    max_bytes : int
+        Size of the cached tiles above which the least recently used tiles
+        are evicted
+    """
+
+    def __init__(self, root: str, max_bytes: int = MAX_BYTES):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(self.root, 'objects')
+        self.locks_dir = os.path.join(self.root, 'locks')
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        for path in (self.objects_dir, self.locks_dir, self.tmp_dir):
+            os.makedirs(path, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """The cache configured by the environment or None if disabled."""
+        root = os.environ.get(CACHE_DIR_ENV)
+        if not root:
+            return None
+        max_bytes = int(os.environ.get(MAX_BYTES_ENV, MAX_BYTES))
+        return cls(root, max_bytes=max_bytes)
+
+    @contextmanager
+    def _lock(self, name: str = LOCK_FILE):
+        with open(os.path.join(self.root, name), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_index(self) -> dict:
+        try:
+            with open(os.path.join(self.root, INDEX_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index: dict):
+        tmp_file = os.path.join(self.root, f'{INDEX_FILE}.{os.getpid()}')
+        with open(tmp_file, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_file, os.path.join(self.root, INDEX_FILE))
+
+    def get_object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest)
+
+    def lookup(self, url: str):
+        """
+        Returns
+        -------
+        str or None
+            Path of the verified cached tile or None if it is not cached
+
+        Raises TileNotFound if the server recently did not have the tile.
+        """
+        with self._lock():
+            index = self._read_index()
+            entry = index.get(url)
+            if entry is None:
+                return None
+            if entry.get('missing'):
+                if time.time() - entry['last_used'] < MISSING_TTL:
+                    raise TileNotFound(url)
+                del index[url]
+                self._write_index(index)
+                return None
+
+        # The tile is hashed without the lock, so that other jobs can use
+        # the cache meanwhile
+        digest = entry['digest']
+        path = self.get_object_path(digest)
+        try:
+            valid = (os.path.getsize(path) == entry['size'] and
+                     get_file_digest(path) == digest)
+        except OSError:
+            # e.g. evicted meanwhile
+            valid = False
+
+        with self._lock():
+            index = self._read_index()
+            entry = index.get(url)
+            # Changed meanwhile, e.g. evicted or added again
+            if entry is None or entry.get('digest') != digest:
+                return None
+            if not valid:
+                logger.warning(f'Discarding corrupt cached tile of {url}')
+                del index[url]
+                self._remove_unreferenced(index, digest)
+                self._write_index(index)
+                return None
+            entry['last_used'] = time.time()
+            self._write_index(index)
+        return path
+
+    def add(self, url: str, tile_file: str) -> str:
+        """Move the downloaded `tile_file` into the cache."""
+        check_tile(tile_file, url)
+        digest = get_file_digest(tile_file)
+        size = os.path.getsize(tile_file)
+        path = self.get_object_path(digest)
+        with self._lock():
+            if os.path.exists(path):
+                os.unlink(tile_file)
+            else:
+                os.replace(tile_file, path)
+            index = self._read_index()
+            index[url] = {'digest': digest,
+                          'size': size,
+                          'last_used': time.time()}
+            self._evict(index, keep=digest)
+            self._write_index(index)
+        return path
+
+    def add_missing(self, url: str):
+        with self._lock():
+            index = self._read_index()
+            index[url] = {'missing': True, 'last_used': time.time()}
+            self._write_index(index)
+
+    def fetch(self, url: str, username: str = None,
+              password: str = None) -> str:
+        """
+        Path of the cached tile of `url`, downloading it on a miss.
+
+        Raises TileNotFound if the server does not have the tile.
+        """
+        path = self.lookup(url)
+        if path is not None:
+            logger.info(f'Tile cache hit: {url}')
+            return path
+
+        # Only one job downloads a tile; the others wait and use it
+        with self._lock(os.path.join('locks', get_url_key(url))):
+            path = self.lookup(url)
+            if path is not None:
+                logger.info(f'Tile cache hit: {url}')
+                return path
+            logger.info(f'Tile cache miss: {url}')
+            tmp_file = os.path.join(self.tmp_dir,
+                                    f'{get_url_key(url)}.{os.getpid()}.'
+                                    f'{threading.get_ident()}')
+            try:
+                download(url, tmp_file, username, password)
+            except TileNotFound:
+                self.add_missing(url)
+                raise
+            try:
+                return self.add(url, tmp_file)
+            finally:
+                if os.path.exists(tmp_file):
+                    os.unlink(tmp_file)
+
+    def copy_to(self, url: str, out_file: str, username: str = None,
+                password: str = None) -> str:
+        """Fetch the tile of `url` and link (or copy) it to `out_file`."""
+        path = self.fetch(url, username, password)
+        if os.path.exists(out_file):
+            os.unlink(out_file)
+        try:
+            # Cached objects are never modified, only replaced
+            os.link(path, out_file)
+        except OSError:
+            shutil.copyfile(path, out_file)
+        return out_file
+
+    def _remove_unreferenced(self, index: dict, digest: str):
+        if not any(entry.get('digest') == digest
+                   for entry in index.values()):
+            path = self.get_object_path(digest)
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def _evict(self, index: dict, keep: str = None):
+        objects = {}
+        for url, entry in index.items():
+            if entry.get('missing'):
+                continue
+            last_used, size = objects.get(entry['digest'], (0, 0))
+            objects[entry['digest']] = (max(last_used, entry['last_used']),
+                                        entry['size'])
+        total = sum(size for _, size in objects.values())
+        for digest, (_, size) in sorted(objects.items(),
+                                        key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            logger.info(f'Evicting cached tile {digest}')
+            for url in [url for url, entry in index.items()
+                        if entry.get('digest') == digest]:
+                del index[url]
+            self._remove_unreferenced(index, digest)
+            total -= size
+
+    def info(self) -> dict:
+        index = self._read_index()
+        tiles = [entry for entry in index.values()
+                 if not entry.get('missing')]
+        return {'root': self.root,
+                'max_bytes': self.max_bytes,
+                'urls': len(tiles),
+                'missing_urls': len(index) - len(tiles),
+                'bytes': sum(entry['size'] for entry in
+                             {entry['digest']: entry
+                              for entry in tiles}.values())}
+
+
+class TileCacheServer(object):
+    """
+    Local http server with the layout of the DEM server at `upstream_url`
+    serving the tiles from `cache`.
+
+    Used as a context manager; `url` is the base url of the server.
+    """
+
+    def __init__(self, cache: TileCache, upstream_url: str,
+                 username: str = None, password: str = None):
+        self.cache = cache
+        self.upstream_url = upstream_url.rstrip('/') + '/'
+        self.username = username
+        self.password = password
+        self._server = None
+        self._thread = None
+
+    def _make_handler(self):
+        server = self
+
+        class TileHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                name = self.path.split('?')[0].lstrip('/')
+                url = server.upstream_url + name
+                try:
+                    path = server.cache.fetch(url, server.username,
+                                              server.password)
+                except TileNotFound:
+                    self.send_error(404)
+                    return
+                except Exception as err:
+                    logger.warning(f'Failed to serve {url}: {err}')
+                    self.send_error(502)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length',
+                                 str(os.path.getsize(path)))
+                self.end_headers()
+                with open(path, 'rb') as f:
+                    shutil.copyfileobj(f, self.wfile, CHUNK_BYTES)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return TileHandler
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                           self._make_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        logger.info(f'Serving {self.upstream_url} from the tile cache at '
+                    f'{self.url}')
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+def main():
+    formatter = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=formatter)
+    parser.add_argument('action', choices=['fetch', 'info'])
+    parser.add_argument('url', nargs='?')
+    parser.add_argument('-o', '--output', default=None)
+    parser.add_argument('-n', '--username', default=None)
+    parser.add_argument('-w', '--password', default=None)
+    parser.add_argument('--cache-dir', default=os.environ.get(CACHE_DIR_ENV))
+    args = parser.parse_args()
+
+    if not args.cache_dir:
+        parser.error(f'Set {CACHE_DIR_ENV} or --cache-dir')
+    cache = TileCache(args.cache_dir,
+                      int(os.environ.get(MAX_BYTES_ENV, MAX_BYTES)))
+    if args.action == 'info':
+        print(json.dumps(cache.info(), indent=2))
+        return 0
+    out_file = args.output or os.path.basename(args.url)
+    try:
+        cache.copy_to(args.url, out_file, args.username, args.password)
+    except TileNotFound:
+        logger.error(f'{args.url} not found')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    log_format = '[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s'
+    logging.basicConfig(format=log_format, level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+State vectors of Sentinel-1 precise and restituted orbit (EOF) files.
+
+The OSVs of an EOF are read with iterparse. When only a time window is
+needed and no cache is used, reading stops at the first OSV past the
+window instead of parsing the ~9000 OSVs of a POEORB. The state vectors of
+a parsed EOF are kept as arrays in a sidecar cache,
+`<EOF name>.<checksum>.npz` in `.orbit_cache/` next to the EOF (or in
+`ORBIT_CACHE_DIR`), so that later jobs and modules slice them without
+touching the xml. Usage:
+
+    eof_orbit.py S1A_OPER_AUX_POEORB_OPOD_....EOF [--start T --end T]
+"""
+import os
+import sys
+import hashlib
+import logging
+import argparse
+import datetime
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger('eof_orbit')
+
+CACHE_DIR_ENV = 'ORBIT_CACHE_DIR'
+CACHE_SUFFIX = '.npz'
+# Keeps the caches out of the orbit file globs of the orbit directory
+CACHE_SUBDIR = '.orbit_cache'
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+OSV_TAG = 'OSV'
+
+
+def parse_time(utc: str) -> datetime.datetime:
+    """Time of an OSV `UTC` tag, e.g. 'UTC=2020-01-01T00:00:00.000000'."""
+    return datetime.datetime.strptime(utc[4:], TIME_FORMAT)
+
+
+def iter_state_vectors(eof_file: str, tend: datetime.datetime = None):
+    """
+    Yield (time, position, velocity) of the OSVs of an EOF, in file (time)
+    order, stopping at the first OSV at or after `tend`.
+    """
+    with open(eof_file, 'rb') as f:
+        for _, elem in ET.iterparse(f):
+            if elem.tag != OSV_TAG:
+                continue
+            timestamp = parse_time(elem.find('UTC').text)
+            if tend is not None and timestamp >= tend:
+                return
+            yield (timestamp,
+                   [float(elem.find(tag).text) for tag in ('X', 'Y', 'Z')],
+                   [float(elem.find(tag).text)
+                    for tag in ('VX', 'VY', 'VZ')])
+            elem.clear()
+
+
+def to_arrays(state_vectors) -> dict:
+    """Times (datetime64[us]), positions and velocities (N x 3)."""
+    import numpy as np
+
+    times, positions, velocities = [], [], []
+    for timestamp, pos, vel in state_vectors:
+        times.append(timestamp)
+        positions.append(pos)
+        velocities.append(vel)
+    return {'times': np.array(times, dtype='datetime64[us]'),
+            'positions': np.array(positions,
+                                  dtype=np.float64).reshape(-1, 3),
+            'velocities': np.array(velocities,
+                                   dtype=np.float64).reshape(-1, 3)}
+
+
+def get_checksum(eof_file: str) -> str:
+    digest = hashlib.sha256()
+    with open(eof_file, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_cache_file(eof_file: str, checksum: str,
+                   cache_dir: str = None) -> str:
+    """Sidecar cache of an EOF, keyed by its name and checksum."""
+    if cache_dir is None:
+        cache_dir = os.environ.get(CACHE_DIR_ENV) or \
+            os.path.join(os.path.dirname(os.path.abspath(eof_file)),
+                         CACHE_SUBDIR)
+    name = os.path.basename(eof_file)
+    return os.path.join(cache_dir, f'{name}.{checksum[:16]}{CACHE_SUFFIX}')
+
+
+def read_cache(cache_file: str):
+    """Cached arrays or None if missing or unreadable."""
+    import numpy as np
+
+    try:
+        with np.load(cache_file) as data:
+            return {key: data[key]
+                    for key in ('times', 'positions', 'velocities')}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_cache(cache_file: str, arrays: dict):
+    """Write the arrays of an EOF atomically; failures are only logged."""
+    import numpy as np
+
+    tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_file, cache_file)
+    except OSError as err:
+        logger.warning(f'Could not cache the orbit in {cache_file}: {err}')
+        if os.path.exists(tmp_file):
+            os.unlink(tmp_file)
+
+
+def slice_window(arrays: dict, tstart: datetime.datetime = None,
+                 tend: datetime.datetime = None) -> dict:
+    """State vectors with `tstart <= time < tend`."""
+    import numpy as np
+
+    times = arrays['times']
+    first = 0 if tstart is None else \
+        np.searchsorted(times, np.datetime64(tstart, 'us'), side='left')
+    last = len(times) if tend is None else \
+        np.searchsorted(times, np.datetime64(tend, 'us'), side='left')
+    return {key: array[first:last] for key, array in arrays.items()}
+
+
+def load_state_vectors(eof_file: str,
+                       tstart: datetime.datetime = None,
+                       tend: datetime.datetime = None,
+                       use_cache: bool = True,
+                       cache_dir: str = None) -> dict:
+    """
+    State vectors of an EOF with `tstart <= time < tend`.
+
+    Parameters
+    ----------
+    eof_file : str
+        Precise or restituted orbit file
+    tstart, tend : datetime.datetime
+        Time window; the whole file if not specified
+    use_cache : bool
+        Read the state vectors from the sidecar cache, parsing the whole EOF
+        into it on a miss. Without the cache, the EOF is only parsed up to
+        `tend`.
+
+    Returns
+    -------
+    dict
+        'times' (datetime64[us]), 'positions' and 'velocities' (N x 3)
+    """
+    if not use_cache:
+        return slice_window(to_arrays(iter_state_vectors(eof_file, tend)),
+                            tstart, tend)
+
+    cache_file = get_cache_file(eof_file, get_checksum(eof_file), cache_dir)
+    arrays = read_cache(cache_file)
+    if arrays is None:
+        logger.info(f'Parsing {eof_file} into {cache_file}')
+        arrays = to_arrays(iter_state_vectors(eof_file))
+        write_cache(cache_file, arrays)
+    return slice_window(arrays, tstart, tend)
+
+
+def main():
+    formatter = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=formatter)
+    parser.add_argument('eof_files', nargs='+')
+    parser.add_argument('--start', type=datetime.datetime.fromisoformat,
+                        default=None)
+    parser.add_argument('--end', type=datetime.datetime.fromisoformat,
+                        default=None)
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false')
+    args = parser.parse_args()
+    for eof_file in args.eof_files:
+        arrays = load_state_vectors(eof_file, args.start, args.end,
+                                    use_cache=args.use_cache)
+        times = arrays['times']
+        span = f'{times[0]} to {times[-1]}' if len(times) else 'none'
+        print(f'{eof_file}: {len(times)} state vectors, {span}')
+    return 0
+
+
+if __name__ == '__main__':
+    log_format = '[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s'
+    logging.basicConfig(format=log_format, level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Single-pass ESD coherence threshold sweep.
+
+topsApp.py's esd step only uses the burst overlap pixels whose coherence
+exceeds the ESD coherence threshold and fails if none are left. The
+overlap coherence and interferogram rasters written by the prepesd step are
+read once here to determine, for every candidate threshold, how many
+pixels the esd step would use. The highest threshold that leaves enough
+pixels can then be written to topsApp.xml once before the esd step is run.
+"""
+import os
+import re
+import logging
+from glob import glob
+import numpy as np
+
+logger = logging.getLogger('esd_sweep')
+
+# `esdDirname` of topsApp.py
+ESD_DIR = 'ESD'
+
+# e.g. overlap_IW1_01.5alks_15rlks.cor written by the prepesd step next to
+# the multilooked overlap interferogram overlap_IW1_01.5alks_15rlks.int
+OVERLAP_COR_RE = re.compile(r'^overlap_IW(\d)_(\d+)\.(\d+alks_\d+rlks)\.cor$')
+
+
+def get_candidate_thresholds(start: float,
+                             minimum: float = 0.5,
+                             increment: float = 0.05) -> list:
+    """Thresholds from `start` down to `minimum` in steps of `increment`."""
+    thresholds = []
+    threshold = start
+    while threshold >= minimum:
+        thresholds.append(threshold)
+        threshold = round(threshold - increment, 2)
+    return thresholds
+
+
+def get_overlap_files(esd_dir: str = ESD_DIR) -> list:
+    """
+    Returns
+    -------
+    list
+        (coherence, interferogram) file pairs of all burst overlaps
+    """
+    pairs = []
+    cor_pattern = os.path.join(esd_dir, 'overlap_IW*_*.cor')
+    for cor_file in sorted(glob(cor_pattern)):
+        if OVERLAP_COR_RE.match(os.path.basename(cor_file)) is None:
+            continue
+        int_file = cor_file[:-len('.cor')] + '.int'
+        if not os.path.exists(int_file):
+            logger.warning(f'No interferogram for {cor_file}')
+            continue
+        pairs.append((cor_file, int_file))
+    return pairs
+
+
+def get_valid_coherence(cor_file: str, int_file: str) -> np.ndarray:
+    """
+    Coherence of the overlap pixels usable for ESD, masked as in the esd
+    step (non-zero interferogram).
+    """
+    cor = np.fromfile(cor_file, dtype=np.float32)
+    ifg = np.fromfile(int_file, dtype=np.complex64)
+    if cor.size != ifg.size:
+        raise RuntimeError(f'Size of {cor_file} does not match {int_file}')
+    valid = np.isfinite(cor) & np.isfinite(ifg) & (np.abs(ifg) > 0)
+    return cor[valid]
+
+
+def count_points_above_thresholds(thresholds: list,
+                                  esd_dir: str = ESD_DIR) -> dict:
+    """
+    Returns
+    -------
+    dict
+        Number of overlap pixels with a coherence above each threshold
+    """
+    overlap_files = get_overlap_files(esd_dir)
+    if not overlap_files:
+        raise RuntimeError(f'No burst overlap files found in {esd_dir}')
+    counts = dict.fromkeys(thresholds, 0)
+    for cor_file, int_file in overlap_files:
+        cor = np.sort(get_valid_coherence(cor_file, int_file))
+        for threshold in thresholds:
+            n_below = np.searchsorted(cor, threshold, side='right')
+            counts[threshold] += int(cor.size - n_below)
+    return counts
+
+
+def select_esd_threshold(thresholds: list,
+                         esd_dir: str = ESD_DIR,
+                         min_points: int = 1):
+    """
+    Returns
+    -------
+    float or None
+        Highest threshold leaving at least `min_points` overlap pixels or None
+        if no threshold does.
+
+    Raises RuntimeError if no burst overlap files were found.
+    """
+    counts = count_points_above_thresholds(thresholds, esd_dir)
+    logger.info(f'ESD points per coherence threshold: {counts}')
+    for threshold in sorted(thresholds, reverse=True):
+        if counts[threshold] >= min_points:
+            return threshold
+    return None
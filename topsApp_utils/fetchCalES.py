@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 import os, sys, re, json, requests, datetime, tarfile, argparse
 from pprint import pprint
-import numpy as np
 from topsApp_utils.UrlUtils import UrlUtils
 
 
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark and validation of the vectorized metadata cube kernel.
+
+Rows of the cube of a pair are computed both by the scalar implementation
+(`Cube.calc_row_reference`, one point at a time with ISCE's orbit) and by
+the vectorized kernel (`Cube.calc_row`). The time per row of both, the
+speedup and the largest difference of each layer are reported. Usage:
+
+    geocube_benchmark.py -m master -s slave [--rows 5] [--json out.json]
+
+The exit status is 1 if a layer differs by more than its tolerance.
+"""
+import sys
+import json
+import argparse
+import logging
+from time import time
+import numpy as np
+from topsApp_utils import makeGeocube
+from topsApp_utils.geocube_kernel import (REFERENCE_LAYERS,
+                                          SECONDARY_LAYERS)
+
+# Largest acceptable differences (degrees, seconds or meters)
+TOLERANCES = {'lookangle': 1e-5,
+              'incangle': 1e-5,
+              'azangle': 1e-5,
+              'azimuthtime': 1e-5,
+              'slantrange': 1e-2,
+              'bpar': 1e-2,
+              'bperp': 1e-2,
+              'slavetime': 1e-5,
+              'slaverange': 1e-2}
+
+NO_DATA = -9999.
+
+
+def make_cube(inps):
+    """Cube writing to in-memory arrays."""
+    shape = (len(inps.heights), inps.Ny, inps.Nx)
+    layers = {}
+    for name in REFERENCE_LAYERS + SECONDARY_LAYERS:
+        dtype = np.float64 if name in ('azimuthtime', 'slantrange',
+                                       'slavetime', 'slaverange') \
+            else np.float32
+        layers[name] = np.full(shape, NO_DATA, dtype=dtype)
+    return makeGeocube.Cube(inps, latvector=np.zeros(inps.Ny),
+                            lonvector=np.zeros(inps.Nx), **layers)
+
+
+def get_rows(n_rows: int, rows: int) -> list:
+    """`rows` rows spread over the cube."""
+    return sorted(set(np.linspace(0, n_rows - 1, min(rows, n_rows))
+                      .round().astype(int).tolist()))
+
+
+def compare(reference, vectorized, rows: list) -> dict:
+    """Largest absolute difference of each layer over `rows`."""
+    diffs = {}
+    for name in REFERENCE_LAYERS + SECONDARY_LAYERS:
+        ref = getattr(reference, name)[:, rows]
+        vec = getattr(vectorized, name)[:, rows]
+        both = np.isfinite(ref) & np.isfinite(vec)
+        mismatch = int(np.count_nonzero(np.isfinite(ref) != np.isfinite(vec)))
+        diffs[name] = {'max_abs_diff': float(np.max(np.abs(ref[both] -
+                                                           vec[both])))
+                       if both.any() else 0.,
+                       'nan_mismatch': mismatch}
+    return diffs
+
+
+def main():
+    formatter = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=formatter)
+    parser.add_argument('-m', '--master', required=True)
+    parser.add_argument('-s', '--slave', required=True)
+    parser.add_argument('-z', '--hgt', dest='heights', type=float, nargs='+',
+                        default=[-1500., 0., 3000., 9000.])
+    parser.add_argument('-y', '--yspc', dest='yspacing', type=float,
+                        default=0.1)
+    parser.add_argument('-x', '--xspc', dest='xspacing', type=float,
+                        default=0.1)
+    parser.add_argument('-e', '--epsg', type=int, default=4326)
+    parser.add_argument('--rows', type=int, default=5,
+                        help='Number of rows computed by both')
+    parser.add_argument('--json', dest='json_file', default=None)
+    inps = parser.parse_args()
+    inps.heights = np.sort(np.array(inps.heights))
+
+    makeGeocube.loadMetadata(inps)
+    makeGeocube.generateSummary(inps)
+    makeGeocube.estimateGridPoints(inps)
+    rows = get_rows(inps.Ny, inps.rows)
+
+    reference = make_cube(inps)
+    start = time()
+    for ii in rows:
+        reference.calc_row_reference(ii)
+    reference_time = (time() - start) / len(rows)
+
+    vectorized = make_cube(inps)
+    start = time()
+    for ii in rows:
+        vectorized.calc_row(ii)
+    vectorized_time = (time() - start) / len(rows)
+
+    diffs = compare(reference, vectorized, rows)
+    failed = [name for name, diff in diffs.items()
+              if diff['max_abs_diff'] > TOLERANCES[name] or
+              diff['nan_mismatch']]
+
+    print(f'Cube {len(inps.heights)} x {inps.Ny} x {inps.Nx}, '
+          f'{len(rows)} rows compared')
+    print(f'scalar     {reference_time:9.4f} s/row')
+    print(f'vectorized {vectorized_time:9.4f} s/row')
+    print(f'speedup    {reference_time / vectorized_time:9.1f} x')
+    for name, diff in diffs.items():
+        print(f'{name:<12} {diff["max_abs_diff"]:.3e} '
+              f'(tolerance {TOLERANCES[name]:.0e}, '
+              f'{diff["nan_mismatch"]} nodata mismatches)')
+
+    if inps.json_file is not None:
+        with open(inps.json_file, 'w') as f:
+            json.dump({'rows': rows,
+                       'scalar_seconds_per_row': reference_time,
+                       'vectorized_seconds_per_row': vectorized_time,
+                       'differences': diffs}, f, indent=2)
+
+    if failed:
+        print(f'Over tolerance: {", ".join(failed)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    log_format = '[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s'
+    logging.basicConfig(format=log_format, level=logging.WARNING)
+    sys.exit(main())
@@ -0,0 +1,324 @@
+"""
+Vectorized kernel of the metadata cube of makeGeocube.py.
+
+The metadata layers of all points of a block of the cube grid (heights x
+rows x columns) are computed at once: the grid is transformed with reusable
+pyproj Transformers, the zero Doppler geometry of the reference and
+secondary orbits is solved for all points with an array Newton iteration
+and the orbits are interpolated with a vectorized version of ISCE's
+Hermite interpolation. The arithmetic follows `Cube.calc_row_reference`,
+the scalar implementation it replaces.
+
+The reference-only layers (REFERENCE_LAYERS) only depend on the reference
+orbit and the grid; given those layers, e.g. cached by an earlier pair with
+the same reference, only the secondary geometry is solved.
+"""
+import json
+import hashlib
+import numpy as np
+
+# Changing the computation of the reference-only layers invalidates their
+# cached copies
+CACHE_VERSION = 1
+
+# ISCE's Orbit.geo2rdr settings
+GEO2RDR_MAX_ITER = 51
+GEO2RDR_TOLERANCE = 1e-6
+
+LLA = '+proj=latlong +ellps=WGS84 +datum=WGS84'
+ECEF = '+proj=geocent +ellps=WGS84 +datum=WGS84'
+
+REFERENCE_LAYERS = ['lookangle', 'incangle', 'azangle', 'azimuthtime',
+                    'slantrange']
+SECONDARY_LAYERS = ['bpar', 'bperp', 'slavetime', 'slaverange']
+
+
+class HermiteOrbit(object):
+    """
+    Orbit state vectors interpolated as ISCE's
+    `Orbit.interpolateOrbit(time, method='hermite')`: a Hermite polynomial
+    through the positions and velocities of the 4 state vectors around
+    each time.
+
+    Parameters
+    ----------
+    epoch : datetime.datetime
+        Time of the first state vector; times are seconds since `epoch`
+    times, positions, velocities : numpy.ndarray
+        State vectors, shapes (N,), (N, 3) and (N, 3)
+    """
+
+    def __init__(self, epoch, times, positions, velocities):
+        if len(times) < 4:
+            raise ValueError('At least 4 state vectors are needed')
+        self.epoch = epoch
+        self.times = np.asarray(times, dtype=np.float64)
+        self.positions = np.asarray(positions, dtype=np.float64)
+        self.velocities = np.asarray(velocities, dtype=np.float64)
+
+    @classmethod
+    def from_isce(cls, orbit):
+        state_vectors = list(orbit)
+        epoch = state_vectors[0].getTime()
+        return cls(epoch,
+                   [(sv.getTime() - epoch).total_seconds()
+                    for sv in state_vectors],
+                   [sv.getPosition() for sv in state_vectors],
+                   [sv.getVelocity() for sv in state_vectors])
+
+    @property
+    def min_time(self) -> float:
+        return self.times[0]
+
+    @property
+    def max_time(self) -> float:
+        return self.times[-1]
+
+    def interpolate(self, t):
+        """
+        Positions and velocities at times `t` (any shape), each of shape
+        `t.shape + (3,)`.
+        """
+        t = np.asarray(t, dtype=np.float64)
+        n_vectors = len(self.times)
+        first = np.clip(np.searchsorted(self.times, t) - 2, 0, n_vectors - 4)
+        nodes = first[..., None] + np.arange(4)
+        t_nodes = self.times[nodes]
+        dt = t[..., None] - t_nodes
+
+        # Lagrange basis L_i(t), its derivative and sum_j 1 / (t_i - t_j)
+        basis = np.ones(dt.shape)
+        basis_der = np.zeros(dt.shape)
+        inv_sum = np.zeros(dt.shape)
+        for i in range(4):
+            for j in range(4):
+                if j == i:
+                    continue
+                denom = t_nodes[..., i] - t_nodes[..., j]
+                basis[..., i] *= dt[..., j] / denom
+                inv_sum[..., i] += 1. / denom
+                term = 1. / denom
+                for k in range(4):
+                    if k != i and k != j:
+                        term = term * dt[..., k] / (t_nodes[..., i] -
+                                                    t_nodes[..., k])
+                basis_der[..., i] += term
+
+        basis2 = basis * basis
+        h_pos = (1. - 2. * dt * inv_sum) * basis2
+        h_vel = dt * basis2
+        dh_pos = (-2. * inv_sum * basis2 +
+                  (1. - 2. * dt * inv_sum) * 2. * basis * basis_der)
+        dh_vel = basis2 + dt * 2. * basis * basis_der
+
+        positions = self.positions[nodes]
+        velocities = self.velocities[nodes]
+        pos = (np.sum(h_pos[..., None] * positions, axis=-2) +
+               np.sum(h_vel[..., None] * velocities, axis=-2))
+        vel = (np.sum(dh_pos[..., None] * positions, axis=-2) +
+               np.sum(dh_vel[..., None] * velocities, axis=-2))
+        return pos, vel
+
+    def geo2rdr(self, xyz):
+        """
+        Zero Doppler time and slant range of the ECEF targets `xyz` (shape
+        `(..., 3)`) by the Newton iteration of ISCE's `Orbit.geo2rdr`.
+
+        Returns
+        -------
+        tuple
+            Times (seconds since `epoch`), slant ranges and a mask of the
+            targets whose iteration stayed within the orbit; ISCE raises for
+            the others
+        """
+        shape = xyz.shape[:-1]
+        t = np.full(shape, 0.5 * (self.min_time + self.max_time))
+        rng = np.full(shape, np.nan)
+        valid = np.ones(shape, dtype=bool)
+        active = np.ones(shape, dtype=bool)
+        for _ in range(GEO2RDR_MAX_ITER):
+            valid &= ~active | ((t >= self.min_time) & (t <= self.max_time))
+            active &= valid
+            if not active.any():
+                break
+            pos, vel = self.interpolate(t[active])
+            dr = xyz[active] - pos
+            rng[active] = np.linalg.norm(dr, axis=-1)
+            step = np.sum(dr * vel, axis=-1) / -np.sum(vel * vel, axis=-1)
+            t[active] -= step
+            converged = np.zeros(shape, dtype=bool)
+            converged[active] = np.abs(step) < GEO2RDR_TOLERANCE
+            active &= ~converged
+        valid &= (t >= self.min_time) & (t <= self.max_time)
+        return t, rng, valid
+
+
+def nvector(lon, lat):
+    """n-vectors (..., 3) of geodetic longitudes and latitudes."""
+    lon = np.radians(lon)
+    lat = np.radians(lat)
+    return np.stack([np.cos(lat) * np.cos(lon),
+                     np.cos(lat) * np.sin(lon),
+                     np.sin(lat)], axis=-1)
+
+
+class GeocubeKernel(object):
+    """
+    Parameters
+    ----------
+    orbit, slave_orbit : HermiteOrbit
+        Reference and secondary orbits
+    proj : str
+        Projection of the cube grid, e.g. 'EPSG:4326'
+    utm : str
+        Local UTM projection, in which the azimuth angles are measured
+    midnight, slave_midnight : datetime.datetime
+        Origins of the reference and secondary times of day
+    """
+
+    def __init__(self, orbit, slave_orbit, proj, utm, midnight,
+                 slave_midnight):
+        self.orbit = orbit
+        self.slave_orbit = slave_orbit
+        self.proj = proj
+        self.utm = utm
+        self.time_offset = (orbit.epoch - midnight).total_seconds()
+        self.slave_time_offset = (slave_orbit.epoch -
+                                  slave_midnight).total_seconds()
+        self._transformers = None
+
+    @classmethod
+    def from_inps(cls, inps):
+        """Kernel of the inputs prepared by makeGeocube.py."""
+        return cls(HermiteOrbit.from_isce(inps.orbit),
+                   HermiteOrbit.from_isce(inps.slaveorbit),
+                   inps.proj4,
+                   inps.utm,
+                   inps.midnight,
+                   inps.slaveMidnight)
+
+    def __getstate__(self):
+        # Transformers are created again where the kernel is unpickled
+        state = dict(self.__dict__)
+        state['_transformers'] = None
+        return state
+
+    @property
+    def transformers(self) -> dict:
+        if self._transformers is None:
+            from pyproj import Transformer
+
+            def make(src, dst):
+                return Transformer.from_crs(src, dst, always_xy=True)
+
+            self._transformers = {'proj_lla': make(self.proj, LLA),
+                                  'proj_ecef': make(self.proj, ECEF),
+                                  'proj_utm': make(self.proj, self.utm),
+                                  'ecef_lla': make(ECEF, LLA),
+                                  'lla_utm': make(LLA, self.utm)}
+        return self._transformers
+
+    def get_reference_key(self, grid: dict, shape: tuple) -> str:
+        """
+        Cache key of the reference-only layers of the cube: digest of the
+        reference orbit, the origin of its times of day, the projections
+        and the grid of shape (heights, rows, columns).
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps({'version': CACHE_VERSION,
+                                  'epoch': self.orbit.epoch.isoformat(),
+                                  'time_offset': self.time_offset,
+                                  'proj': self.proj,
+                                  'utm': self.utm,
+                                  'x0': float(grid['x0']),
+                                  'xspacing': float(grid['xspacing']),
+                                  'y1': float(grid['y1']),
+                                  'yspacing': float(grid['yspacing']),
+                                  'heights': [float(h)
+                                              for h in grid['heights']],
+                                  'shape': list(shape)},
+                                 sort_keys=True).encode('utf8'))
+        for array in (self.orbit.times, self.orbit.positions,
+                      self.orbit.velocities):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def compute(self, xs, ys, heights, reference: dict = None) -> dict:
+        """
+        Metadata layers of the grid points `heights` x `ys` x `xs`.
+
+        If the reference-only layers of the points are given in
+        `reference` (REFERENCE_LAYERS and `valid`, e.g. from a cache), only
+        the secondary geometry is solved.
+
+        Returns
+        -------
+        dict
+            Layers of shape (heights, ys, xs) named as the `Cube` arrays,
+            with `valid`, where the reference geometry could be solved, and
+            `slave_valid`, where the secondary geometry could also be solved
+        """
+        tr = self.transformers
+        hh, yy, xx = np.meshgrid(np.asarray(heights, dtype=np.float64),
+                                 np.asarray(ys, dtype=np.float64),
+                                 np.asarray(xs, dtype=np.float64),
+                                 indexing='ij')
+        targxyz = np.stack(tr['proj_ecef'].transform(xx, yy, hh), axis=-1)
+
+        if reference is None:
+            mtaz, mrng, valid = self.orbit.geo2rdr(targxyz)
+        else:
+            mtaz = reference['azimuthtime'] - self.time_offset
+            mrng = reference['slantrange']
+            valid = reference['valid'].astype(bool)
+        satpos, satvel = self.orbit.interpolate(
+            np.clip(mtaz, self.orbit.min_time, self.orbit.max_time))
+
+        losvec = (targxyz - satpos) / mrng[..., None]
+        losvec /= np.linalg.norm(losvec, axis=-1)[..., None]
+
+        staz, srng, slave_valid = self.slave_orbit.geo2rdr(targxyz)
+        slavexyz, _ = self.slave_orbit.interpolate(
+            np.clip(staz, self.slave_orbit.min_time,
+                    self.slave_orbit.max_time))
+        baseline_vec = slavexyz - satpos
+        direction = np.sign(np.sum(np.cross(losvec, baseline_vec) * satvel,
+                                   axis=-1))
+        baseline = np.linalg.norm(baseline_vec, axis=-1)
+        bpar = np.sum(losvec * baseline_vec, axis=-1)
+        with np.errstate(invalid='ignore'):
+            bperp = direction * np.sqrt(baseline * baseline - bpar * bpar)
+
+        layers = {'bpar': bpar,
+                  'bperp': bperp,
+                  'slavetime': staz + self.slave_time_offset,
+                  'slaverange': srng,
+                  'valid': valid,
+                  'slave_valid': valid & slave_valid}
+        if reference is not None:
+            layers.update((name, reference[name])
+                          for name in REFERENCE_LAYERS)
+            return layers
+
+        lon, lat, _ = tr['proj_lla'].transform(xx, yy, hh)
+        targutm_x, targutm_y, _ = tr['proj_utm'].transform(xx, yy, hh)
+        targnorm = nvector(lon, lat)
+        satlon, satlat, sathgt = tr['ecef_lla'].transform(satpos[..., 0],
+                                                          satpos[..., 1],
+                                                          satpos[..., 2])
+        satutm_x, satutm_y, _ = tr['lla_utm'].transform(satlon, satlat,
+                                                        sathgt)
+        satnorm = nvector(satlon, satlat)
+        with np.errstate(invalid='ignore'):
+            lookangle = np.degrees(np.arccos(np.sum(satnorm * -losvec,
+                                                    axis=-1)))
+            incangle = np.degrees(np.arccos(np.sum(targnorm * -losvec,
+                                                   axis=-1)))
+        azangle = np.degrees(np.arctan2(satutm_y - targutm_y,
+                                        satutm_x - targutm_x))
+        layers.update({'lookangle': lookangle,
+                       'incangle': incangle,
+                       'azangle': azangle,
+                       'azimuthtime': mtaz + self.time_offset,
+                       'slantrange': mrng})
+        return layers
@@ -0,0 +1,271 @@
+"""
+Content-addressed cache of the reference geometry computed by topsApp.py's
+topo step.
+
+The lat/lon/hgt/los/shadowMask/incLocal rasters of a burst only depend on
+the reference burst, its orbit, the DEM and the topo settings, so the key of
+a cache entry is a digest of those. In a network where a reference date
+appears in many pairs, `shadow_mask/runTopo.py` copies the rasters of a
+burst from the cache instead of running topozero again.
+makeGeocube.py caches the reference-only layers of the metadata cube the
+same way, as entries `geocube-<key>`, and burst_slc_cache.py the burst SLCs
+of the acquisitions, as entries `burst-<key>`.
+
+The cache is enabled by setting the environment variable TOPO_CACHE_DIR to
+a (node-local) directory. Entries are verified against the checksums in
+their manifest when they are used, written atomically and evicted in least
+recently used order once the cache exceeds TOPO_CACHE_MAX_BYTES.
+"""
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+
+logger = logging.getLogger('geometry_cache')
+
+CACHE_DIR_ENV = 'TOPO_CACHE_DIR'
+MAX_BYTES_ENV = 'TOPO_CACHE_MAX_BYTES'
+MAX_BYTES = 200 * 2**30
+
+# Changing the layout of entries or the topo outputs invalidates old entries
+CACHE_VERSION = 1
+
+MANIFEST = 'manifest.json'
+LOCK_FILE = '.lock'
+TMP_PREFIX = '.tmp-'
+CHUNK_BYTES = 16 * 2**20
+
+# Files written by ISCE next to each raster
+COMPANION_SUFFIXES = ['.xml', '.vrt']
+
+
+def get_file_digest(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_with_digest(src: str, dst: str) -> str:
+    """Copy `src` to `dst` and return the digest of the copied bytes."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        for chunk in iter(lambda: fsrc.read(CHUNK_BYTES), b''):
+            digest.update(chunk)
+            fdst.write(chunk)
+    return digest.hexdigest()
+
+
+def get_dem_digest(dem_file: str) -> str:
+    """Digest of the DEM raster and of its geolocation (ISCE xml)."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(get_file_digest(dem_file).encode('utf8'))
+    xml_file = f'{dem_file}.xml'
+    if os.path.exists(xml_file):
+        with open(xml_file, 'rb') as f:
+            # The xml records the DEM path, which may differ between jobs
+            xml = f.read().replace(dem_file.encode('utf8'), b'')
+        digest.update(xml)
+    return digest.hexdigest()
+
+
+def get_orbit_state(orbit) -> list:
+    return [[sv.getTime().isoformat(),
+             list(sv.getPosition()),
+             list(sv.getVelocity())] for sv in orbit]
+
+
+def get_burst_key(burst, swath: int, dem_digest: str, params: dict) -> str:
+    """
+    Parameters
+    ----------
+    burst : BurstSLC
+        Reference burst as loaded from the reference product
+    swath : int
+        Subswath number of the burst
+    dem_digest : str
+        From `get_dem_digest`
+    params : dict
+        Topo settings that are not burst attributes
+
+    Returns
+    -------
+    str
+        Cache key of the geometry rasters of the burst
+    """
+    burst_state = {'version': CACHE_VERSION,
+                   'swath': swath,
+                   'sensing_start': burst.sensingStart.isoformat(),
+                   'number_of_lines': burst.numberOfLines,
+                   'number_of_samples': burst.numberOfSamples,
+                   'starting_range': burst.startingRange,
+                   'range_pixel_size': burst.rangePixelSize,
+                   'azimuth_time_interval': burst.azimuthTimeInterval,
+                   'radar_wavelength': burst.radarWavelength,
+                   'orbit': get_orbit_state(burst.orbit),
+                   'dem': dem_digest,
+                   'params': params}
+    payload = json.dumps(burst_state, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf8')).hexdigest()
+
+
+def rewrite_companion(src: str, dst: str, old_path: str, new_path: str):
+    """Copy an ISCE xml/vrt pointing to `old_path` so it points to
+    `new_path`."""
+    with open(src) as f:
+        text = f.read()
+    text = text.replace(old_path, new_path)
+    text = text.replace(os.path.basename(old_path),
+                        os.path.basename(new_path))
+    with open(dst, 'w') as f:
+        f.write(text)
+
+
+class GeometryCache(object):
+    """
+    Directory of entries `<key>/` holding the rasters of one burst and a
+    manifest with their sizes, checksums and original names.
+    """
+
+    def __init__(self, root: str, max_bytes: int = MAX_BYTES):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """The cache configured by the environment or None if disabled."""
+        root = os.environ.get(CACHE_DIR_ENV)
+        if not root:
+            return None
+        max_bytes = int(os.environ.get(MAX_BYTES_ENV, MAX_BYTES))
+        return cls(root, max_bytes=max_bytes)
+
+    def get_entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _read_manifest(self, entry_dir: str) -> dict:
+        with open(os.path.join(entry_dir, MANIFEST)) as f:
+            return json.load(f)
+
+    def fetch(self, key: str, outputs: dict):
+        """
+        Copy the rasters of entry `key` to the paths of `outputs`, a dict
+        of raster name (e.g. 'lat') to output path.
+
+        Returns
+        -------
+        dict or None
+            The metadata stored with the entry or None on a miss or if the
+            entry is incomplete or corrupt
+        """
+        entry_dir = self.get_entry_dir(key)
+        try:
+            manifest = self._read_manifest(entry_dir)
+        except (OSError, ValueError):
+            return None
+        if set(manifest['files']) != set(outputs):
+            logger.warning(f'Geometry cache entry {key} has other rasters')
+            return None
+
+        try:
+            for name, path in outputs.items():
+                record = manifest['files'][name]
+                src = os.path.join(entry_dir, name)
+                if os.path.getsize(src) != record['size'] or \
+                        copy_with_digest(src, path) != record['digest']:
+                    raise RuntimeError(f'Checksum mismatch of {src}')
+                for suffix in record['companions']:
+                    rewrite_companion(src + suffix, path + suffix,
+                                      record['path'], path)
+        except (OSError, RuntimeError) as err:
+            logger.warning(f'Discarding geometry cache entry {key}: {err}')
+            self.remove(key)
+            # Only the files of the entry are removed
+            for name, path in outputs.items():
+                companions = manifest['files'][name]['companions']
+                for suffix in [''] + companions:
+                    if os.path.exists(path + suffix):
+                        os.unlink(path + suffix)
+            return None
+
+        # Most recently used entries are evicted last
+        os.utime(os.path.join(entry_dir, MANIFEST))
+        return manifest['metadata']
+
+    def store(self, key: str, outputs: dict, metadata: dict = None,
+              companion_suffixes: list = COMPANION_SUFFIXES):
+        """
+        Add the rasters of `outputs` as entry `key`, with their files of
+        `companion_suffixes`.
+        """
+        entry_dir = self.get_entry_dir(key)
+        if os.path.exists(entry_dir):
+            return
+        tmp_dir = os.path.join(self.root,
+                               f'{TMP_PREFIX}{key}-{os.getpid()}')
+        os.makedirs(tmp_dir, exist_ok=True)
+        try:
+            files = {}
+            for name, path in outputs.items():
+                dst = os.path.join(tmp_dir, name)
+                companions = []
+                for suffix in companion_suffixes:
+                    if os.path.exists(path + suffix):
+                        shutil.copyfile(path + suffix, dst + suffix)
+                        companions.append(suffix)
+                files[name] = {'path': path,
+                               'size': os.path.getsize(path),
+                               'digest': copy_with_digest(path, dst),
+                               'companions': companions}
+            manifest = {'version': CACHE_VERSION,
+                        'created': time.time(),
+                        'bytes': sum(record['size']
+                                     for record in files.values()),
+                        'files': files,
+                        'metadata': metadata or {}}
+            with open(os.path.join(tmp_dir, MANIFEST), 'w') as f:
+                json.dump(manifest, f, indent=2)
+            # Another job may have stored the same entry in the meantime
+            os.rename(tmp_dir, entry_dir)
+        except OSError as err:
+            logger.warning(f'Could not store geometry cache entry {key}: '
+                           f'{err}')
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        self.evict()
+
+    def remove(self, key: str):
+        shutil.rmtree(self.get_entry_dir(key), ignore_errors=True)
+
+    def get_entries(self) -> list:
+        """(last use, bytes, key) of all complete entries."""
+        entries = []
+        for key in os.listdir(self.root):
+            if key.startswith('.'):
+                continue
+            manifest_file = os.path.join(self.root, key, MANIFEST)
+            try:
+                with open(manifest_file) as f:
+                    size = json.load(f)['bytes']
+                entries.append((os.path.getmtime(manifest_file), size, key))
+            except (OSError, ValueError, KeyError):
+                continue
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries beyond `max_bytes`."""
+        with open(os.path.join(self.root, LOCK_FILE), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = sorted(self.get_entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in entries:
+                if total <= self.max_bytes:
+                    break
+                logger.info(f'Evicting geometry cache entry {key}')
+                self.remove(key)
+                total -= size
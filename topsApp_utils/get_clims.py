@@ -4,16 +4,9 @@ Return absolute min, absolute max, min percentile, and max percentile
 values of data in a raster band.
 """
 import os, sys, argparse, logging, traceback
-import numpy as np
-from osgeo import gdal
-from gdalconst import GA_ReadOnly
-
-
-gdal.UseExceptions() # make GDAL raise python exceptions
 
 
 log_format = "[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s"
-logging.basicConfig(format=log_format, level=logging.INFO)
 logger = logging.getLogger('get_clims')
 
 
@@ -21,6 +14,11 @@ def get_clims(raster, band, clim_min_pct=None, clim_max_pct=None, nodata=None):
     """Get data absolute min/max values as well as min/max percentile values
        for a given GDAL-recognized file format for a particular band."""
 
+    import numpy as np
+    from osgeo import gdal
+    from gdalconst import GA_ReadOnly
+    gdal.UseExceptions() # make GDAL raise python exceptions
+
     # load raster
     gd = gdal.Open(raster, GA_ReadOnly)
 
@@ -51,6 +49,7 @@ def get_clims(raster, band, clim_min_pct=None, clim_max_pct=None, nodata=None):
 
 
 if __name__ == "__main__":
+    logging.basicConfig(format=log_format, level=logging.INFO)
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("raster", help="input raster file (any GDAL-recognized file format)")
     parser.add_argument("-b", "--band", dest="band", type=int, default=1,
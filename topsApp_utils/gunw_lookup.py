@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Batched lookup of existing GUNW products in GRQ.
+
+Many (reference scenes, secondary scenes, version) tuples are resolved with
+a single Elasticsearch multi-search request. Elasticsearch clients are
+pooled per endpoint and results are kept in a short-lived local cache so
+that repeated checks (e.g. when submitting a reprocessing campaign and
+again within each job) do not query GRQ again.
+
+Usage:
+
+    gunw_lookup.py pairs.json --index 'grq_*_s1-gunw'
+
+where pairs.json is a list of objects with the keys `reference_scenes`,
+`secondary_scenes` and `version`. A json list with one boolean per pair is
+written to stdout.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from elasticsearch import Elasticsearch
+from elasticsearch_dsl import Search, MultiSearch, Q
+
+logger = logging.getLogger('gunw_lookup')
+
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache',
+                          'gunw_lookup.json')
+CACHE_TTL = 600
+
+# Elasticsearch clients keyed by (url, http_auth)
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_grq_client(es_url: str, http_auth: tuple = None) -> Elasticsearch:
+    """Return a pooled Elasticsearch client for `es_url`."""
+    key = (es_url, http_auth)
+    with _CLIENTS_LOCK:
+        if key not in _CLIENTS:
+            _CLIENTS[key] = Elasticsearch(es_url,
+                                          http_auth=http_auth,
+                                          verify_certs=False,
+                                          )
+        return _CLIENTS[key]
+
+
+def update_str(item: str) -> str:
+    return r'"' + item + r'"'
+
+
+def get_gunw_query(reference_scenes: list,
+                   secondary_scenes: list,
+                   version: str):
+    reference_scenes_ = list(map(update_str, reference_scenes))
+    secondary_scenes_ = list(map(update_str, secondary_scenes))
+
+    reference_matches = [Q('query_string',
+                           query=scene,
+                           default_field="metadata.reference_scenes")
+                         for scene in reference_scenes_]
+    secondary_matches = [Q('query_string',
+                           query=scene,
+                           default_field="metadata.secondary_scenes")
+                         for scene in secondary_scenes_]
+    version_match = [Q('query_string',
+                       query=version[:3],
+                       default_field="version")]
+    qq = Q('bool', must=(reference_matches +
+                         secondary_matches +
+                         version_match))
+    return qq
+
+
+def get_cache_key(index: str,
+                  reference_scenes: list,
+                  secondary_scenes: list,
+                  version: str) -> str:
+    payload = json.dumps([index,
+                          sorted(reference_scenes),
+                          sorted(secondary_scenes),
+                          version[:3]])
+    return hashlib.sha1(payload.encode('utf8')).hexdigest()
+
+
+class ResultCache(object):
+    """
+    Json file cache of lookup results that expire after `ttl` seconds.
+    """
+
+    def __init__(self, cache_file: str = CACHE_FILE, ttl: float = CACHE_TTL):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self._data = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.cache_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        now = time.time()
+        return {key: value for key, value in data.items()
+                if now - value['time'] < self.ttl}
+
+    def get(self, key: str):
+        value = self._data.get(key)
+        if value is None or time.time() - value['time'] >= self.ttl:
+            return None
+        return value['exists']
+
+    def set(self, key: str, exists: bool):
+        self._data[key] = {'exists': exists, 'time': time.time()}
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp_file = f'{self.cache_file}.{os.getpid()}.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(self._data, f)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as err:
+            logger.warning(f'Could not write {self.cache_file}: {err}')
+
+
+def has_consistent_scenes(hit,
+                          reference_scenes: list,
+                          secondary_scenes: list) -> bool:
+    # The query only ensures the scenes are a subset; ensure set equality
+    ref_consistent = (len(reference_scenes) ==
+                      len(hit['metadata']['reference_scenes']))
+    sec_consistent = (len(secondary_scenes) ==
+                      len(hit['metadata']['secondary_scenes']))
+    return sec_consistent and ref_consistent
+
+
+def find_existing_gunws(pairs: list,
+                        client: Elasticsearch,
+                        index: str,
+                        cache: ResultCache = None) -> list:
+    """
+    Parameters
+    ----------
+    pairs : list
+        (reference_scenes, secondary_scenes, version) tuples
+    client : Elasticsearch
+        GRQ client, e.g. from `get_grq_client`
+    index : str
+        Index pattern of the GUNW dataset, e.g. 'grq_*_s1-gunw'
+    cache : ResultCache
+        If specified, cached results are used and new ones are added
+
+    Returns
+    -------
+    list
+        True for each pair for which a GUNW with the same scenes and version
+        exists
+    """
+    results = [None] * len(pairs)
+    keys = [get_cache_key(index, *pair) for pair in pairs]
+    if cache is not None:
+        results = [cache.get(key) for key in keys]
+
+    todo = [i for i, result in enumerate(results) if result is None]
+    if todo:
+        ms = MultiSearch(using=client, index=index)
+        for i in todo:
+            ms = ms.add(Search().query(get_gunw_query(*pairs[i])))
+        logger.info(f'Querying {index} for {len(todo)} of {len(pairs)} '
+                    'pairs')
+        responses = ms.execute()
+        for i, response in zip(todo, responses):
+            reference_scenes, secondary_scenes, version = pairs[i]
+            results[i] = any(has_consistent_scenes(hit,
+                                                   reference_scenes,
+                                                   secondary_scenes)
+                             for hit in response.hits)
+            if cache is not None:
+                cache.set(keys[i], results[i])
+        if cache is not None:
+            cache.save()
+    return results
+
+
+def main():
+    formatter = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=formatter)
+    parser.add_argument('pairs_file',
+                        help='json list of objects with reference_scenes, '
+                             'secondary_scenes and version')
+    parser.add_argument('--index', default='grq_*_s1-gunw',
+                        help='GUNW index pattern')
+    parser.add_argument('--es-url', default=None,
+                        help='GRQ url (default: GRQ_URL of settings.conf)')
+    parser.add_argument('--cache-file', default=CACHE_FILE)
+    parser.add_argument('--cache-ttl', type=float, default=CACHE_TTL,
+                        help='Seconds results are cached; 0 disables cache')
+    args = parser.parse_args()
+
+    http_auth = None
+    es_url = args.es_url
+    if es_url is None:
+        from topsApp_utils.UrlUtils import UrlUtils
+        settings = UrlUtils()
+        es_url = settings['GRQ_URL']
+        if 'ES_USERNAME' in settings:
+            http_auth = (settings['ES_USERNAME'], settings['ES_PASSWORD'])
+
+    with open(args.pairs_file) as f:
+        pairs = [(pair['reference_scenes'],
+                  pair['secondary_scenes'],
+                  pair['version']) for pair in json.load(f)]
+
+    cache = None
+    if args.cache_ttl > 0:
+        cache = ResultCache(args.cache_file, ttl=args.cache_ttl)
+    client = get_grq_client(es_url, http_auth)
+    results = find_existing_gunws(pairs, client, args.index, cache=cache)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    log_format = '[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s'
+    logging.basicConfig(format=log_format, level=logging.INFO)
+    main()
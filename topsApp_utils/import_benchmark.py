@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Startup time benchmark of the PGE entry points.
+
+Every script of the PGE is launched as its own python process, so the time
+to import it is paid on every call. Each entry point is imported (without
+running its `__main__` block) in a fresh interpreter several times and the
+median import time, net of the bare interpreter start, is reported together
+with the slowest top level imports from `python -X importtime`.
+
+Usage:
+
+    import_benchmark.py [--repeat 5] [--budget 1.0] [--json out.json]
+
+With `--budget`, the exit status is 1 if any entry point fails to import or
+takes longer than the budget (in seconds) to import.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+REPO_PATH = os.path.dirname(BASE_PATH)
+
+# Scripts launched by the PGE or by the operators
+ENTRY_POINTS = ['create_standard_product_s1.py',
+                'preflight_s1.py',
+                'topsApp_utils/makeGeocube.py',
+                'topsApp_utils/standard_product_packaging.py',
+                'topsApp_utils/update_met_json_standard_product.py',
+                'topsApp_utils/create_tiles.py',
+                'topsApp_utils/get_clims.py',
+                'topsApp_utils/ned_dem.py',
+                'topsApp_utils/fetchCalES.py',
+                'topsApp_utils/gunw_lookup.py',
+                'topsApp_utils/dem_tile_cache.py',
+                'topsApp_utils/dem_stitcher.py',
+                'topsApp_utils/annotation_index.py',
+                'topsApp_utils/eof_orbit.py',
+                'topsApp_utils/validity_index.py',
+                ]
+
+# Imports the script without running its `__main__` block; the script
+# directory is first on sys.path as when it is launched
+IMPORT_CODE = """
+import sys, time, importlib.util
+path = sys.argv[1]
+sys.path[:0] = [sys.argv[2], sys.argv[3]]
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('_entry_point', path)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+print(time.perf_counter() - start)
+"""
+
+
+def get_interpreter_time(repeat: int = 5) -> float:
+    """Median wall time of starting and stopping a bare interpreter."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def parse_importtime(stderr: str, top: int = 5) -> list:
+    """
+    Returns
+    -------
+    list
+        (module, cumulative seconds) of the `top` slowest modules imported
+        directly by the entry point
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        # Nested imports are indented below the module importing them
+        if name.startswith('  '):
+            continue
+        imports.append((name.strip(), int(fields[1]) / 1e6))
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:top]
+
+
+def time_entry_point(script: str, repeat: int = 5, top: int = 5) -> dict:
+    """
+    Parameters
+    ----------
+    script : str
+        Path of the entry point relative to the repository
+    repeat : int
+        Number of fresh interpreters the script is imported in
+
+    Returns
+    -------
+    dict
+        Median and minimum import time in seconds, the slowest imports and
+        the error if the script could not be imported
+    """
+    path = os.path.join(REPO_PATH, script)
+    cmd = [sys.executable, '-X', 'importtime', '-c', IMPORT_CODE,
+           path, os.path.dirname(path), REPO_PATH]
+    env = dict(os.environ)
+    env.setdefault('TOPSAPP', REPO_PATH)
+
+    times = []
+    slowest = []
+    for _ in range(repeat):
+        proc = subprocess.run(cmd, capture_output=True, text=True,
+                              cwd=REPO_PATH, env=env)
+        if proc.returncode != 0:
+            error = proc.stderr.strip().splitlines()[-1:]
+            return {'script': script,
+                    'error': error[0] if error else 'failed'}
+        times.append(float(proc.stdout.strip().splitlines()[-1]))
+        slowest = parse_importtime(proc.stderr, top)
+    return {'script': script,
+            'median_seconds': statistics.median(times),
+            'min_seconds': min(times),
+            'slowest_imports': slowest}
+
+
+def main():
+    formatter = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=formatter)
+    parser.add_argument('scripts', nargs='*', default=ENTRY_POINTS,
+                        help='Entry points relative to the repository '
+                             '(default: all)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5,
+                        help='Number of slowest imports reported')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='Maximum import time in seconds')
+    parser.add_argument('--json', dest='json_file', default=None,
+                        help='Also write the results to this file')
+    args = parser.parse_args()
+
+    interpreter = get_interpreter_time(args.repeat)
+    print(f'python startup: {interpreter:.3f} s (not included below)')
+
+    results = []
+    over_budget = []
+    for script in args.scripts:
+        result = time_entry_point(script, args.repeat, args.top)
+        results.append(result)
+        if 'error' in result:
+            print(f'{script:<52} import failed: {result["error"]}')
+            if args.budget is not None:
+                over_budget.append(script)
+            continue
+        print(f'{script:<52} {result["median_seconds"]:7.3f} s')
+        for name, seconds in result['slowest_imports']:
+            print(f'    {name:<48} {seconds:7.3f} s')
+        if args.budget is not None and \
+                result['median_seconds'] > args.budget:
+            over_budget.append(script)
+
+    if args.json_file is not None:
+        with open(args.json_file, 'w') as f:
+            json.dump({'interpreter_seconds': interpreter,
+                       'entry_points': results}, f, indent=2)
+
+    if over_budget:
+        print(f'Over the {args.budget} s budget: {", ".join(over_budget)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,8 +4,6 @@ from builtins import range
 from past.utils import old_div
 import sys
 import os
-import isce
-from isceobj.Image.Image import Image
 import numpy as np
 
 __all__ = ['get_image','get_size','fix_xml','compute_residues',
@@ -13,6 +11,8 @@ __all__ = ['get_image','get_size','fix_xml','compute_residues',
 
 
 def get_image(fname):
+    import isce
+    from isceobj.Image.Image import Image
     im  = Image()
     im.load(fname)
     return im
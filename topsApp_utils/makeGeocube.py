@@ -7,26 +7,56 @@ from builtins import object
 from past.utils import old_div
 import numpy as np
 import os
-import isce
 import argparse
-import h5py
 import datetime
-import pyproj
 import pdb
 import logging
-import shutil
 from time import time
 from functools import wraps
-from joblib import Parallel, delayed, dump, load
 
-from iscesys.Component.ProductManager import ProductManager as PM
-from isceobj.Orbit.Orbit import Orbit
-from isceobj.Planet.Planet import Planet
+# isce, h5py and pyproj are imported where they are used so that the
+# command line is parsed before the slow imports
+from topsApp_utils.geocube_kernel import (GeocubeKernel,
+                                          REFERENCE_LAYERS,
+                                          SECONDARY_LAYERS)
 
 log_format = "[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s"
-logging.basicConfig(format=log_format, level=logging.INFO)
 logger = logging.getLogger('makeGeocube')
 
+# Rows and columns of the tiles computed by the workers
+TILE_SIZE = 16
+
+# HDF5 compression of the cube layers
+COMPRESSION = 'gzip'
+COMPRESSION_LEVEL = 4
+
+# Data types of the cube layers, HDF5 datasets of the layers and the
+# layers initialized to nodata (the others are 0 where not computed)
+LAYER_DTYPES = {'lookangle': np.float32,
+                'incangle': np.float32,
+                'azangle': np.float32,
+                'azimuthtime': np.float64,
+                'slantrange': np.float64,
+                'bpar': np.float32,
+                'bperp': np.float32,
+                'slavetime': np.float64,
+                'slaverange': np.float64}
+CUBE_DATASETS = {'bpar': 'bparallel',
+                 'bperp': 'bperp',
+                 'lookangle': 'lookangle',
+                 'incangle': 'incangle',
+                 'azangle': 'azangle',
+                 'azimuthtime': 'secondsofday',
+                 'slantrange': 'slantrange',
+                 'slavetime': 'slavetime',
+                 'slaverange': 'slaverange'}
+NODATA_LAYERS = ['lookangle', 'incangle', 'azangle', 'slantrange', 'bpar',
+                 'bperp']
+
+# Reference-only layers and where they were solved, cached across the pairs
+# of a reference date (see geometry_cache.py)
+CACHED_LAYERS = REFERENCE_LAYERS + ['valid']
+
 
 def simple_time_tracker(log_fun):
 
@@ -116,6 +146,37 @@ def cmdLineParse():
         type=int,
         default=4326,
         help='EPSG code for geocoded products')
+    parser.add_argument(
+        '-c',
+        '--cores',
+        dest='cores',
+        type=int,
+        default=None,
+        help='Core budget, default is OMP_NUM_THREADS')
+    parser.add_argument(
+        '-t',
+        '--tile-size',
+        dest='tile_size',
+        type=int,
+        default=TILE_SIZE,
+        help='Rows and columns of the tiles computed by the workers')
+    parser.add_argument(
+        '--compression',
+        dest='compression',
+        choices=['gzip', 'lzf', 'none'],
+        default=COMPRESSION,
+        help='HDF5 compression of the cube layers')
+    parser.add_argument(
+        '--compression-level',
+        dest='compression_level',
+        type=int,
+        default=COMPRESSION_LEVEL,
+        help='gzip compression level')
+    parser.add_argument(
+        '--no-shuffle',
+        dest='shuffle',
+        action='store_false',
+        help='Do not apply the HDF5 shuffle filter')
     parser.add_argument(
         '-nodata',
         '--nodata',
@@ -136,6 +197,8 @@ def loadProduct(xmlname):
     '''
     Load product using ISCE's product loader.
     '''
+    import isce
+    from iscesys.Component.ProductManager import ProductManager as PM
 
     pm = PM()
     pm.configure()
@@ -190,6 +253,8 @@ def getUTMZone(inps):
 
 
 def getMergedOrbit(product):
+    import isce
+    from isceobj.Orbit.Orbit import Orbit
 
     ###Create merged orbit
     orb = Orbit()
@@ -249,6 +314,9 @@ def generateSummary(inps):
     '''
     Add simple stats like swath range, height etc.
     '''
+    import isce
+    from isceobj.Planet.Planet import Planet
+
     refelp = Planet(pname='Earth').ellipsoid
 
     inps.orbit = getMergedOrbit(inps.masterSwaths)
@@ -274,6 +342,7 @@ def estimateGridPoints(inps):
     '''
     Estimate start and end.
     '''
+    import pyproj
 
     #pdb.set_trace()
     inps.proj4 = 'EPSG:{0}'.format(inps.epsg)
@@ -391,6 +460,7 @@ class Cube(object):
         self.slaverange = slaverange
         self.latvector = latvector
         self.lonvector = lonvector
+        self.kernel = GeocubeKernel.from_inps(inps)
 
     def nvector(self, llh):
         '''
@@ -409,6 +479,34 @@ class Cube(object):
         Set metadata array values for a row in the cube.
         '''
 
+        yval = self.inps.y1 - ii * self.inps.yspacing
+        self.latvector[ii] = yval
+
+        logger.info("Running ROW: " + str(ii + 1) + " of " + str(self.inps.Ny))
+
+        xvals = self.inps.x0 + np.arange(self.inps.Nx) * self.inps.xspacing
+        if ii == 0:
+            self.lonvector[:] = xvals
+
+        layers = self.kernel.compute(xvals, [yval], self.inps.heights)
+        self.set_layers(layers, np.s_[:, ii:ii + 1, :])
+
+    def set_layers(self, layers, window):
+        '''
+        Set the arrays in `window` to the layers computed by the kernel.
+        '''
+
+        set_layers({name: getattr(self, name)
+                    for name in REFERENCE_LAYERS + SECONDARY_LAYERS},
+                   layers, window)
+
+    def calc_row_reference(self, ii):
+        '''
+        Scalar implementation of `calc_row`, one point at a time with ISCE's
+        orbit, kept to validate the kernel (see geocube_benchmark.py).
+        '''
+        import pyproj
+
         yval = self.inps.y1 - ii * self.inps.yspacing
         #satutm = np.array( pyproj.transform( lla, utm, satllh[0], satllh[1], satllh[2]))
         self.latvector[ii] = yval
@@ -488,11 +586,214 @@ class Cube(object):
                                    satutm[0] - targutm[0]))
 
 
+def get_tiles(row_start, row_end, nx, tile_size=TILE_SIZE):
+    '''
+    (first row, end row, first column, end column) of the 2D tiles of the
+    rows `row_start` to `row_end` of the cube.
+    '''
+
+    return [(r0, min(r0 + tile_size, row_end), c0, min(c0 + tile_size, nx))
+            for r0 in range(row_start, row_end, tile_size)
+            for c0 in range(0, nx, tile_size)]
+
+
+def get_core_budget(cores=None):
+    '''
+    Cores the cube may use: `cores` if given, else OMP_NUM_THREADS (set by
+    the PGE for the whole job), at most the CPUs available to the process.
+    '''
+
+    available = len(os.sched_getaffinity(0))
+    if cores is None and os.environ.get('OMP_NUM_THREADS'):
+        cores = int(os.environ['OMP_NUM_THREADS'])
+    return max(1, min(cores or available, available))
+
+
+def get_band_rows(ny, nx, tile_size, workers):
+    '''
+    Rows of the bands of the cube computed between two writes, with enough
+    tiles to keep the workers busy. A band is also the chunk of the HDF5
+    datasets, so that each write fills whole chunks.
+    '''
+
+    tiles_per_row = -(-nx // tile_size)
+    tile_rows = max(1, -(-2 * workers // tiles_per_row))
+    return min(ny, tile_rows * tile_size)
+
+
+def set_layers(arrays, layers, window):
+    '''
+    Set `arrays` in `window` to the layers computed by the kernel where the
+    geometry could be solved; other points keep their values.
+    '''
+
+    for names, valid in [(REFERENCE_LAYERS, layers['valid']),
+                         (SECONDARY_LAYERS, layers['slave_valid'])]:
+        for name in names:
+            block = arrays[name][window]
+            block[valid] = layers[name][valid]
+            arrays[name][window] = block
+    if 'valid' in arrays:
+        arrays['valid'][window] = layers['valid']
+
+
+def compute_tile(kernel, arrays, grid, tile, band_start=0, reference=None):
+    '''
+    Compute all heights of a 2D tile of the cube into `arrays`, which hold
+    the rows of the cube from `band_start` on. If the cached reference-only
+    layers of the whole cube are given in `reference`, only the secondary
+    layers are computed.
+    '''
+
+    r0, r1, c0, c1 = tile
+    yvals = grid['y1'] - np.arange(r0, r1) * grid['yspacing']
+    xvals = grid['x0'] + np.arange(c0, c1) * grid['xspacing']
+    if reference is not None:
+        reference = {name: array[:, r0:r1, c0:c1]
+                     for name, array in reference.items()}
+    layers = kernel.compute(xvals, yvals, grid['heights'], reference)
+    set_layers(arrays, layers,
+               np.s_[:, r0 - band_start:r1 - band_start, c0:c1])
+    return tile
+
+
+# State of a worker process, set once when it starts
+_worker = {}
+
+
+def _init_worker(kernel, arrays, grid, reference):
+    _worker['kernel'] = kernel
+    _worker['arrays'] = arrays
+    _worker['grid'] = grid
+    _worker['reference'] = reference
+
+
+def _compute_tile(args):
+    tile, band_start = args
+    return compute_tile(_worker['kernel'], _worker['arrays'], _worker['grid'],
+                        tile, band_start, _worker['reference'])
+
+
+class SharedLayers(object):
+    '''
+    A band of the cube layers in shared memory, so that the tiles computed
+    by the worker processes are written in place.
+    '''
+
+    def __init__(self, shape, no_data=-9999):
+        from multiprocessing.shared_memory import SharedMemory
+
+        self.no_data = no_data
+        self.blocks = {}
+        self.arrays = {}
+        # `valid` marks where the reference geometry was solved
+        for name, dtype in list(LAYER_DTYPES.items()) + [('valid', bool)]:
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            block = SharedMemory(create=True, size=max(size, 1))
+            self.blocks[name] = block
+            self.arrays[name] = np.ndarray(shape, dtype=dtype,
+                                           buffer=block.buf)
+        self.reset()
+
+    def reset(self):
+        for name, array in self.arrays.items():
+            array[:] = self.no_data if name in NODATA_LAYERS else 0
+
+    def close(self):
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+
+
+def get_reference_key(kernel, grid, shape):
+    '''
+    Key of the reference-only layers of the cube in the geometry cache.
+    '''
+
+    return 'geocube-' + kernel.get_reference_key(grid, shape)
+
+
+def load_reference(cache, key, shape):
+    '''
+    Cached reference-only layers (CACHED_LAYERS) of the cube or None on a
+    miss.
+    '''
+    from tempfile import TemporaryDirectory
+
+    with TemporaryDirectory(prefix='geocube') as tmp_dir:
+        outputs = {name: os.path.join(tmp_dir, name + '.npy')
+                   for name in CACHED_LAYERS}
+        if cache.fetch(key, outputs) is None:
+            return None
+        reference = {name: np.load(path) for name, path in outputs.items()}
+    if any(array.shape != shape for array in reference.values()):
+        logger.warning('Discarding cached reference layers of another '
+                       'shape')
+        return None
+    return reference
+
+
+def store_reference(cache, key, reference):
+    '''
+    Add the reference-only layers (CACHED_LAYERS) of the cube to the
+    geometry cache.
+    '''
+    from tempfile import TemporaryDirectory
+
+    with TemporaryDirectory(prefix='geocube') as tmp_dir:
+        outputs = {}
+        for name in CACHED_LAYERS:
+            outputs[name] = os.path.join(tmp_dir, name + '.npy')
+            np.save(outputs[name], reference[name])
+        cache.store(key, outputs)
+
+
+def create_layer_datasets(cube, shape, chunks, no_data=-9999,
+                          compression=COMPRESSION,
+                          compression_level=COMPRESSION_LEVEL,
+                          shuffle=True):
+    '''
+    Create the chunked and compressed HDF5 datasets of the cube layers.
+    '''
+
+    if compression == 'none':
+        compression = None
+    options = {'chunks': chunks,
+               'compression': compression,
+               'shuffle': shuffle and compression is not None}
+    if compression == 'gzip':
+        options['compression_opts'] = compression_level
+    datasets = {}
+    for name, dataset in CUBE_DATASETS.items():
+        datasets[name] = cube.create_dataset(
+            dataset, shape=shape, dtype=LAYER_DTYPES[name],
+            fillvalue=no_data if name in NODATA_LAYERS else 0, **options)
+    return datasets
+
+
 @simple_time_tracker(_log)
-def processCube(inps, fid, no_data=-9999):
+def processCube(inps, fid, no_data=-9999, cores=None, tile_size=TILE_SIZE,
+                compression=COMPRESSION, compression_level=COMPRESSION_LEVEL,
+                shuffle=True):
     '''
     Start generating the cube.
+
+    The cube is computed in bands of rows split in 2D tiles. The tiles are
+    computed by a pool of `cores` worker processes (see `get_core_budget`),
+    which receive the orbits when they start and write the tiles to a
+    band in shared memory. Each band is then written to the chunked and
+    compressed HDF5 datasets of the layers.
+
+    The reference-only layers only depend on the reference orbit and the
+    grid. If the geometry cache is enabled (TOPO_CACHE_DIR), they are
+    cached so that the other pairs of the reference date only compute the
+    secondary layers.
     '''
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import get_context
+    from topsApp_utils.geometry_cache import GeometryCache
 
     logger.info('Output grid size: {0} x {1} x {2}'.format(
         len(inps.heights), inps.Ny, inps.Nx))
@@ -503,110 +804,91 @@ def processCube(inps, fid, no_data=-9999):
     cube.create_dataset('y0', data=inps.y0)
     cube.create_dataset('y1', data=inps.y1)
 
-    # create memmap directory
-    memmap_dir = "./joblib_memmap"
+    kernel = GeocubeKernel.from_inps(inps)
+    grid = {'x0': inps.x0,
+            'xspacing': inps.xspacing,
+            'y1': inps.y1,
+            'yspacing': inps.yspacing,
+            'heights': inps.heights}
+    n_tiles = len(get_tiles(0, inps.Ny, inps.Nx, tile_size))
+    workers = min(get_core_budget(cores), n_tiles)
+    band_rows = get_band_rows(inps.Ny, inps.Nx, tile_size, workers)
+    logger.info('{0} tiles on {1} workers, {2} rows per band'.format(
+        n_tiles, workers, band_rows))
+
+    shape = (len(inps.heights), inps.Ny, inps.Nx)
+    cache = GeometryCache.from_env()
+    reference = None
+    if cache is not None:
+        key = get_reference_key(kernel, grid, shape)
+        reference = load_reference(cache, key, shape)
+        if reference is not None:
+            logger.info('Using cached reference layers {0}'.format(key))
+        else:
+            logger.info('Reference layers {0} not cached'.format(key))
+    # Reference layers computed here are gathered for the cache
+    gathered = None
+    if cache is not None and reference is None:
+        gathered = {name: np.empty(shape, dtype=LAYER_DTYPES.get(name, bool))
+                    for name in CACHED_LAYERS}
+
+    # Packaging reads whole layers, so chunks span all columns
+    datasets = create_layer_datasets(
+        cube, shape, (1, band_rows, inps.Nx), no_data, compression,
+        compression_level, shuffle)
+
+    layers = SharedLayers((len(inps.heights), band_rows, inps.Nx), no_data)
+    executor = None
     try:
-        os.mkdir(memmap_dir)
-    except FileExistsError:
-        pass
-
-    # create output memmap for each metadata array and initialize
-    lookangle = np.memmap(
-        os.path.join(memmap_dir, "lookangle"),
-        shape=(len(inps.heights), inps.Ny, inps.Nx),
-        dtype=np.float32,
-        mode='w+')
-    lookangle[:] = no_data
-    incangle = np.memmap(
-        os.path.join(memmap_dir, "incangle"),
-        shape=(len(inps.heights), inps.Ny, inps.Nx),
-        dtype=np.float32,
-        mode='w+')
-    incangle[:] = no_data
-    azangle = np.memmap(
-        os.path.join(memmap_dir, "azangle"),
-        shape=(len(inps.heights), inps.Ny, inps.Nx),
-        dtype=np.float32,
-        mode='w+')
-    azangle[:] = no_data
-    azimuthtime = np.memmap(
-        os.path.join(memmap_dir, "azimuthtime"),
-        shape=(len(inps.heights), inps.Ny, inps.Nx),
-        dtype=np.float64,
-        mode='w+')
-    slantrange = np.memmap(
-        os.path.join(memmap_dir, "slantrange"),
-        shape=(len(inps.heights), inps.Ny, inps.Nx),
-        dtype=np.float64,
-        mode='w+')
-    slantrange[:] = no_data
-    bpar = np.memmap(
-        os.path.join(memmap_dir, "bpar"),
-        shape=(len(inps.heights), inps.Ny, inps.Nx),
-        dtype=np.float32,
-        mode='w+')
-    bpar[:] = no_data
-    bperp = np.memmap(
-        os.path.join(memmap_dir, "bperp"),
-        shape=(len(inps.heights), inps.Ny, inps.Nx),
-        dtype=np.float32,
-        mode='w+')
-    bperp[:] = no_data
-    slavetime = np.memmap(
-        os.path.join(memmap_dir, "slavetime"),
-        shape=(len(inps.heights), inps.Ny, inps.Nx),
-        dtype=np.float64,
-        mode='w+')
-    slaverange = np.memmap(
-        os.path.join(memmap_dir, "slaverange"),
-        shape=(len(inps.heights), inps.Ny, inps.Nx),
-        dtype=np.float64,
-        mode='w+')
-    latvector = np.memmap(
-        os.path.join(memmap_dir, "latvector"),
-        shape=(inps.Ny,),
-        dtype=np.float64,
-        mode='w+')
-    lonvector = np.memmap(
-        os.path.join(memmap_dir, "lonvector"),
-        shape=(inps.Nx,),
-        dtype=np.float64,
-        mode='w+')
-
-    # calculate geocube metadata in parallel
-    md_cube = Cube(inps, lookangle, incangle, azangle, azimuthtime, slantrange,
-                   bpar, bperp, slavetime, slaverange, latvector, lonvector)
-    Parallel(
-        n_jobs=-1,
-        max_nbytes=1e6)(delayed(md_cube.calc_row)(ii) for ii in range(inps.Ny))
-
-    # dump metadata arrays
-    cube.create_dataset('bparallel', data=md_cube.bpar)
-    cube.create_dataset('bperp', data=md_cube.bperp)
-    cube.create_dataset('lookangle', data=md_cube.lookangle)
-    cube.create_dataset('incangle', data=md_cube.incangle)
-    cube.create_dataset('azangle', data=md_cube.azangle)
-    cube.create_dataset('secondsofday', data=md_cube.azimuthtime)
-    cube.create_dataset('slantrange', data=md_cube.slantrange)
-    cube.create_dataset('slavetime', data=md_cube.slavetime)
-    cube.create_dataset('slaverange', data=md_cube.slaverange)
+        if workers > 1:
+            # Forked workers inherit the kernel and the shared arrays
+            executor = ProcessPoolExecutor(max_workers=workers,
+                                           mp_context=get_context('fork'),
+                                           initializer=_init_worker,
+                                           initargs=(kernel, layers.arrays,
+                                                     grid, reference))
+        for band_start in range(0, inps.Ny, band_rows):
+            band_end = min(band_start + band_rows, inps.Ny)
+            tiles = get_tiles(band_start, band_end, inps.Nx, tile_size)
+            layers.reset()
+            if executor is not None:
+                for _ in executor.map(_compute_tile,
+                                      [(tile, band_start) for tile in tiles]):
+                    pass
+            else:
+                for tile in tiles:
+                    compute_tile(kernel, layers.arrays, grid, tile,
+                                 band_start, reference)
+            rows = band_end - band_start
+            for name, dataset in datasets.items():
+                dataset[:, band_start:band_end, :] = \
+                    layers.arrays[name][:, :rows, :]
+            if gathered is not None:
+                for name, array in gathered.items():
+                    array[:, band_start:band_end, :] = \
+                        layers.arrays[name][:, :rows, :]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        layers.close()
+    if gathered is not None:
+        store_reference(cache, key, gathered)
+
     cube.create_dataset('yspacing', data=inps.yspacing)
     cube.create_dataset('xspacing', data=inps.xspacing)
     cube.create_dataset('heights', data=inps.heights)
-    cube.create_dataset('lons', data=md_cube.lonvector)
-    cube.create_dataset('lats', data=md_cube.latvector)
-    cube.create_dataset('nodata', data=np.float(no_data))
-
-    try:
-        shutil.rmtree(memmap_dir)
-    except:
-        pass
+    cube.create_dataset('lons',
+                        data=inps.x0 + np.arange(inps.Nx) * inps.xspacing)
+    cube.create_dataset('lats',
+                        data=inps.y1 - np.arange(inps.Ny) * inps.yspacing)
+    cube.create_dataset('nodata', data=float(no_data))
 
 
 if __name__ == '__main__':
     '''
     Main driver.
     '''
+    logging.basicConfig(format=log_format, level=logging.INFO)
 
     #Command line parser
     inps = cmdLineParse()
@@ -626,6 +908,7 @@ if __name__ == '__main__':
         raise Exception('Output file already exists')
 
     ###Create h5 file
+    import h5py
     fid = h5py.File(inps.outh5)
 
     ###Record inputs
@@ -635,7 +918,10 @@ if __name__ == '__main__':
     writeSummary(inps, fid)
 
     ####Generate cube
-    processCube(inps, fid, no_data=inps.nodata)
+    processCube(inps, fid, no_data=inps.nodata, cores=inps.cores,
+                tile_size=inps.tile_size, compression=inps.compression,
+                compression_level=inps.compression_level,
+                shuffle=inps.shuffle)
 
     ####Close file
     fid.close()
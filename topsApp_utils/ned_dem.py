@@ -11,12 +11,9 @@ import os, sys, math, json, logging, argparse, zipfile
 from subprocess import check_call, CalledProcessError
 from itertools import chain
 from string import Template
-import isce
-import isceobj
 
 
 log_format = "[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s"
-logging.basicConfig(format=log_format, level=logging.INFO)
 logger = logging.getLogger('ned_dem')
 
 
@@ -192,6 +189,9 @@ def download(url_list, username, password):
             sys.exit(1)
     else:
         command = 'curl -k -f -u ' + username + ':' + password + ' -O '
+    # Shared with the other jobs of the node if configured
+    from topsApp_utils.dem_tile_cache import TileCache
+    cache = TileCache.from_env()
     dem_files = []
     for url in url_list:
         dem_file = os.path.basename(url)
@@ -199,6 +199,10 @@ def download(url_list, username, password):
             dem_files.append(dem_file)
             continue
         try:
+            if cache is not None:
+                cache.copy_to(url, dem_file, username, password)
+                dem_files.append(dem_file)
+                continue
             logger.info(command + url)
             if os.system(command + url): raise Exception
             dem_files.append(dem_file)
@@ -298,6 +302,7 @@ def main(url_base, username, password, action, bbox, downsample):
 
 
 if __name__ == '__main__':
+    logging.basicConfig(format=log_format, level=logging.INFO)
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("url_base", help="NED DEM url base")
     parser.add_argument("-a", "--action", dest="action", help="action to perform",
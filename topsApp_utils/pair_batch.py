@@ -0,0 +1,161 @@
+"""
+Planning of a batch of interferograms of the same track and frame.
+
+In an interferogram network each acquisition appears in several pairs. A
+batch job receives the ifg-cfgs of such a network in the `input_metadata`
+list of its context; each SLC zip and orbit is localized once into the
+batch directory and each pair is processed in its own directory with the
+same single-pair PGE, linking the shared inputs instead of copying them.
+Pairs are ordered by reference acquisition so that pairs sharing the
+reference geometry run one after the other.
+"""
+import os
+import json
+import copy
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger('pair_batch')
+
+PAIRS_DIR = 'pairs'
+
+# ifg-cfg keys that must agree for all pairs of a batch
+COMMON_KEYS = ['track_number', 'direction', 'dem_type']
+
+
+def get_acquisition_key(zip_files: list) -> tuple:
+    return tuple(sorted(os.path.basename(f) for f in zip_files))
+
+
+def check_common_track(cfgs: list):
+    """Ensure the ifg-cfgs of the batch share the track and frame."""
+    if not cfgs:
+        raise RuntimeError('No ifg-cfgs in batch')
+    for key in COMMON_KEYS:
+        values = {str(cfg.get(key)) for cfg in cfgs}
+        if len(values) > 1:
+            raise RuntimeError(f'ifg-cfgs of a batch must share {key}; '
+                               f'found {", ".join(sorted(values))}')
+    ids = [cfg['id'] for cfg in cfgs]
+    duplicates = {i for i in ids if ids.count(i) > 1}
+    if duplicates:
+        raise RuntimeError(f'Duplicate ifg-cfgs in batch: '
+                           f'{", ".join(sorted(duplicates))}')
+
+
+def get_acquisitions(cfgs: list) -> OrderedDict:
+    """
+    Returns
+    -------
+    OrderedDict
+        For each acquisition (sorted zip file names), its zip files, orbit
+        file, sensing date and the ids of the pairs using it; ordered by
+        date
+    """
+    acquisitions = {}
+    for cfg in cfgs:
+        for role in ('master', 'slave'):
+            zip_files = cfg[f'{role}_zip_file']
+            key = get_acquisition_key(zip_files)
+            acq = acquisitions.setdefault(key, {
+                'zip_files': sorted(zip_files),
+                'orbit_file': cfg[f'{role}_orbit_file'],
+                'date': cfg[f'slc_{role}_dt'],
+                'pairs': []})
+            if acq['orbit_file'] != cfg[f'{role}_orbit_file']:
+                raise RuntimeError(f'Pairs of batch use different orbits for '
+                                   f'{", ".join(key)}')
+            acq['pairs'].append(cfg['id'])
+    return OrderedDict(sorted(acquisitions.items(),
+                              key=lambda item: item[1]['date']))
+
+
+def order_pairs(cfgs: list) -> list:
+    """Order the ifg-cfgs by reference and then by secondary date."""
+    return sorted(cfgs, key=lambda cfg: (cfg['slc_master_dt'],
+                                         get_acquisition_key(
+                                             cfg['master_zip_file']),
+                                         cfg['slc_slave_dt']))
+
+
+def get_pair_dir(cfg: dict, pairs_dir: str = PAIRS_DIR) -> str:
+    return os.path.join(pairs_dir, cfg['id'])
+
+
+def get_pair_inputs(cfg: dict) -> list:
+    """Files of the batch directory processed by the pair."""
+    return (list(cfg['master_zip_file']) +
+            list(cfg['slave_zip_file']) +
+            [cfg['master_orbit_file'], cfg['slave_orbit_file']])
+
+
+def check_localized(cfgs: list, batch_dir: str = '.'):
+    missing = sorted({f for cfg in cfgs for f in get_pair_inputs(cfg)
+                      if not os.path.exists(os.path.join(batch_dir, f))})
+    if missing:
+        raise RuntimeError(f'Inputs not localized: {", ".join(missing)}')
+
+
+def link_file(src: str, dst: str):
+    """Symlink `src` to `dst` replacing an earlier link."""
+    if os.path.islink(dst):
+        os.unlink(dst)
+    os.symlink(os.path.abspath(src), dst)
+
+
+def make_pair_context(batch_ctx: dict, cfg: dict, shared: dict) -> dict:
+    """
+    Context of a single-pair job for one ifg-cfg of the batch.
+
+    `shared` holds the context keys pointing to data prepared once for the
+    batch, e.g. `aux_cal_dir`.
+    """
+    ctx = copy.deepcopy(batch_ctx)
+    ctx['input_metadata'] = [cfg]
+    ctx['localize_urls'] = cfg.get('localize_urls', [])
+    ctx.update(shared)
+    return ctx
+
+
+def setup_pair_dir(batch_ctx: dict,
+                   cfg: dict,
+                   shared: dict,
+                   batch_dir: str = '.',
+                   pairs_dir: str = PAIRS_DIR) -> str:
+    """
+    Create the work directory of a pair with links to the localized inputs
+    of the batch and its `_context.json`.
+    """
+    pair_dir = get_pair_dir(cfg, os.path.join(batch_dir, pairs_dir))
+    os.makedirs(pair_dir, exist_ok=True)
+    for file_name in get_pair_inputs(cfg):
+        link_file(os.path.join(batch_dir, file_name),
+                  os.path.join(pair_dir, file_name))
+
+    # Used by the error handling of the PGE
+    job_file = os.path.join(batch_dir, '_job.json')
+    if os.path.exists(job_file):
+        link_file(job_file, os.path.join(pair_dir, '_job.json'))
+
+    with open(os.path.join(pair_dir, '_context.json'), 'w') as f:
+        json.dump(make_pair_context(batch_ctx, cfg, shared), f,
+                  sort_keys=True, indent=2)
+    return pair_dir
+
+
+def get_product_dirs(pair_dir: str) -> list:
+    """Directories of the datasets created in `pair_dir`."""
+    product_dirs = []
+    for name in sorted(os.listdir(pair_dir)):
+        path = os.path.join(pair_dir, name)
+        if os.path.isfile(os.path.join(path, f'{name}.dataset.json')):
+            product_dirs.append(path)
+    return product_dirs
+
+
+def log_plan(cfgs: list, acquisitions: OrderedDict):
+    logger.info(f'Batch of {len(cfgs)} pairs from {len(acquisitions)} '
+                'acquisitions')
+    for key, acq in acquisitions.items():
+        logger.info(f'{acq["date"]}: {len(acq["pairs"])} pairs, '
+                    f'{", ".join(key)}')
@@ -0,0 +1,111 @@
+"""
+Block-wise water and connected component masking of the geocoded
+unwrapped interferogram.
+
+Row windows of the inputs are streamed through the masking logic and the
+masked product is written sequentially, so the memory footprint is bounded
+by the block size instead of the size of the product.
+"""
+import logging
+import numpy as np
+from osgeo import gdal
+
+logger = logging.getLogger('product_masking')
+
+# Approximate memory of one block of the unwrapped product
+BLOCK_BYTES = 64 * 1024 ** 2
+
+# Value of masked pixels in the phase band
+PHASE_NODATA = -10
+
+
+def get_block_rows(n_cols: int,
+                   n_bands: int,
+                   dtype,
+                   block_bytes: int = BLOCK_BYTES) -> int:
+    row_bytes = n_cols * n_bands * np.dtype(dtype).itemsize
+    return max(1, block_bytes // row_bytes)
+
+
+def mask_product_blocks(unw_file: str,
+                        unw_dtype,
+                        flat_file: str,
+                        flat_dtype,
+                        wmask_file: str,
+                        wmask_dtype,
+                        cc_vrt: str,
+                        shape: tuple,
+                        out_file: str,
+                        block_rows: int = None) -> str:
+    """
+    Parameters
+    ----------
+    unw_file : str
+        Band interleaved by line unwrapped product (amplitude, phase)
+    unw_dtype :
+        Data type of `unw_file`
+    flat_file : str
+        Single band complex wrapped interferogram on the same grid
+    flat_dtype :
+        Data type of `flat_file`
+    wmask_file : str
+        Single band water mask cropped to the same grid (-1 is water)
+    wmask_dtype :
+        Data type of `wmask_file`
+    cc_vrt : str
+        GDAL readable connected components on the same grid (0 is
+        unconnected)
+    shape : tuple
+        (lines, bands, samples) of `unw_file`
+    out_file : str
+        Masked product with the wrapped phase in band 2. Water, unconnected
+        components and zero phase are set to 0 in all bands and -10 in the
+        phase band.
+    block_rows : int
+        Number of lines per block. Defaults to blocks of about `BLOCK_BYTES`
+
+    Returns
+    -------
+    str
+        `out_file`
+    """
+    n_rows, n_bands, n_cols = shape
+    if block_rows is None:
+        block_rows = get_block_rows(n_cols, n_bands, unw_dtype)
+    logger.info(f'Masking {shape} product in blocks of {block_rows} lines')
+
+    unw = np.memmap(unw_file, dtype=unw_dtype, mode='r', shape=shape)
+    flat = np.memmap(flat_file, dtype=flat_dtype, mode='r',
+                     shape=(n_rows, n_cols))
+    wmask = np.memmap(wmask_file, dtype=wmask_dtype, mode='r',
+                      shape=(n_rows, n_cols))
+    cc = gdal.Open(cc_vrt)
+    cc_band = cc.GetRasterBand(1)
+
+    with open(out_file, 'wb') as f:
+        for row_start in range(0, n_rows, block_rows):
+            row_end = min(row_start + block_rows, n_rows)
+            n_block = row_end - row_start
+
+            water = wmask[row_start:row_end] == -1
+            unconnected = cc_band.ReadAsArray(0, row_start,
+                                              n_cols, n_block) == 0
+
+            # wrapped phase
+            phase = np.angle(flat[row_start:row_end])
+            phase[phase == 0] = PHASE_NODATA
+            phase[water] = PHASE_NODATA
+            phase[unconnected] = PHASE_NODATA
+
+            block = np.array(unw[row_start:row_end])
+            for i in range(n_bands):
+                band = block[:, i, :]
+                band[water] = 0
+                band[unconnected] = 0
+
+            # overwrite displacement with phase
+            block[:, 1, :] = phase
+            f.write(block.tobytes())
+
+    cc = None
+    return out_file
@@ -1,81 +1,141 @@
+"""
+Envelope of the geolocation grid points of Sentinel-1 SLCs.
+
+The annotation xmls are streamed with iterparse, straight from the SLC zips
+or from SAFE directories, keeping only the running min/max of the
+longitudes and latitudes of their `geolocationGridPoint`s. Only the co-pol
+(VV or HH) annotations are read: the cross-pol annotation of a swath has the
+same geolocation grid. If the annotation index of an SLC was built (see
+annotation_index.py), its geolocation grids are used instead.
+"""
+import re
+import logging
+import zipfile
 import xml.etree.ElementTree as ET
 from pathlib import Path
-import pandas as pd
-from xml.etree.ElementTree import Element
 
+logger = logging.getLogger('sent1_bbox')
+
+CO_POLS = ('vv', 'hh')
+GRID_POINT_TAG = 'geolocationGridPoint'
+
+# e.g. s1a-iw1-slc-vv-20200101t000000-...-001.xml
+ANNOTATION_RE = re.compile(r's1\w-iw\d-slc-(?P<pol>\w\w)-[\w\-]*\.xml$')
+
+
+def is_co_pol(xml_file_name: str) -> bool:
+    """True if `xml_file_name` is the annotation xml of a co-pol swath."""
+    match = ANNOTATION_RE.match(xml_file_name.split('/')[-1])
+    return match is not None and match.group('pol') in CO_POLS
+
+
+def new_envelope() -> dict:
+    return {'xmin': float('inf'),
+            'xmax': float('-inf'),
+            'ymin': float('inf'),
+            'ymax': float('-inf')}
 
-def get_one_geogrid(geo_grid_element: Element) -> dict:
-    """Get dictionary of GCP metadata from Sentinel-1 xml metadata
+
+def update_envelope(envelope: dict, xml_file) -> dict:
+    """
+    Extend `envelope` with the geolocation grid points of an annotation xml.
 
     Parameters
     ----------
-    geo_grid_element : Element
-        Element from xml files within:
-         './geolocationGrid/
-         'geolocationGridPointList/'
-         'geolocationGridPoint'
+    envelope : dict
+        Running envelope (see `new_envelope`), updated in place
+    xml_file : str or file object
+        Annotation xml
 
     Returns
     -------
     dict
-       Dictionary ontaining all metadata in GCP. The keys are:
-
-       'azimuthTime', 'slantRangeTime', 'line', 'pixel', 'latitude',
-       'longitude', 'height', 'incidenceAngle', 'elevationAngle'
+        The updated envelope
     """
-    data = {child.tag: child.text
-            for child in list(geo_grid_element)}
-    return data
+    depth = 0
+    root = None
+    for event, elem in ET.iterparse(xml_file, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if elem.tag == GRID_POINT_TAG:
+            lon = float(elem.findtext('longitude'))
+            lat = float(elem.findtext('latitude'))
+            envelope['xmin'] = min(envelope['xmin'], lon)
+            envelope['xmax'] = max(envelope['xmax'], lon)
+            envelope['ymin'] = min(envelope['ymin'], lat)
+            envelope['ymax'] = max(envelope['ymax'], lat)
+            elem.clear()
+        elif depth == 1:
+            # Sections of the annotation are dropped once parsed
+            root.remove(elem)
+    return envelope
 
 
-def get_data_from_one_xml(xml_file_name: str) -> pd.DataFrame:
+def update_envelope_from_zip(envelope: dict, zip_path: str) -> dict:
+    """Extend `envelope` with the co-pol annotation xmls of an SLC zip."""
+    from topsApp_utils.slc_annotations import get_annotation_members
+
+    with zipfile.ZipFile(zip_path, 'r') as zip_obj:
+        for member in get_annotation_members(zip_obj):
+            if is_co_pol(member):
+                logger.info(f'Reading {member} from {zip_path}')
+                with zip_obj.open(member) as xml_file:
+                    update_envelope(envelope, xml_file)
+    return envelope
+
+
+def update_envelope_from_index(envelope: dict, index) -> dict:
+    """Extend `envelope` with the co-pol records of an annotation index."""
+    for member, record in index.find().items():
+        if is_co_pol(member):
+            grid = record['geolocation_grid']
+            envelope['xmin'] = min([envelope['xmin']] + grid['longitude'])
+            envelope['xmax'] = max([envelope['xmax']] + grid['longitude'])
+            envelope['ymin'] = min([envelope['ymin']] + grid['latitude'])
+            envelope['ymax'] = max([envelope['ymax']] + grid['latitude'])
+    return envelope
+
+
+def update_envelope_from_safe(envelope: dict, safe_dir: str) -> dict:
+    """Extend `envelope` with the co-pol annotation xmls of a SAFE."""
+    for xml_file in sorted(Path(safe_dir).glob('annotation/s1*-iw*.xml')):
+        if is_co_pol(xml_file.name):
+            update_envelope(envelope, str(xml_file))
+    return envelope
+
+
+def get_envelope_from_all_slcs(slc_paths: list = None) -> dict:
     """
     Parameters
     ----------
-    xml_file_name : str
-        The relative path to the xml file in the annotation directory of the
-        sentinel-1 data.
+    slc_paths : list
+        SLC zip files or SAFE directories. If not specified, the SAFE
+        directories in the current work directory are used.
 
     Returns
     -------
-    pd.DataFrame
-        Obtain all GCP from relevant XML file and turn into dataframe.
-
-        The columns are:
-
-        'azimuthTime', 'slantRangeTime', 'line', 'pixel', 'latitude',
-        'longitude', 'height', 'incidenceAngle', 'elevationAngle'
-    """
-    tree = ET.parse(xml_file_name)
-    root = tree.getroot()
-    geo_grid_list = root.findall('./geolocationGrid/'
-                                 'geolocationGridPointList/'
-                                 'geolocationGridPoint')
-    data = list(map(get_one_geogrid, geo_grid_list))
-    df = pd.DataFrame(data)
-    df['latitude'] = pd.to_numeric(df['latitude'])
-    df['longitude'] = pd.to_numeric(df['longitude'])
-    return df
-
-
-def get_data_from_one_slc(slc_directory: str) -> pd.DataFrame:
-    """
-    Get concantenated dataframe of all GCPs within SLC for various
-    polarizations and swaths within slc file.
+    dict
+        'xmin', 'xmax', 'ymin' and 'ymax' of the geolocation grid points
     """
-    xml_files = list(Path(slc_directory).glob('annotation/s1*-iw*.xml'))
-    dfs = list(map(get_data_from_one_xml, xml_files))
-    df_slc = pd.concat(dfs, axis=0)
-    return df_slc
-
-
-def get_envelope_from_all_slcs() -> dict:
-    # Assume the data is in the current work directory
-    safe_dirs = list(Path('.').glob('S1*_IW_SLC*.SAFE/'))
-    dfs = list(map(get_data_from_one_slc, safe_dirs))
-    df_all_slcs = pd.concat(dfs, axis=0)
-    envelope = {'xmin': df_all_slcs.longitude.min(),
-                'xmax': df_all_slcs.longitude.max(),
-                'ymin': df_all_slcs.latitude.min(),
-                'ymax': df_all_slcs.latitude.max()}
+    from topsApp_utils.annotation_index import load_index
+
+    if slc_paths is None:
+        # Assume the data is in the current work directory
+        slc_paths = sorted(Path('.').glob('S1*_IW_SLC*.SAFE/'))
+    envelope = new_envelope()
+    for slc_path in map(str, slc_paths):
+        index = load_index(slc_path)
+        if index is not None:
+            update_envelope_from_index(envelope, index)
+        elif zipfile.is_zipfile(slc_path):
+            update_envelope_from_zip(envelope, slc_path)
+        else:
+            update_envelope_from_safe(envelope, slc_path)
+    if envelope['xmin'] > envelope['xmax']:
+        raise ValueError('No geolocation grid points in the co-pol '
+                         'annotations of the SLCs')
     return envelope
@@ -0,0 +1,97 @@
+"""
+Access to the annotation xmls of Sentinel-1 SLC zip files.
+
+The annotation xmls are read and parsed directly from the zip files, e.g.
+by annotation_index.py, which builds the indexes of several zips in a
+thread pool. Extracting them into the work directory is kept as an opt-in
+compatibility mode for consumers that need the files on disk.
+"""
+import re
+import logging
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('slc_annotations')
+
+# Only want xmls that match this regular expression
+# (within annotation file)
+ANNOTATION_RE = re.compile(r'S1\w*.SAFE/annotation/s1[\w\-]*.xml')
+
+
+def get_annotation_members(zip_obj: zipfile.ZipFile,
+                           pol: str = None) -> list:
+    """
+    Parameters
+    ----------
+    zip_obj : zipfile.ZipFile
+        Opened SLC zip file
+    pol : str
+        If specified, only the annotation xmls of this polarization (e.g.
+        'vv') are returned.
+
+    Returns
+    -------
+    list
+        Names of the annotation xmls within the zip file
+    """
+    members = [zip_info.filename for zip_info in zip_obj.filelist
+               if ANNOTATION_RE.match(zip_info.filename)]
+    if pol is not None:
+        members = [member for member in members
+                   if f'-{pol.lower()}-' in member.split('/')[-1]]
+    return members
+
+
+def read_annotation_xmls_from_zip(zip_path: str, pol: str = None) -> dict:
+    """
+    Returns
+    -------
+    dict
+        Content of each annotation xml keyed by its name within the zip file,
+        e.g. 'S1A_..._1234.SAFE/annotation/s1a-iw1-....xml'
+    """
+    xmls = {}
+    with zipfile.ZipFile(zip_path, 'r') as zip_obj:
+        for member in get_annotation_members(zip_obj, pol=pol):
+            logger.info(f'Reading {member} from {zip_path}')
+            xmls[member] = zip_obj.read(member)
+    return xmls
+
+
+def read_annotations_from_zip(zip_path: str, pol: str = None) -> dict:
+    """
+    Returns
+    -------
+    dict
+        Root element of each parsed annotation xml keyed by its name within
+        the zip file (see `read_annotation_xmls_from_zip`)
+    """
+    xmls = read_annotation_xmls_from_zip(zip_path, pol=pol)
+    return {member: ET.fromstring(content)
+            for member, content in xmls.items()}
+
+
+def extract_annotations_from_zip(zip_path: str) -> list:
+    with zipfile.ZipFile(zip_path, 'r') as zip_obj:
+        members = get_annotation_members(zip_obj)
+        for member in members:
+            zip_obj.extract(member)
+            logger.info(f'Unzipping {member}')
+    return members
+
+
+def extract_annotations(zip_paths: list, max_workers: int = None) -> list:
+    """
+    Compatibility mode: extract the annotation xmls of all zip files into
+    the current working directory.
+
+    Returns
+    -------
+    list
+        Relative paths of the extracted xmls
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(extract_annotations_from_zip, zip_paths)
+        return [member for members in results for member in members]
+
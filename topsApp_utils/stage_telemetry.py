@@ -0,0 +1,263 @@
+"""
+Per-stage performance telemetry for the PGE.
+
+For each stage the wall time, CPU time (this process and its waited-for
+children, e.g. topsApp.py), peak resident memory of the process tree,
+bytes read and written and the size of the work directory are recorded.
+
+Memory is sampled by a background thread. The size of the work directory
+is tracked incrementally at the stage boundaries: only the directories
+whose mtime changed since the previous update, i.e. those the stage wrote
+to, are listed again (see `ScratchDiskUsage`). Stages running concurrently
+share the process-wide counters, so their CPU time and I/O overlap.
+"""
+import os
+import json
+import time
+import logging
+import resource
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger('stage_telemetry')
+
+SIDECAR_FILE = '_performance.json'
+SAMPLE_INTERVAL = 1.
+
+
+def get_cpu_seconds() -> float:
+    """User and system time of this process and its waited-for children."""
+    total = 0.
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def get_io_bytes() -> dict:
+    """
+    Bytes read from and written to storage by this process and its
+    waited-for children (Linux only; zeros elsewhere).
+    """
+    io = {'read_bytes': 0, 'write_bytes': 0}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                if key in io:
+                    io[key] = int(value)
+    except OSError:
+        pass
+    return io
+
+
+def _get_children(pid: int) -> list:
+    children = []
+    try:
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children') as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def _get_rss_bytes(pid: int) -> int:
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def get_tree_rss_bytes(pid: int = None) -> int:
+    """Resident memory of a process and all its descendants."""
+    pids = [pid or os.getpid()]
+    total = 0
+    while pids:
+        pid = pids.pop()
+        total += _get_rss_bytes(pid)
+        pids.extend(_get_children(pid))
+    return total
+
+
+class ScratchDiskUsage(object):
+    """
+    Bytes of the files under a directory, updated incrementally.
+
+    The size of the files directly in each directory is cached with the
+    mtime of the directory. An update only stats the directories and lists
+    again those whose mtime changed, i.e. where files were created, removed
+    or renamed. Symlinks (e.g. to shared inputs and caches) are not
+    counted.
+    """
+
+    def __init__(self, path: str = '.'):
+        self.path = os.path.abspath(path)
+        # directory -> (mtime_ns, bytes of its files, its subdirectories)
+        self._dirs = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _scan(path: str) -> tuple:
+        file_bytes = 0
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    file_bytes += entry.stat(follow_symlinks=False).st_size
+        return file_bytes, subdirs
+
+    def update(self) -> int:
+        """Current size in bytes."""
+        with self._lock:
+            dirs = {}
+            total = 0
+            stack = [self.path]
+            while stack:
+                path = stack.pop()
+                try:
+                    mtime_ns = os.stat(path).st_mtime_ns
+                    cached = self._dirs.get(path)
+                    if cached is None or cached[0] != mtime_ns:
+                        cached = (mtime_ns,) + self._scan(path)
+                except OSError:
+                    # Removed while being scanned
+                    continue
+                dirs[path] = cached
+                total += cached[1]
+                stack.extend(cached[2])
+            self._dirs = dirs
+            return total
+
+
+class StageTelemetry(object):
+    """
+    Collects performance metrics of named stages.
+
+    The scratch disk usage is the size of the work directory, updated when
+    a stage starts or ends; its high-water mark is taken over these
+    updates.
+    """
+
+    def __init__(self,
+                 work_dir: str = '.',
+                 sidecar_file: str = SIDECAR_FILE,
+                 sample_interval: float = SAMPLE_INTERVAL):
+        # Stages may change the work directory
+        self.work_dir = os.path.abspath(work_dir)
+        self.sidecar_file = os.path.abspath(sidecar_file)
+        self.sample_interval = sample_interval
+        self.stages = []
+        self._active = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._start_time = time.time()
+        self._start_cpu = get_cpu_seconds()
+        self.disk_usage = ScratchDiskUsage(self.work_dir)
+        # Only the inputs are in the work directory at this point
+        self.disk_bytes = self.disk_usage.update()
+        self.disk_high_water_bytes = self.disk_bytes
+        self.rss_high_water_bytes = get_tree_rss_bytes()
+
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop,
+                                         name='stage_telemetry',
+                                         daemon=True)
+        self._sampler.start()
+
+    def update_disk_bytes(self) -> int:
+        """Update the size of the work directory and its high-water mark."""
+        disk = self.disk_usage.update()
+        with self._lock:
+            self.disk_bytes = disk
+            self.disk_high_water_bytes = max(self.disk_high_water_bytes, disk)
+            for record in self._active.values():
+                record['scratch_disk_high_water_bytes'] = max(
+                    record['scratch_disk_high_water_bytes'], disk)
+        return disk
+
+    def _sample(self):
+        rss = get_tree_rss_bytes()
+        with self._lock:
+            self.rss_high_water_bytes = max(self.rss_high_water_bytes, rss)
+            for record in self._active.values():
+                record['peak_rss_bytes'] = max(record['peak_rss_bytes'], rss)
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.sample_interval):
+            try:
+                self._sample()
+            except Exception as err:
+                logger.warning(f'Telemetry sampling failed: {err}')
+
+    @contextmanager
+    def measure(self, name: str):
+        """Record the performance metrics of the enclosed block as `name`."""
+        io_start = get_io_bytes()
+        cpu_start = get_cpu_seconds()
+        wall_start = time.time()
+        record = {'name': name,
+                  'peak_rss_bytes': 0,
+                  'scratch_disk_high_water_bytes': 0}
+        key = (name, threading.get_ident())
+        with self._lock:
+            self._active[key] = record
+        self._sample()
+        disk_start = self.update_disk_bytes()
+        status = 'failed'
+        try:
+            yield record
+            status = 'done'
+        finally:
+            self._sample()
+            disk_end = self.update_disk_bytes()
+            io_end = get_io_bytes()
+            with self._lock:
+                del self._active[key]
+                record['status'] = status
+                record['wall_seconds'] = round(time.time() - wall_start, 3)
+                record['cpu_seconds'] = round(get_cpu_seconds() - cpu_start,
+                                              3)
+                record['read_bytes'] = (io_end['read_bytes'] -
+                                        io_start['read_bytes'])
+                record['write_bytes'] = (io_end['write_bytes'] -
+                                         io_start['write_bytes'])
+                record['scratch_disk_bytes'] = disk_end
+                record['scratch_disk_growth_bytes'] = disk_end - disk_start
+                self.stages.append(record)
+            logger.info(f'Stage {name} performance: {record}')
+            self.write_sidecar()
+
+    def summary(self) -> dict:
+        """Performance block for the met json."""
+        self._sample()
+        self.update_disk_bytes()
+        with self._lock:
+            return {
+                'wall_seconds': round(time.time() - self._start_time, 3),
+                'cpu_seconds': round(get_cpu_seconds() - self._start_cpu, 3),
+                'peak_rss_bytes': self.rss_high_water_bytes,
+                'scratch_disk_high_water_bytes': self.disk_high_water_bytes,
+                'scratch_disk_bytes': self.disk_bytes,
+                'stages': list(self.stages),
+            }
+
+    def write_sidecar(self, path: str = None) -> str:
+        """Write the summary atomically; stages may finish concurrently."""
+        path = path or self.sidecar_file
+        tmp_file = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with self._write_lock:
+            with open(tmp_file, 'w') as f:
+                json.dump(self.summary(), f, indent=2)
+            os.replace(tmp_file, path)
+        return path
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
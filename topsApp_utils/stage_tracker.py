@@ -0,0 +1,269 @@
+"""
+Stage-level checkpointing for the PGE.
+
+Each stage of `create_standard_product_s1.main()` records a completion
+marker together with a fingerprint of its inputs in a small json file in
+the work directory. When a failed job is retried in the same directory,
+every stage whose inputs are unchanged is skipped and processing restarts
+at the first incomplete stage. topsApp stages additionally restart at the
+first topsApp step without a pickle in `PICKLE/`.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from contextlib import nullcontext
+from datetime import datetime
+
+logger = logging.getLogger('stage_tracker')
+
+STATE_FILE = '_stages.json'
+TOPSAPP_PICKLE_DIR = 'PICKLE'
+
+# Order of the topsApp.py steps (see `TopsInSAR._steps` in ISCE2)
+TOPSAPP_STEPS = ['startup',
+                 'preprocess',
+                 'computeBaselines',
+                 'verifyDEM',
+                 'topo',
+                 'subsetoverlaps',
+                 'coarseoffsets',
+                 'coarseresamp',
+                 'overlapifg',
+                 'prepesd',
+                 'esd',
+                 'rangecoreg',
+                 'fineoffsets',
+                 'fineresamp',
+                 'ion',
+                 'burstifg',
+                 'mergebursts',
+                 'filter',
+                 'unwrap',
+                 'unwrap2stage',
+                 'geocode',
+                 'denseoffsets',
+                 'filteroffsets',
+                 'geocodeoffsets']
+
+
+def get_path_signature(path: str):
+    """
+    Return a cheap signature of a path: the size of a file, 'dir' for a
+    directory and None if the path does not exist.
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    if os.path.isdir(path):
+        return 'dir'
+    return None
+
+
+def fingerprint(params: dict = None, input_files: list = ()) -> str:
+    """
+    Parameters
+    ----------
+    params : dict
+        Json serializable parameters the stage depends on.
+    input_files : list
+        Paths the stage reads. Only the names and sizes are used so that
+        large inputs (e.g. SLC zips) are not read.
+
+    Returns
+    -------
+    str
+        sha1 hex digest of the parameters and input file signatures
+    """
+    files = {str(path): get_path_signature(str(path))
+             for path in input_files}
+    payload = json.dumps({'params': params, 'files': files},
+                         sort_keys=True,
+                         default=str)
+    return hashlib.sha1(payload.encode('utf8')).hexdigest()
+
+
+def get_topsapp_resume_step(first_step: str,
+                            last_step: str,
+                            pickle_dir: str = TOPSAPP_PICKLE_DIR) -> str:
+    """
+    Return the first step between `first_step` and `last_step` (inclusive)
+    that has not been completed according to the topsApp pickles. topsApp
+    writes `PICKLE/<step>` after each completed step and `--start=<step>`
+    loads the pickle of the step before.
+    """
+    i_first = TOPSAPP_STEPS.index(first_step)
+    i_last = TOPSAPP_STEPS.index(last_step)
+    for step in TOPSAPP_STEPS[i_first: i_last + 1]:
+        if not os.path.exists(os.path.join(pickle_dir, step)):
+            return step
+    # Every step has a pickle; rerunning the last one is cheapest
+    return last_step
+
+
+class StageTracker(object):
+    """
+    Records completion markers and input fingerprints of the PGE stages.
+
+    Stages are run in a fixed order. Once a stage has to be (re)run, every
+    later stage is rerun too because its inputs may have been regenerated.
+    Stages may be run from several threads. Background stages, run
+    concurrently with the others, only depend on their own fingerprint:
+    they neither invalidate nor are invalidated by the other stages.
+    """
+
+    def __init__(self,
+                 state_file: str = STATE_FILE,
+                 enabled: bool = True,
+                 telemetry=None):
+        # Other stages may change the work directory
+        self.state_file = os.path.abspath(state_file)
+        self.enabled = enabled
+        # Optional `StageTelemetry` measuring each stage that is run
+        self.telemetry = telemetry
+        self._state = self._load() if enabled else {}
+        self._visited = []
+        self._invalidated = not enabled
+        self._lock = threading.RLock()
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (OSError, ValueError) as err:
+            logger.warning(f'Ignoring unreadable {self.state_file}: {err}')
+            return {}
+
+    def _save(self):
+        if not self.enabled:
+            return
+        tmp_file = f'{self.state_file}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self._state, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, self.state_file)
+
+    def is_done(self, name: str, stage_fingerprint: str,
+                background: bool = False) -> bool:
+        """
+        True if the stage completed in a previous attempt with the same
+        input fingerprint and its recorded outputs are still on disk.
+        """
+        record = self._state.get(name)
+        if (self._invalidated and not background) or record is None:
+            return False
+        if record.get('status') != 'done':
+            return False
+        if record.get('fingerprint') != stage_fingerprint:
+            logger.info(f'Inputs of stage {name} changed since last attempt')
+            return False
+        changed = [path for path, signature in record.get('files', {}).items()
+                   if get_path_signature(path) != signature]
+        if changed:
+            logger.info(f'Outputs of stage {name} changed or missing: '
+                        f'{changed}')
+            return False
+        return True
+
+    def begin(self, name: str, stage_fingerprint: str,
+              background: bool = False) -> bool:
+        """
+        Mark the stage as running and, unless it is a background stage,
+        invalidate all later stages.
+
+        Returns
+        -------
+        bool
+            True if a previous attempt of this stage with identical inputs
+            was interrupted, i.e. the stage may resume from partial outputs.
+        """
+        record = self._state.get(name, {})
+        resumable = ((background or not self._invalidated) and
+                     record.get('status') == 'running' and
+                     record.get('fingerprint') == stage_fingerprint)
+        if not background:
+            self._invalidated = True
+            # Stages not yet visited are downstream of this one
+            for stale in [key for key in self._state
+                          if key not in self._visited and key != name and
+                          not self._state[key].get('background')]:
+                del self._state[stale]
+        self._visited.append(name)
+        self._state[name] = {'status': 'running',
+                             'fingerprint': stage_fingerprint,
+                             'started': datetime.utcnow().isoformat()}
+        if background:
+            self._state[name]['background'] = True
+        self._save()
+        return resumable
+
+    def mark_done(self,
+                  name: str,
+                  outputs: dict = None,
+                  output_files: list = ()):
+        with self._lock:
+            record = self._state[name]
+            record['status'] = 'done'
+            record['completed'] = datetime.utcnow().isoformat()
+            record['outputs'] = outputs or {}
+            record['files'] = {str(path): get_path_signature(str(path))
+                               for path in output_files}
+            self._save()
+
+    def run(self,
+            name: str,
+            func,
+            *args,
+            params: dict = None,
+            input_files: list = (),
+            output_files=None,
+            resumable: bool = False,
+            background: bool = False,
+            **kwargs) -> dict:
+        """
+        Run `func(*args, **kwargs)` as stage `name` unless it is already
+        complete.
+
+        Parameters
+        ----------
+        params, input_files :
+            Used to compute the input fingerprint (see `fingerprint`).
+        output_files : list or callable
+            Paths to verify before a stage is skipped. If callable, it is
+            called with the outputs dictionary returned by `func`.
+        resumable : bool
+            If True, `func` receives a `resume` keyword indicating that an
+            interrupted attempt of this stage can be continued.
+        background : bool
+            True for a stage run concurrently with the others; it is
+            excluded from the invalidation of later stages.
+
+        Returns
+        -------
+        dict
+            The json serializable outputs of the stage, either returned by
+            `func` or recorded from the previous attempt.
+        """
+        stage_fingerprint = fingerprint(params, input_files)
+        with self._lock:
+            if self.is_done(name, stage_fingerprint, background):
+                logger.info(f'Stage {name} completed in a previous attempt; '
+                            'skipping')
+                self._visited.append(name)
+                return self._state[name]['outputs']
+
+            resume = self.begin(name, stage_fingerprint, background)
+        logger.info(f'Running stage {name}'
+                    f'{" (resuming)" if resume else ""}')
+        if resumable:
+            kwargs['resume'] = resume
+        measure = (self.telemetry.measure(name) if self.telemetry
+                   else nullcontext())
+        with measure:
+            outputs = func(*args, **kwargs) or {}
+
+        if callable(output_files):
+            output_files = output_files(outputs)
+        self.mark_done(name, outputs, output_files or [])
+        return outputs
@@ -11,17 +11,14 @@ import logging
 import traceback
 from collections import OrderedDict
 import os
-from netCDF4 import Dataset
 import numpy as np
-import isce
-import osgeo
-from osgeo import gdal
-from osgeo import osr
 import collections
 import pdb
 
+# netCDF4 and GDAL are imported where they are used; ISCE is imported by the
+# isce_functions called through python_execution
+
 log_format = "[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s"
-logging.basicConfig(format=log_format, level=logging.INFO)
 logger = logging.getLogger('standard_product_packaging')
 
 BASE_PATH = os.path.dirname(__file__)
@@ -388,6 +385,7 @@ def create_dataset(fid,dataset,fid_parent=None):
                 crs_attribute_value = extract_key(crs_attribute,"value")
                 if crs_attribute_name.lower() == "spatial_ref":
                     if isinstance(crs_attribute_value,int):
+                        from osgeo import osr
                         ref = osr.SpatialReference()
                         ref.ImportFromEPSG(crs_attribute_value)
                         projectionRef = ref.ExportToWkt()
@@ -480,6 +478,7 @@ def data_loading(filename,out_data_type=None,data_band=None):
         out_data_res: the resolution of the output data, default is original
         data_band: the band that needs to be loaded, default is all
     """
+    from osgeo import gdal
 
     # converting to the absolute path
     filename = os.path.abspath(filename)
@@ -557,6 +556,8 @@ if __name__ == '__main__':
     '''
         Main driver.
     '''
+    logging.basicConfig(format=log_format, level=logging.INFO)
+    from netCDF4 import Dataset
 
     # get config json file
     cwd = os.getcwd()
@@ -4,20 +4,12 @@ from builtins import range
 from past.utils import old_div
 import ast, os, sys, json, re, math, logging, traceback, pickle, hashlib
 from lxml.etree import parse
-from osgeo import gdal, ogr, osr
 import numpy as np
-import isce
-from iscesys.Component.ProductManager import ProductManager as PM
-from isceobj.Orbit.Orbit import Orbit
 
 from topsApp_utils.time_utils import getTemporalSpanInDays
 
 
-gdal.UseExceptions() # make GDAL raise python exceptions
-
-
 log_format = "[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s"
-logging.basicConfig(format=log_format, level=logging.INFO)
 logger = logging.getLogger('update_met_json')
 
 
@@ -26,6 +18,8 @@ MISSION_RE = re.compile(r'^S1(\w)$')
 
 def get_raster_corner_coords(vrt_file):
     """Return raster corner coordinates."""
+    from osgeo import gdal
+    gdal.UseExceptions() # make GDAL raise python exceptions
 
     # go to directory where vrt exists to extract from image
     cwd =os.getcwd()
@@ -52,6 +46,8 @@ def get_raster_corner_coords(vrt_file):
 
 def load_product(int_file):
     """Load product from fine interferogram xml file."""
+    import isce
+    from iscesys.Component.ProductManager import ProductManager as PM
 
     pm = PM()
     pm.configure()
@@ -61,6 +57,8 @@ def load_product(int_file):
 
 def get_orbit():
     """Return orbit object."""
+    import isce
+    from isceobj.Orbit.Orbit import Orbit
 
     orb = Orbit()
     orb.configure()
@@ -145,6 +143,7 @@ def get_env_box(env):
 
 
 def get_union_geom(bbox_list):
+    from osgeo import ogr
     geom_union = None
     for bbox in bbox_list:
         loc = get_loc(bbox)
@@ -309,6 +308,7 @@ def update_met_json(orbit_type, scene_count, swath_num, master_mission,
 
 
 if __name__ == "__main__":
+    logging.basicConfig(format=log_format, level=logging.INFO)
     print("update met arg count : %s" %len(sys.argv))
     if len(sys.argv) != 14:
         raise SystemExit("usage: %s <orbit type used> <scene count> <swath num> <master_mission> <slave_mission> <pickle dir> <fine int file> <vrt file> <unw.geo.xml file> <output json file> <sensing start> <sensing stop> <archive filename>" % sys.argv[0])
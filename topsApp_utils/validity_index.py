@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Persistent index of the orbit (EOF) and AUX_CAL files of a directory.
+
+The mission, type and validity interval of each file are parsed once from
+its name and kept in `.validity_index/orbit.json` or
+`.validity_index/aux_cal.json` in the directory, so that writing the index
+does not change the mtime of the directory. The index is updated
+incrementally when the directory changes (its mtime): only new names are
+parsed and removed files are dropped. The intervals are kept sorted by
+start time per mission and type, so the file covering a time is found by
+bisection instead of globbing and parsing the whole directory on every
+lookup. Usage:
+
+    validity_index.py orbit /path/to/orbits 2020-01-01T00:00:00 --mission S1A
+"""
+import os
+import sys
+import json
+import bisect
+import logging
+import argparse
+import datetime
+import threading
+
+logger = logging.getLogger('validity_index')
+
+# Changing the name parsing invalidates the existing indexes
+INDEX_VERSION = 1
+
+INDEX_DIR = '.validity_index'
+
+DATE_FORMAT = '%Y%m%dT%H%M%S'
+EPOCH = datetime.datetime(1970, 1, 1)
+
+ORBIT = 'orbit'
+AUX_CAL = 'aux_cal'
+# Orbit types in order of preference
+ORBIT_TYPES = ['POEORB', 'RESORB']
+ORBIT_SUFFIX = '.EOF'
+# e.g. S1A OPER AUX POEORB OPOD <creation> V<start> <stop>.EOF
+ORBIT_FIELDS = 8
+
+
+def to_seconds(time: datetime.datetime) -> float:
+    return (time - EPOCH).total_seconds()
+
+
+def parse_orbit_name(name: str):
+    """
+    (mission, orbit type, start, stop) of an orbit file name, e.g.
+    S1A_OPER_AUX_POEORB_OPOD_20200121T120654_V20191231T225942_20200102T005942.EOF,
+    or None if it is not one.
+    """
+    if not name.startswith('S1') or not name.endswith(ORBIT_SUFFIX):
+        return None
+    fields = name.split('_')
+    if len(fields) != ORBIT_FIELDS or fields[3] not in ORBIT_TYPES:
+        return None
+    orbit_type = fields[3]
+    try:
+        start = datetime.datetime.strptime(fields[-2][1:16], DATE_FORMAT)
+        stop = datetime.datetime.strptime(fields[-1][0:15], DATE_FORMAT)
+    except ValueError:
+        return None
+    return fields[0], orbit_type, to_seconds(start), to_seconds(stop)
+
+
+def parse_aux_cal_name(name: str):
+    """
+    (mission, 'AUX_CAL', start, stop) of an AUX_CAL product name, e.g.
+    S1A_AUX_CAL_V20190228T092500_G20190227T100643.SAFE, or None if it is not
+    one. As in Sentinel1_TOPS.findAuxFile, the interval runs from the
+    validity (V) to the generation (G) time.
+    """
+    if not name.startswith('S1') or '_AUX_CAL_' not in name:
+        return None
+    fields = name.split('_')
+    try:
+        start = datetime.datetime.strptime(fields[-2][1:16], DATE_FORMAT)
+        stop = datetime.datetime.strptime(fields[-1][1:16], DATE_FORMAT)
+    except ValueError:
+        return None
+    return fields[0], 'AUX_CAL', to_seconds(start), to_seconds(stop)
+
+
+PARSERS = {ORBIT: parse_orbit_name,
+           AUX_CAL: parse_aux_cal_name}
+
+
+class ValidityIndex(object):
+    """
+    Validity intervals of the orbit or AUX_CAL files of `directory`, with
+    `kind` 'orbit' or 'aux_cal'.
+    """
+
+    def __init__(self, directory: str, kind: str):
+        self.directory = os.path.abspath(directory)
+        self.kind = kind
+        self.parse_name = PARSERS[kind]
+        self.index_file = os.path.join(self.directory, INDEX_DIR,
+                                       f'{kind}.json')
+        self.mtime_ns = None
+        # name -> (mission, type, start, stop) or None if not a product
+        self.entries = {}
+        # (mission, type) -> sorted starts and the (start, stop, name)
+        self.starts = {}
+        self.intervals = {}
+        self.max_duration = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_file) as f:
+                data = json.load(f)
+            if data['version'] == INDEX_VERSION:
+                self.mtime_ns = data['mtime_ns']
+                self.entries = {name: tuple(entry) if entry else None
+                                for name, entry in data['entries'].items()}
+        except (OSError, ValueError, KeyError):
+            pass
+        self._sort()
+
+    def _make_index_dir(self):
+        # Created before the directory mtime is taken, as it changes it
+        try:
+            os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+        except OSError as err:
+            logger.debug(f'Could not create the index directory: {err}')
+
+    def _save(self):
+        data = {'version': INDEX_VERSION,
+                'mtime_ns': self.mtime_ns,
+                'entries': self.entries}
+        tmp_file = f'{self.index_file}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_file, self.index_file)
+        except OSError as err:
+            # e.g. a read-only directory; the index is kept in memory
+            logger.debug(f'Could not write {self.index_file}: {err}')
+            if os.path.exists(tmp_file):
+                os.unlink(tmp_file)
+
+    def _sort(self):
+        groups = {}
+        for name, entry in self.entries.items():
+            if entry is not None:
+                mission, file_type, start, stop = entry
+                groups.setdefault((mission, file_type), []).append(
+                    (start, stop, name))
+        self.intervals = {key: sorted(group) for key, group in groups.items()}
+        self.starts = {key: [start for start, _, _ in group]
+                       for key, group in self.intervals.items()}
+        self.max_duration = {key: max(stop - start
+                                      for start, stop, _ in group)
+                             for key, group in self.intervals.items()}
+
+    def refresh(self):
+        """
+        Rescan the directory if it changed since the index was built. Only
+        the names are listed: the new ones are parsed, the others reused.
+        """
+        with self._lock:
+            self._make_index_dir()
+            mtime_ns = os.stat(self.directory).st_mtime_ns
+            if mtime_ns == self.mtime_ns:
+                return
+            # Changes after the stat are found by the next refresh
+            names = set(os.listdir(self.directory))
+            names.discard(INDEX_DIR)
+            added = [name for name in names if name not in self.entries]
+            removed = [name for name in self.entries if name not in names]
+            for name in added:
+                self.entries[name] = self.parse_name(name)
+            for name in removed:
+                del self.entries[name]
+            if added or removed:
+                logger.info(f'{self.kind} index of {self.directory}: '
+                            f'{len(added)} added, {len(removed)} removed')
+                self._sort()
+            self.mtime_ns = mtime_ns
+            self._save()
+
+    def find(self, time: datetime.datetime, mission: str = None,
+             file_type: str = None):
+        """
+        Path of the file of `mission` (e.g. 'S1A', any if not specified) and
+        `file_type` (e.g. 'POEORB', any if not specified) whose validity
+        interval contains `time` and whose middle is closest to it, or None.
+        """
+        self.refresh()
+        t = to_seconds(time)
+        best = None
+        for key, intervals in self.intervals.items():
+            if (mission is not None and key[0] != mission) or \
+                    (file_type is not None and key[1] != file_type):
+                continue
+            # Intervals starting after `time` or ending before the longest
+            # interval could reach it cannot contain it
+            last = bisect.bisect_right(self.starts[key], t)
+            first = bisect.bisect_left(self.starts[key],
+                                       t - self.max_duration[key])
+            for start, stop, name in intervals[first:last]:
+                if stop >= t:
+                    distance = abs(t - 0.5 * (start + stop))
+                    if best is None or distance < best[0]:
+                        best = (distance, name)
+        if best is None:
+            return None
+        return os.path.join(self.directory, best[1])
+
+
+# Indexes of the directories used by the process
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(directory: str, kind: str) -> ValidityIndex:
+    """The index of `directory`, loaded once per process."""
+    key = (os.path.abspath(directory), kind)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = ValidityIndex(directory, kind)
+        return _indexes[key]
+
+
+def main():
+    formatter = argparse.RawDescriptionHelpFormatter
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=formatter)
+    parser.add_argument('kind', choices=[ORBIT, AUX_CAL])
+    parser.add_argument('directory')
+    parser.add_argument('time', type=datetime.datetime.fromisoformat)
+    parser.add_argument('-m', '--mission', default=None)
+    parser.add_argument('-t', '--type', dest='file_type', default=None)
+    args = parser.parse_args()
+    path = get_index(args.directory, args.kind).find(
+        args.time, mission=args.mission, file_type=args.file_type)
+    if path is None:
+        logger.error(f'No {args.kind} file covers {args.time}')
+        return 1
+    print(path)
+    return 0
+
+
+if __name__ == '__main__':
+    log_format = '[%(asctime)s: %(levelname)s/%(funcName)s] %(message)s'
+    logging.basicConfig(format=log_format, level=logging.INFO)
+    sys.exit(main())
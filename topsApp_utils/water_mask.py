@@ -0,0 +1,178 @@
+"""
+Water mask sampled directly on the grid of the geocoded product.
+
+The SRTM water body (SWBD) tiles covering the product are fetched once,
+through the node-local tile cache if it is enabled (see dem_tile_cache.py),
+and each tile is read once from its zip file and sampled (nearest neighbor)
+onto the product pixels it covers. Areas without a tile (the SWBD server has
+no tiles over the ocean) are water. This replaces stitching the tiles at
+full resolution with wbdStitcher.py, downsampling the stitched mask and
+cropping it to the product.
+
+As in the stitched SWBD mask, the mask is a byte image in which water is -1
+and land is 0.
+"""
+import os
+import math
+import logging
+import zipfile
+import numpy as np
+
+logger = logging.getLogger('water_mask')
+
+# SWBD tiles are 1x1 degree of 3601 x 3601 bytes (255 is water) sharing
+# their edges with the neighboring tiles
+TILE_SAMPLES = 3601
+TILE_EXTENSION = '.SRTMSWBD.raw'
+
+WATER = -1
+
+
+def get_tile_name(lat: int, lon: int) -> str:
+    """Name of the SWBD tile zip with south west corner `lat`, `lon`."""
+    ns = 'N' if lat >= 0 else 'S'
+    ew = 'E' if lon >= 0 else 'W'
+    return f'{ns}{abs(lat):02d}{ew}{abs(lon):03d}{TILE_EXTENSION}.zip'
+
+
+def get_tile_corners(bbox: list) -> list:
+    """South west corners of the tiles covering `bbox` (S, N, W, E)."""
+    south, north, west, east = bbox
+    return [(lat, lon)
+            for lat in range(int(math.floor(south)), int(math.ceil(north)))
+            for lon in range(int(math.floor(west)), int(math.ceil(east)))]
+
+
+def fetch_tiles(bbox: list,
+                url_base: str,
+                out_dir: str = 'wbd_tiles',
+                username: str = None,
+                password: str = None) -> list:
+    """
+    Download the SWBD tiles covering `bbox`, or link them from the tile
+    cache.
+
+    Returns
+    -------
+    list
+        Paths of the tiles; tiles missing on the server are skipped
+    """
+    from topsApp_utils.dem_tile_cache import TileCache, TileNotFound, download
+
+    os.makedirs(out_dir, exist_ok=True)
+    cache = TileCache.from_env()
+    tile_files = []
+    for lat, lon in get_tile_corners(bbox):
+        name = get_tile_name(lat, lon)
+        url = url_base.rstrip('/') + '/' + name
+        tile_file = os.path.join(out_dir, name)
+        if not os.path.exists(tile_file):
+            try:
+                if cache is not None:
+                    cache.copy_to(url, tile_file, username, password)
+                else:
+                    download(url, tile_file, username, password)
+            except TileNotFound:
+                logger.info(f'No water body tile {name}; assuming water')
+                continue
+        tile_files.append(tile_file)
+    logger.info(f'Fetched {len(tile_files)} water body tiles')
+    return tile_files
+
+
+def read_tile(tile_file: str):
+    """Water body tile (int8, -1 is water) of a zip file."""
+    with zipfile.ZipFile(tile_file) as z:
+        name = [n for n in z.namelist() if n.endswith('.raw')][0]
+        data = z.read(name)
+    return np.frombuffer(data, dtype=np.int8).reshape(TILE_SAMPLES,
+                                                      TILE_SAMPLES)
+
+
+def get_tile_corner(tile_file: str) -> tuple:
+    """(lat, lon) of the south west corner from the name of a tile."""
+    name = os.path.basename(tile_file)
+    lat = int(name[1:3]) * (1 if name[0] == 'N' else -1)
+    lon = int(name[4:7]) * (1 if name[3] == 'E' else -1)
+    return lat, lon
+
+
+def get_grid_indices(start: float, delta: float, size: int,
+                     tile_start: int, reverse: bool = False) -> tuple:
+    """
+    Pixels of a grid axis whose centers fall in the 1 degree tile starting
+    at `tile_start` and their indices in the tile. `start` is the outer edge
+    of the first pixel, as in the ISCE xml of the geocoded products.
+
+    Returns
+    -------
+    tuple
+        Slice of the grid pixels and the tile indices of those pixels
+    """
+    coords = start + delta * (np.arange(size) + 0.5)
+    inside = np.nonzero((coords >= tile_start) &
+                        (coords < tile_start + 1))[0]
+    if inside.size == 0:
+        return slice(0, 0), inside
+    coords = coords[inside]
+    if reverse:
+        # Tile rows run from north to south
+        offsets = tile_start + 1 - coords
+    else:
+        offsets = coords - tile_start
+    indices = np.clip(np.rint(offsets * (TILE_SAMPLES - 1)).astype(int),
+                      0, TILE_SAMPLES - 1)
+    return slice(inside[0], inside[-1] + 1), indices
+
+
+def make_water_mask(tile_files: list, grid: dict, out_file: str):
+    """
+    Parameters
+    ----------
+    tile_files : list
+        SWBD tile zips from `fetch_tiles`
+    grid : dict
+        Product grid as returned by imutils.get_size
+    out_file : str
+        Water mask written with its ISCE xml
+
+    Returns
+    -------
+    numpy.ndarray
+        The water mask
+    """
+    lat, lon = grid['lat'], grid['lon']
+    mask = np.full((lat['size'], lon['size']), WATER, dtype=np.int8)
+    for tile_file in tile_files:
+        tile_lat, tile_lon = get_tile_corner(tile_file)
+        rows, tile_rows = get_grid_indices(lat['val'], lat['delta'],
+                                           lat['size'], tile_lat,
+                                           reverse=True)
+        cols, tile_cols = get_grid_indices(lon['val'], lon['delta'],
+                                           lon['size'], tile_lon)
+        if tile_rows.size == 0 or tile_cols.size == 0:
+            continue
+        tile = read_tile(tile_file)
+        mask[rows, cols] = tile[np.ix_(tile_rows, tile_cols)]
+    mask.tofile(out_file)
+    write_mask_xml(out_file, grid)
+    logger.info(f'Water mask {out_file}: {mask.shape}, '
+                f'{np.count_nonzero(mask == WATER)} water pixels')
+    return mask
+
+
+def write_mask_xml(mask_file: str, grid: dict):
+    import isce
+    import isceobj
+
+    lat, lon = grid['lat'], grid['lon']
+    image = isceobj.createImage()
+    image.initImage(mask_file, 'read', lon['size'], 'BYTE')
+    image.init({'Coordinate1': {'size': lon['size'],
+                                'startingValue': lon['val'],
+                                'delta': lon['delta']},
+                'Coordinate2': {'size': lat['size'],
+                                'startingValue': lat['val'],
+                                'delta': lat['delta']},
+                'FILE_NAME': mask_file})
+    image.renderHdr()